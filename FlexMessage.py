@@ -318,8 +318,26 @@ def recommend(
 
 
 
-def Carousel_contents(file_path, uid):
-    rows = list(csv.reader(open(file_path, encoding="utf-8-sig")))[1:11]
+def Carousel_contents(source, uid):
+    """
+    source 為 googlemap_search_nearby 回傳的結果 list（每筆 dict）時直接組成前 10 張卡片；
+    為 CSV 路徑時沿用舊格式逐列讀取。
+    """
+    if not isinstance(source, str):
+        return [
+            recommend(
+                name=h['name'],
+                rating=h['rating'],
+                img_url=h['img_url'],
+                location=h['location'],
+                place_id=h['place_id'],
+                google_price_level=h.get('price_level'),
+                uid=uid
+            )
+            for h in list(source)[:10]
+        ]
+
+    rows = list(csv.reader(open(source, encoding="utf-8-sig")))[1:11]
     bubbles = []
     for row in rows:
         name, _, rating, img, loc, pid, *rest = row
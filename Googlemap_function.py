@@ -1,34 +1,84 @@
 # Googlemap_function.py
 
-import googlemaps
 from time import sleep
+import json
+import threading
+import time
 import urllib.parse
 import pandas as pd
 import csv
 import os
 from dotenv import load_dotenv
 load_dotenv()   # 這行會去根目錄找 .env，並把變數載入 os.environ
-from config import RECOMMEND_CSV, HOTEL_DATA_CSV
+from concurrent.futures import ThreadPoolExecutor, wait
+from config import (
+    HOTEL_DATA_CSV, NEARBY_RESULT_LOG,
+    NEARBY_DETAILS_LIMIT, NEARBY_DETAILS_CONCURRENCY, NEARBY_DETAILS_DEADLINE,
+)
+import geo_distance
+import maps_gateway
+import nearby_cache
 
-# 透過環境變數獲取 Google Maps API 金鑰
+# 透過環境變數獲取 Google Maps API 金鑰（照片 URL 用）；API 呼叫一律經 maps_gateway
 api_key  = os.getenv("GOOGLE_MAPS_API_KEY")
-gmaps = googlemaps.Client(key=api_key)
+gmaps = maps_gateway.client()
 
-def googlemap_search_nearby(lat, lng, keyword):
+def _rank_nearby(results, lat, lng, sort_by):
     """
-    搜尋指定經緯度 2 公里內的指定類別地點（例如餐廳、景點），並將結果存入 CSV。
+    依 sort_by 排序 Nearby Search 的原始結果（rating 由高到低 / 本地 haversine 由近到遠），
+    distance 模式會在每筆加上 distance_km。
+    """
+    if sort_by == "distance" and results:
+        dist = geo_distance.haversine_km(
+            lat, lng,
+            [r['geometry']['location']['lat'] for r in results],
+            [r['geometry']['location']['lng'] for r in results],
+        )
+        for r, d in zip(results, dist):
+            r['distance_km'] = round(float(d), 3)
+        return sorted(results, key=lambda r: r['distance_km'])
+    return sorted(results, key=lambda r: float(r.get('rating', 0)), reverse=True)
+
+def _fetch_details(place_ids, deadline=NEARBY_DETAILS_DEADLINE, language="zh-TW"):
+    """
+    以有界執行緒池併發抓 Place Details，最多等 deadline 秒；
+    回傳 {place_id: result}，只包含時間內成功回來的。
+    """
+    if not place_ids:
+        return {}
+    pool = ThreadPoolExecutor(max_workers=min(NEARBY_DETAILS_CONCURRENCY, len(place_ids)))
+    futures = {pool.submit(gmaps.place, place_id=pid, language=language): pid for pid in place_ids}
+    done, not_done = wait(futures, timeout=deadline)
+    pool.shutdown(wait=False, cancel_futures=True)
+    if not_done:
+        print(f"place details: {len(not_done)}/{len(futures)} 筆超過 {deadline}s，略過")
+
+    details = {}
+    for fut in done:
+        try:
+            details[futures[fut]] = fut.result()['result']
+        except Exception as e:
+            print(f"place details {futures[fut]} error: {e}")
+    return details
+
+def _search_nearby(lat, lng, keyword, sort_by, language):
+    """
+    實際呼叫 Places API：Nearby Search → 排序 → 前 NEARBY_DETAILS_LIMIT 筆併發抓 Details。
+    回傳 (search_list, 原始結果數, Details 是否全部到齊)。
     """
     loc = {'lat': lat, 'lng': lng}
     rad = 2000
     results = gmaps.places_nearby(keyword=keyword, radius=rad, location=loc)['results']
-    
-    placeID_list = [place['place_id'] for place in results]
-    hotel_info = [gmaps.place(place_id=pid, language="zh-TW")['result'] for pid in placeID_list]
-    sleep(0.1)
-        
+
+    top = _rank_nearby(results, lat, lng, sort_by)[:NEARBY_DETAILS_LIMIT]
+    details = _fetch_details([r['place_id'] for r in top], language=language)
+
     search_list = []
     maxwidth = 800
-    for h in hotel_info:
+    for r in top:
+        h = details.get(r['place_id'])
+        if h is None:
+            continue
         name = h['name'][:40] if len(h['name']) >= 50 else h['name']
         
         # Google Maps 圖片 URL
@@ -59,26 +109,66 @@ def googlemap_search_nearby(lat, lng, keyword):
             'location': h['geometry']['location'],
             'map_url': map_url
         }
+        if 'distance_km' in r:
+            dic['distance_km'] = r['distance_km']
         search_list.append(dic)
 
-    # 寫入 CSV
-    with open(RECOMMEND_CSV, 'w+', newline='', encoding='utf-8-sig') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(['name', 'price_level', 'rating', 'img_url', 'location', 'place_id', 'map_url'])
+    if sort_by != "distance":
         search_list = sorted(search_list, key=lambda row: float(row["rating"]), reverse=True)
-        for h in search_list:
-            writer.writerow([
-                h['name'],
-                h['price_level'],
-                h['rating'],
-                h['img_url'],
-                h['location'],
-                h['place_id'],
-                h['map_url']
-            ])
-    print("寫入檔案完成:", RECOMMEND_CSV)
-
-    return search_list, len(results)
+    return search_list, len(results), len(search_list) == len(top)
+
+_log_lock = threading.Lock()
+
+def _append_result_log(lat, lng, keyword, sort_by, language, search_list):
+    """把一次搜尋結果追加到 NEARBY_RESULT_LOG（JSONL，只記 geohash 格子不記精確座標）"""
+    record = {
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "tile": geo_distance.geohash(lat, lng),
+        "keyword": keyword,
+        "sort_by": sort_by,
+        "language": language,
+        "results": [{"name": h["name"], "place_id": h["place_id"], "rating": h["rating"]}
+                    for h in search_list],
+    }
+    try:
+        with _log_lock, open(NEARBY_RESULT_LOG, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"nearby result log error: {e}")
+
+def googlemap_search_nearby(lat, lng, keyword, sort_by="rating", language="zh-TW"):
+    """
+    搜尋指定經緯度 2 公里內的指定類別地點（例如餐廳、景點），回傳 (結果 list, 原始結果數)，
+    由呼叫端直接交給 FlexMessage.Carousel_contents，不再經過共用的 recommend.csv。
+    sort_by="rating" 依評分由高到低；"distance" 依本地 haversine 距離由近到遠（不呼叫 Distance Matrix）。
+    只對排序後前 NEARBY_DETAILS_LIMIT 筆併發抓 Place Details，逾時未回來的不顯示。
+
+    結果先查 nearby_cache（geohash 格子 × 關鍵字 × 語言 × 排序）；Details 全部到齊的結果才寫入快取。
+    distance 模式命中時依這位使用者的座標重算距離再排序。
+    """
+    cached = nearby_cache.get(lat, lng, keyword, language, sort_by)
+    if cached is not None:
+        items, total = cached
+        search_list = [dict(h) for h in items]
+        if sort_by == "distance" and search_list:
+            dist = geo_distance.haversine_km(
+                lat, lng,
+                [h['location']['lat'] for h in search_list],
+                [h['location']['lng'] for h in search_list],
+            )
+            for h, d in zip(search_list, dist):
+                h['distance_km'] = round(float(d), 3)
+            search_list.sort(key=lambda row: row['distance_km'])
+    else:
+        search_list, total, complete = _search_nearby(lat, lng, keyword, sort_by, language)
+        if complete:
+            nearby_cache.put(lat, lng, keyword, language, sort_by, (search_list, total))
+            search_list = [dict(h) for h in search_list]
+
+    if NEARBY_RESULT_LOG:
+        _append_result_log(lat, lng, keyword, sort_by, language, search_list)
+
+    return search_list, total
 
 def googlemap_search_hotel(lat, lng):
     """
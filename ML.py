@@ -4,9 +4,11 @@ import numpy as np
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import LabelEncoder, OneHotEncoder
 
+import inference_batcher
+import recommend_lookup
+import plan_index
 from config import (
     PENGHU_ORIGINAL_CSV,
-    GENERATED_DATA_CSV,
 )
 
 def XGboost_recommend1(arr, gender, age):
@@ -78,49 +80,36 @@ def XGboost_recommend2(arr, gender, age, tidal, temperature):
     return result[0]
 
 def XGboost_recommend3(arr, gender, age, tidal, temperature, dont_go_here):
-    from sklearn.preprocessing import LabelEncoder, OneHotEncoder
-
-    tree_deep = 100
-    learning_rate = 0.3
-
-    Data = pd.read_csv(GENERATED_DATA_CSV, encoding='utf-8-sig')
-    df_data = pd.DataFrame(
-        data=np.c_[Data['weather'], Data['gender'], Data['age'], Data['tidal'], Data['temperature'], Data['設置點']],
-        columns=['weather', 'gender', 'age', 'tidal', 'temperature', 'label']
-    )
-    df_data = df_data[~df_data['label'].isin(dont_go_here)]
-    for col in ['gender', 'age', 'tidal', 'temperature']:
-        df_data[col] = pd.to_numeric(df_data[col], errors='coerce').fillna(0)
-
-    labelencoder = LabelEncoder()
-    df_data['weather'] = labelencoder.fit_transform(df_data['weather'])
-    X = df_data.drop(labels=['label'], axis=1).values
-    onehotencoder = OneHotEncoder(handle_unknown='ignore', sparse_output=False)
-    X = onehotencoder.fit_transform(X)
-    Y = df_data['label'].values
-    le = LabelEncoder()
-    Y = le.fit_transform(Y)
-
-    X_train, X_test, Y_train, Y_test = train_test_split(
-        X, Y, test_size=0.3, random_state=42
-    )
-
-    arr_labelencode = labelencoder.transform(arr)
-    Value_arr = np.array([
-        float(arr_labelencode[0]), float(gender),
-        float(age), float(tidal), float(temperature)
-    ], dtype=np.float64)
-    final = onehotencoder.transform(Value_arr.reshape(1, -1))
-
-    xgboostModel = XGBClassifier(n_estimators=tree_deep, learning_rate=learning_rate)
-    xgboostModel.fit(X_train, Y_train)
-    xgboostModel.save_model('PHtest.bin')
-
-    predicted = xgboostModel.predict(final)
-    result = le.inverse_transform(predicted)
-    return result[0]
+    """
+    以 recommend3 模型推薦景點，遮罩 dont_go_here 中的地點後取機率最高者。
+    特徵落在離線查表網格內時 O(1) 查表；否則經 inference_batcher 與同時段的
+    其他請求合併成一次 predict_proba。
+    weather 為未見過的標籤時拋出 ValueError。
+    """
+    row = [arr[0], float(gender), float(age), float(tidal), float(temperature)]
+    hit = recommend_lookup.rank("recommend3", row, exclude=dont_go_here, k=1)
+    if hit:
+        return hit[0]
+    return inference_batcher.best("recommend3", row, exclude=dont_go_here)
+
+def recommend3_top_k(arr, gender, age, tidal, temperature, dont_go_here, k=5):
+    """
+    同 XGboost_recommend3，但回傳排除 dont_go_here 後機率最高的前 k 個景點。
+    """
+    row = [arr[0], float(gender), float(age), float(tidal), float(temperature)]
+    hit = recommend_lookup.rank("recommend3", row, exclude=dont_go_here, k=k)
+    if hit:
+        return hit
+    return inference_batcher.rank("recommend3", row, exclude=dont_go_here, k=k)
 
 def XGboost_plan(plan_data, gender, age):
+    """
+    plan_data 為 plan CSV 路徑時查 plan_index 的 (gender, age) 族群索引；
+    傳入 DataFrame 則沿用即時訓練。
+    """
+    if isinstance(plan_data, str):
+        return plan_index.template_user(plan_data, gender, age)
+
     le = LabelEncoder()
     tree_deep = 100
     learning_rate = 0.3
@@ -1,119 +1,158 @@
 # model_trainer.py
 
+import os
 import pandas as pd
 import numpy as np
 from xgboost import XGBClassifier
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import LabelEncoder, OneHotEncoder
 
+import model_bundle
 from config import (
     PENGHU_ORIGINAL_CSV,
     GENERATED_DATA_CSV,
+    SUSTAINABLE_ATTR_CSV,
+    NON_SUSTAINABLE_ATTR_CSV,
+    SUSTAINABLE_NON_ATTR_CSV,
+    NON_SUSTAINABLE_NON_ATTR_CSV,
     XGB_MODEL1_PATH,
     XGB_MODEL2_PATH,
     PHTEST_MODEL_PATH,
+    SUSTAINABLE_MODEL_PATH,
+    NON_SUSTAINABLE_MODEL_PATH,
+    SUSTAINABLE_NON_MODEL_PATH,
+    NON_SUSTAINABLE_NON_MODEL_PATH,
 )
 
-def XGboost_recommend1():
+TREE_DEEP = 100
+LEARNING_RATE = 0.3
+
+FULL_FEATURES = ["weather", "gender", "age", "tidal", "temperature"]
+
+# 各模型的 (訓練資料, 特徵欄位, 舊版模型檔) —— 與 model_registry 共用
+MODEL_SPECS = {
+    "recommend1": (PENGHU_ORIGINAL_CSV, ["weather", "gender", "age"], XGB_MODEL1_PATH),
+    "recommend2": (PENGHU_ORIGINAL_CSV, FULL_FEATURES, XGB_MODEL2_PATH),
+    "recommend3": (GENERATED_DATA_CSV, FULL_FEATURES, PHTEST_MODEL_PATH),
+    "sustainable_attractions":         (SUSTAINABLE_ATTR_CSV,         FULL_FEATURES, SUSTAINABLE_MODEL_PATH),
+    "non_sustainable_attractions":     (NON_SUSTAINABLE_ATTR_CSV,     FULL_FEATURES, NON_SUSTAINABLE_MODEL_PATH),
+    "sustainable_non_attractions":     (SUSTAINABLE_NON_ATTR_CSV,     FULL_FEATURES, SUSTAINABLE_NON_MODEL_PATH),
+    "non_sustainable_non_attractions": (NON_SUSTAINABLE_NON_ATTR_CSV, FULL_FEATURES, NON_SUSTAINABLE_NON_MODEL_PATH),
+}
+
+# ---------------------------
+# 共用：讀資料 + 擬合編碼器
+# ---------------------------
+def load_training_frame(csv_path, feature_cols):
     """
-    訓練並儲存第一支 XGBoost 模型，使用原始 penghu_orignal2.csv 資料。
+    讀取訓練 CSV，回傳 feature_cols + label 的 DataFrame；
+    數值欄位統一轉成 float，無法轉換者補 0。
+    """
+    Data = pd.read_csv(csv_path, encoding='utf-8-sig')
+    df_data = pd.DataFrame({col: Data[col] for col in feature_cols})
+    df_data['label'] = Data['設置點']
+    for col in feature_cols:
+        if col != 'weather':
+            df_data[col] = pd.to_numeric(df_data[col], errors='coerce').fillna(0).astype(np.float64)
+    return df_data
+
+def fit_encoders(df_data, feature_cols):
+    """
+    擬合 weather LabelEncoder、OneHotEncoder 與目標 LabelEncoder。
+    目標編碼器只看切分後的訓練集，與模型訓練時的類別索引一致。
+    回傳 (labelencoder, onehot, le, X_train, Y_train)。
     """
-    le = LabelEncoder()
     labelencoder = LabelEncoder()
-    tree_deep = 100
-    learning_rate = 0.3
-
-    # 讀取原始資料
-    Data = pd.read_csv(PENGHU_ORIGINAL_CSV, encoding='utf-8-sig')
-    df_data = pd.DataFrame(
-        data=np.c_[Data['weather'], Data['gender'], Data['age'], Data['設置點']],
-        columns=['weather', 'gender', 'age', 'label']
-    )
-
-    # Label Encoding
+    df_data = df_data.copy()
     df_data['weather'] = labelencoder.fit_transform(df_data['weather'])
-    X = df_data.drop(labels=['label'], axis=1).values
+    X = df_data[feature_cols].values.astype(np.float64)
 
-    # One-Hot Encoding
     onehot = OneHotEncoder(handle_unknown='ignore', sparse_output=False)
     X = onehot.fit_transform(X)
     Y = df_data['label'].values
 
-    # 切分資料
     X_train, _, Y_train, _ = train_test_split(X, Y, test_size=0.3, random_state=42)
+    le = LabelEncoder()
     Y_train = le.fit_transform(Y_train)
+    return labelencoder, onehot, le, X_train, Y_train
 
-    # 訓練模型
-    model = XGBClassifier(n_estimators=tree_deep, learning_rate=learning_rate)
-    model.fit(X_train, Y_train)
+def _fit(name):
+    csv_path, feature_cols, _ = MODEL_SPECS[name]
+    df_data = load_training_frame(csv_path, feature_cols)
+    labelencoder, onehot, le, X_train, Y_train = fit_encoders(df_data, feature_cols)
 
-    # 儲存模型
-    model.save_model(XGB_MODEL1_PATH)
-    print(f"模型已儲存至 {XGB_MODEL1_PATH}")
+    model = XGBClassifier(n_estimators=TREE_DEEP, learning_rate=LEARNING_RATE)
+    model.fit(X_train, Y_train)
+    return model, labelencoder, onehot, le, X_train, Y_train
 
-def XGboost_recommend2():
+def train(name):
     """
-    訓練並儲存第二支 XGBoost 模型，使用原始 penghu_orignal2.csv 資料含 tidal、temperature 欄位。
+    依 MODEL_SPECS[name] 訓練模型，回傳 (model, labelencoder, onehot, le)，不寫檔。
     """
-    le = LabelEncoder()
-    labelencoder = LabelEncoder()
-    tree_deep = 100
-    learning_rate = 0.3
+    return _fit(name)[:4]
 
-    Data = pd.read_csv(PENGHU_ORIGINAL_CSV, encoding='utf-8-sig')
-    df_data = pd.DataFrame(
-        data=np.c_[Data['weather'], Data['gender'], Data['age'], Data['tidal'], Data['temperature'], Data['設置點']],
-        columns=['weather', 'gender', 'age', 'tidal', 'temperature', 'label']
+def _train_and_save(name, report_accuracy=False):
+    """
+    訓練後同時寫出舊版 .bin 與版本化 bundle（booster + 編碼器 + 資料 checksum）。
+    """
+    csv_path, feature_cols, model_path = MODEL_SPECS[name]
+    model, labelencoder, onehot, le, X_train, Y_train = _fit(name)
+    model.save_model(model_path)
+    print(f"模型已儲存至 {model_path}")
+    model_bundle.save_bundle(
+        name, model, feature_cols, labelencoder, onehot, le, csv_path,
+        params={"n_estimators": TREE_DEEP, "learning_rate": LEARNING_RATE},
     )
+    if report_accuracy:
+        print('訓練集Accuracy: %.2f%%' % (model.score(X_train, Y_train) * 100.0))
+    return model
 
-    df_data['weather'] = labelencoder.fit_transform(df_data['weather'])
-    X = df_data.drop(labels=['label'], axis=1).values
-
-    onehot = OneHotEncoder(handle_unknown='ignore', sparse_output=False)
-    X = onehot.fit_transform(X)
-    Y = df_data['label'].values
-
-    X_train, _, Y_train, _ = train_test_split(X, Y, test_size=0.3, random_state=42)
-    Y_train = le.fit_transform(Y_train)
+# ---------------------------
+# 個別模型
+# ---------------------------
+def XGboost_recommend1():
+    """
+    訓練並儲存第一支 XGBoost 模型，使用原始 penghu_orignal2.csv 資料。
+    """
+    _train_and_save("recommend1")
 
-    model = XGBClassifier(n_estimators=tree_deep, learning_rate=learning_rate)
-    model.fit(X_train, Y_train)
-    model.save_model(XGB_MODEL2_PATH)
-    print(f"模型已儲存至 {XGB_MODEL2_PATH}")
-    print('訓練集Accuracy: %.2f%%' % (model.score(X_train, Y_train) * 100.0))
+def XGboost_recommend2():
+    """
+    訓練並儲存第二支 XGBoost 模型，使用原始 penghu_orignal2.csv 資料含 tidal、temperature 欄位。
+    """
+    _train_and_save("recommend2", report_accuracy=True)
 
 def XGboost_recommend3():
     """
     訓練並儲存第三支 XGBoost 模型，使用 generated_data_updated1.csv。
     """
-    le = LabelEncoder()
-    labelencoder = LabelEncoder()
-    tree_deep = 100
-    learning_rate = 0.3
-
-    Data = pd.read_csv(GENERATED_DATA_CSV, encoding='utf-8-sig')
-    df_data = pd.DataFrame(
-        data=np.c_[Data['weather'], Data['gender'], Data['age'], Data['tidal'], Data['temperature'], Data['設置點']],
-        columns=['weather', 'gender', 'age', 'tidal', 'temperature', 'label']
-    )
-
-    df_data['weather'] = labelencoder.fit_transform(df_data['weather'])
-    X = df_data.drop(labels=['label'], axis=1).values
+    _train_and_save("recommend3")
 
-    onehot = OneHotEncoder(handle_unknown='ignore', sparse_output=False)
-    X = onehot.fit_transform(X)
-    Y = df_data['label'].values
-
-    X_train, _, Y_train, _ = train_test_split(X, Y, test_size=0.3, random_state=42)
-    Y_train = le.fit_transform(Y_train)
-
-    model = XGBClassifier(n_estimators=tree_deep, learning_rate=learning_rate)
-    model.fit(X_train, Y_train)
-    model.save_model(PHTEST_MODEL_PATH)
-    print(f"模型已儲存至 {PHTEST_MODEL_PATH}")
+def XGboost_classification():
+    """
+    訓練並儲存四支分類模型（永續/一般 × 景點/餐廳）；缺少訓練 CSV 者略過。
+    """
+    for name in ("sustainable_attractions", "non_sustainable_attractions",
+                 "sustainable_non_attractions", "non_sustainable_non_attractions"):
+        csv_path = MODEL_SPECS[name][0]
+        if not os.path.exists(csv_path):
+            print(f"⚠️ 找不到 {csv_path}，略過 {name}")
+            continue
+        _train_and_save(name)
+
+def build_lookup_tables(names=("recommend2", "recommend3")):
+    """
+    以剛發佈的模型列舉離散特徵網格，寫出線上 O(1) 查表（見 recommend_lookup.py）。
+    """
+    import recommend_lookup   # 延遲匯入：recommend_lookup → model_registry → 本模組
+    for name in names:
+        recommend_lookup.build(name)
 
 if __name__ == "__main__":
     # 訓練並儲存所有模型
     XGboost_recommend1()
     XGboost_recommend2()
     XGboost_recommend3()
+    XGboost_classification()
+    # 建立推薦查表
+    build_lookup_tables()
@@ -7,6 +7,7 @@ import json
 import csv
 import sqlite3
 import threading
+from concurrent.futures import ThreadPoolExecutor
 threading._after_fork = lambda *args, **kwargs: None
 threading.Thread._stop   = lambda self: None
 from datetime import datetime as dt
@@ -71,20 +72,29 @@ else:
 # 資料處理
 import pandas as pd
 import numpy as np
-import requests
-import googlemaps
 # 自製模組
 from timer import measure_time
 from report_runtime import fetch_data
 from config import (
     MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DATABASE,
-    PLAN_CSV, PLAN_2DAY, PLAN_3DAY, PLAN_4DAY, PLAN_5DAY,
-    LOCATION_FILE, RECOMMEND_CSV
+    PLAN_2DAY, PLAN_3DAY, PLAN_4DAY, PLAN_5DAY,
+    LOCATION_FILE,
+    MAPS_LOOKUP_CONCURRENCY, DISTANCE_MATRIX_MAX_DESTINATIONS,
+    DISTANCE_MODE, NEARBY_SORT, DAILY_CROWD_STATS_CSV,
 )
 import re
 import unicodedata
 import XGBOOST_predicted
 import ML
+import model_registry
+import plan_index
+import plan_store
+import planning_scheduler
+import place_cache
+import geo_distance
+import maps_gateway
+import popularity_snapshot
+import crowd_stats
 import Search
 import Now_weather
 import Filter
@@ -113,6 +123,15 @@ init_app(app, interval=5)   # 只需這一行
 metrics.init_metrics(app)  
 import routes_metrics              # 不會產生循環
 routes_metrics.register_png_routes(app)
+model_registry.start()             # 背景載入模型 + hot-reload 監看
+popularity_snapshot.start()        # 背景每小時更新 populartimes 快照
+
+def _warm_up_plans(paths=(PLAN_2DAY, PLAN_3DAY, PLAN_4DAY, PLAN_5DAY)):
+    """背景載入各天數行程的欄式表與族群索引"""
+    plan_store.warm_up(paths)
+    plan_index.warm_up(paths)
+
+threading.Thread(target=_warm_up_plans, daemon=True).start()
 
 # LINE Bot 設定
 ACCESS_TOKEN   = os.getenv("LINE_ACCESS_TOKEN",   "your_line_access_token_here")
@@ -145,8 +164,6 @@ def _get_lang(uid: str) -> str:
     return shared.user_language.get(uid, 'zh')
 
 # ─────────────── LINE 安全封裝 ───────────────
-used_reply_tokens = set()
-
 def safe_reply(token, msgs, uid=None):
     """
     安全的 reply 函式，避免重複使用 replyToken。
@@ -156,8 +173,9 @@ def safe_reply(token, msgs, uid=None):
         print("Warning: reply token is None or empty")
         return
 
-    # 避免同一個 token 重複用
-    if token in used_reply_tokens:
+    # 先佔用 token 再送出：回傳 False 代表其他 greenlet / worker 已經用過
+    # （只記住 REPLY_TOKEN_TTL 秒內用過的 token；事件中的 token 已在 event_scope 登記，不再打後端）
+    if not shared.claim_reply_token(token):
         print(f"Warning: Reply token {token} already used, skipping reply")
         return
 
@@ -166,7 +184,6 @@ def safe_reply(token, msgs, uid=None):
     # 簡單判斷：token 含有 '-' 視為非 LINE 平台生成（Locust UUID）
     if test_mode or "-" in token:
         print(f"[TestMode] Skip reply_message for token: {token}")
-        used_reply_tokens.add(token)
         # 測試模式下直接視為成功回覆，不呼叫 LINE 平台
         return
 
@@ -177,7 +194,6 @@ def safe_reply(token, msgs, uid=None):
     try:
         # 嘗試呼叫 LINE 回覆 API
         line_bot_api.reply_message(token, msgs)
-        used_reply_tokens.add(token)
         print(f"✅ Reply sent successfully with token: {token}")
     except LineBotApiError as e:
         # 取得錯誤細節
@@ -185,8 +201,6 @@ def safe_reply(token, msgs, uid=None):
         request_id  = getattr(e, "request_id", None)
         error_message = e.error.message if hasattr(e, "error") and e.error else str(e)
         print(f"❌ safe_reply error: status_code={status_code}, request_id={request_id}, message={error_message}")
-        # 標記 token 已使用，避免重複
-        used_reply_tokens.add(token)
         # 若有提供 uid，改用 push 補發訊息
         if uid:
             print(f"↪️ safe_reply fallback to push for user {uid}")
@@ -258,131 +272,148 @@ def safe_push(uid, msgs):
 
 # ─────────────── 背景行程規劃 Thread ───────────────
 def _background_planning(option, reply_token, user_id):
-    """背景行程規劃，使用 push 而非 reply"""
-    try:
-        process_travel_planning(option, reply_token, user_id)
-        shared.user_plan_ready[user_id] = True
-        
-        # 規劃完成後推送通知
-        lang = _get_lang(user_id)
-        safe_push(user_id, TextSendMessage(text=_t("planning_completed", lang)))
-        
-    except Exception as e:
-        print(f"Background planning failed: {e}")
-        lang = _get_lang(user_id)
-        safe_push(user_id, TextSendMessage(text=_t("planning_failed", lang)))
-    finally:
+    """
+    背景行程規劃，使用 push 而非 reply。
+    整個工作包在 profile_scope 裡：只 load 一次，推播前先寫回，
+    使用者收到通知後的下一個事件就能讀到 plan_ready / preparing 的新狀態。
+    寫回前先告知 planning_scheduler；執行期間使用者已改選天數時，
+    這次的結果已過時，狀態與通知交給接著跑的後續工作。
+    """
+    with shared.profile_scope(user_id):
+        try:
+            process_travel_planning(option, reply_token, user_id)
+            if planning_scheduler.finishing(user_id):
+                print(f"[planning] {user_id} superseded, skip notify for {option}")
+                return
+            shared.user_plan_ready[user_id] = True
+            shared.user_preparing[user_id] = False
+            shared.flush(user_id)
+
+            # 規劃完成後推送通知
+            lang = _get_lang(user_id)
+            safe_push(user_id, TextSendMessage(text=_t("planning_completed", lang)))
+
+        except Exception as e:
+            print(f"Background planning failed: {e}")
+            if planning_scheduler.finishing(user_id):
+                return
+            shared.user_preparing[user_id] = False
+            shared.flush(user_id)
+            lang = _get_lang(user_id)
+            safe_push(user_id, TextSendMessage(text=_t("planning_failed", lang)))
+
+def _schedule_planning(days, reply_token, user_id):
+    """
+    把背景規劃排入 planning_scheduler（固定 worker 數、同一使用者只保留一個工作；
+    以天數當 key，執行中改選天數時排一個後續工作）。
+    佇列已滿時還原 preparing 狀態並回傳 False，由呼叫端回覆 planning_busy。
+    """
+    # 先寫回本事件的 profile 變動（preparing=True 等），背景工作結束時的寫入才不會被事件收尾蓋掉
+    shared.flush(user_id)
+    result = planning_scheduler.submit(user_id, _background_planning, days, reply_token, user_id, key=days)
+    if result == planning_scheduler.REJECTED:
+        print(f"[planning] queue full, rejected {user_id}")
         shared.user_preparing[user_id] = False
+        return False
+    return True
 # ========== 以下為行程／人氣／推薦等核心函式 ==========
 # （完整邏輯保持不變，只把 TEXTS[...] → _t('key')，
 #   中文 Label → to_en(...) if language_1=='en' else 原文）
 
-def load_historical_avg_crowd(csv_path="daily_crowd_stats.csv"):
+def load_historical_avg_crowd(csv_path=DAILY_CROWD_STATS_CSV):
     """
-    讀取 daily_crowd_stats.csv，回傳 {place: avg_count} 的 dict
+    回傳 daily_crowd_stats.csv 的 {place: avg_count}（crowd_stats 已載入的矩陣，檔案更新時自動重載）
     """
-    hist_df = pd.read_csv(csv_path, encoding="utf-8-sig")
-    avg_crowd = (
-        hist_df
-        .groupby("place")["count"]
-        .mean()
-        .round()
-        .astype(int)
-        .to_dict()
-    )
-    return avg_crowd
+    return crowd_stats.get(csv_path).avg_dict()
 
-import requests
 from datetime import datetime as dt
 from timer import measure_time
 
 
 def get_current_popularity(place_id):
     """
-    以 Google Maps Python 客戶端 + Place Details API 取今日即時熱度 (0–100)。
+    經 maps_gateway（共用連線池、限流、重試）呼叫 Place Details API 取今日即時熱度 (0–100)。
+    重排名平常讀 popularity_snapshot 的每小時快照，只有快照裡沒有的 place_id 才走這裡。
 
-    1) 若 place_id 是空字串，先用 find_place 拿 place_id
+    1) place_id 是空字串時直接回傳 0
     2) 呼叫 Place Details，只要 populartimes 欄位
-    3) 轉換星期索引：Python Mon=0→Google Mon=1
-    4) 找到對應 day["name"] 再取當前小時的 data
-    5) 全面錯誤保護，任何異常皆回傳 0
+    3) 轉換星期索引：Python Mon=0→Google Sun=0，取當前小時
+    4) 全面錯誤保護，任何異常皆回傳 0
     """
-    # 0. 建立 Google Maps client
-    try:
-        gmaps = googlemaps.Client(key=GOOGLE_API_KEY)
-    except Exception:
-        return 0
-
-    # 1. 如果 place_id 不在，就先用 find_place 查一次
+    # 1. 沒有 place_id 就無從查起（以空字串 find_place 只會得到 API 錯誤）
     if not place_id:
-        try:
-            res = gmaps.find_place(
-                input=place_id or "",           # 空字串也要傳，但 gmaps 會回錯
-                input_type="textquery",
-                fields=["place_id"]
-            )
-            candidates = res.get("candidates", [])
-            if candidates:
-                place_id = candidates[0].get("place_id", "")
-        except Exception:
-            return 0
-
-        if not place_id:
-            return 0
-
-    # 2. 呼叫 Place Details API 拿 populartimes
-    details_url = (
-        "https://maps.googleapis.com/maps/api/place/details/json"
-        f"?place_id={place_id}"
-        "&fields=populartimes"
-        f"&key={GOOGLE_API_KEY}"
-    )
-    try:
-        resp = requests.get(details_url, timeout=5)
-        resp.raise_for_status()
-        res_json = resp.json()
-    except Exception:
         return 0
 
-    pop_times = res_json.get("result", {}).get("populartimes")
-    if not isinstance(pop_times, list) or not pop_times:
+    # 2. 經 maps_gateway 呼叫 Place Details API 拿 populartimes，整理成 (7, 24) 陣列
+    week = popularity_snapshot.fetch_week(place_id)
+    if week is None:
         return 0
 
-    # 3. 計算今天的 weekday index
-    # Python weekday(): Mon=0…Sun=6 → Google: Sun=0…Sat=6
-    try:
-        py_wd = dt.now().weekday()
-        google_wd = (py_wd + 1) % 7
-    except Exception:
-        return 0
+    # 3. 星期索引轉成 Google 的 Sun=0…Sat=6，取當前小時的熱度
+    now = dt.now()
+    return int(week[popularity_snapshot.google_weekday(now), now.hour])
 
-    # 4. 找到當天的 data array
-    data_array = None
-    for day_obj in pop_times:
-        if day_obj.get("name") == google_wd:
-            data_array = day_obj.get("data")
-            break
-
-    # 5. 取當前小時的熱度
-    if isinstance(data_array, list):
-        hour = dt.now().hour
-        if 0 <= hour < len(data_array):
-            try:
-                val = data_array[hour]
-                return int(val) if isinstance(val, (int, float, str)) else 0
-            except Exception:
-                return 0
 
-    return 0
+def _resolve_places(places, crowd_source, avg_crowd=None):
+    """
+    在有界執行緒池（gevent 下為 greenlet）上併發查詢每個景點的 place_id 與人潮，
+    place_id 先查 place_cache（持久化快取），未命中才經 maps_gateway.find_place_id 查詢；
+    回傳 {place: (place_id, crowd)}；單一景點失敗只影響該景點（place_id="", crowd=0）。
+    """
+    def _one(place):
+        pid = place_cache.resolve(place, maps_gateway.find_place_id)
+        if crowd_source == "historical":
+            crowd = avg_crowd.get(place, 0)
+        else:
+            # realtime：先讀每小時快照（O(1)），快照沒有才即時查
+            crowd = popularity_snapshot.current(pid) if pid else 0
+            if crowd is None:
+                crowd = get_current_popularity(pid)
+        return pid, crowd
+
+    unique = list(dict.fromkeys(places))
+    if not unique:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(MAPS_LOOKUP_CONCURRENCY, len(unique))) as pool:
+        return dict(zip(unique, pool.map(_one, unique)))
+
 
+def _batch_distances(gmaps, origin, place_ids, fallback=None):
+    """
+    一個起點對所有 place_id 的行車距離（公里，小數 3 位），
+    每 DISTANCE_MATRIX_MAX_DESTINATIONS 個目的地合併成一次 Distance Matrix 呼叫。
+    沒有 place_id、該元素非 OK，或整批請求失敗的列沿用 fallback（未提供時為 0.0）。
+    """
+    distances = list(fallback) if fallback is not None else [0.0] * len(place_ids)
+    targets = [(i, pid) for i, pid in enumerate(place_ids) if pid]
+    for start in range(0, len(targets), DISTANCE_MATRIX_MAX_DESTINATIONS):
+        chunk = targets[start:start + DISTANCE_MATRIX_MAX_DESTINATIONS]
+        try:
+            matrix = gmaps.distance_matrix(
+                origins=[origin],
+                destinations=[f"place_id:{pid}" for _, pid in chunk],
+                mode="driving",
+                units="metric"
+            )
+            elements = matrix["rows"][0]["elements"]
+        except Exception as e:
+            print(f"distance_matrix error: {e}")
+            continue
+        for (i, _), elem in zip(chunk, elements):
+            if elem.get("status") == "OK":
+                distances[i] = round(elem["distance"]["value"] / 1000, 3)
+    return distances
 
 
 def update_plan_csv_with_populartimes(plan_csv_file, user_id, crowd_source="historical"):
     """
-    在行程 CSV 加入 place_id、crowd（歷史或即時）、distance_km，
+    在行程加入 place_id、crowd（歷史或即時）、distance_km，
     並依距離、人潮排序，重設 crowd_rank。
     並把 UserID/MemID 欄位值改成該使用者的 user_id。
-    讀取 shared.user_location 作為使用者定位。
+    讀取 shared.user_location 作為使用者定位；距離預設由 geo_distance 本地計算。
+
+    plan_csv_file 可為 DataFrame（每位使用者自己的行程，回傳排序後的新 DataFrame，不寫檔）
+    或 CSV 路徑（讀入後寫回原檔，相容舊流程）。
     """
     # 0. 歷史人潮
     if crowd_source == "historical":
@@ -396,50 +427,32 @@ def update_plan_csv_with_populartimes(plan_csv_file, user_id, crowd_source="hist
     user_loc = f"{user_lat},{user_lng}"
 
     # 2. 讀取並初始化 DataFrame
-    df = pd.read_csv(plan_csv_file, encoding="utf-8-sig")
+    if isinstance(plan_csv_file, pd.DataFrame):
+        df = plan_csv_file.copy()
+    else:
+        df = pd.read_csv(plan_csv_file, encoding="utf-8-sig")
+    df.reset_index(drop=True, inplace=True)
     for col, dv in [("place_id", ""), ("crowd", 0), ("distance_km", 0.0), ("crowd_rank", 0)]:
         if col not in df.columns:
             df[col] = dv
 
-    # 3. 建立 Google Maps Client
-    gmaps = googlemaps.Client(key=GOOGLE_API_KEY)
+    # 3. 共用的 Google Maps client（maps_gateway）
+    gmaps = maps_gateway.client()
 
-    # 4. 逐筆處理 place_id、人潮、距離
-    for idx, row in df.iterrows():
-        place = row["設置點"]
-        # (a) 查 place_id
-        try:
-            res = gmaps.find_place(
-                input=place,
-                input_type="textquery",
-                fields=["place_id"]
-            )
-            pid = res.get("candidates", [{}])[0].get("place_id", "")
-        except:
-            pid = ""
-        df.at[idx, "place_id"] = pid
+    # 4. 併發查 place_id + 人潮（同名景點只查一次）
+    resolved = _resolve_places(df["設置點"].tolist(), crowd_source,
+                               avg_crowd if crowd_source == "historical" else None)
+    df["place_id"] = [resolved[p][0] for p in df["設置點"]]
+    df["crowd"] = [resolved[p][1] for p in df["設置點"]]
 
-        # (b) 套用人潮
-        if crowd_source == "historical":
-            df.at[idx, "crowd"] = avg_crowd.get(place, 0)
-        else:
-            df.at[idx, "crowd"] = get_current_popularity(pid)
-
-        # (c) 計算距離
-        try:
-            matrix = gmaps.distance_matrix(
-                origins=[user_loc],
-                destinations=[f"place_id:{pid}"],
-                mode="driving",
-                units="metric"
-            )
-            elem = matrix["rows"][0]["elements"][0]
-            if elem.get("status") == "OK":
-                df.at[idx, "distance_km"] = round(elem["distance"]["value"] / 1000, 3)
-            else:
-                df.at[idx, "distance_km"] = 0.0
-        except:
-            df.at[idx, "distance_km"] = 0.0
+    # 4.1 距離：預設本地計算（haversine / 路網矩陣），DISTANCE_MODE=google 時再以 Distance Matrix 精修
+    missing = [None] * len(df)
+    local = geo_distance.distances_km(user_lat, user_lng, df["設置點"],
+                                      df.get("緯度", missing), df.get("經度", missing))
+    distances = np.round(np.nan_to_num(local, nan=0.0), 3).tolist()
+    if DISTANCE_MODE == "google":
+        distances = _batch_distances(gmaps, user_loc, df["place_id"].tolist(), fallback=distances)
+    df["distance_km"] = distances
 
     # 5. 排序 & 重新編排 crowd_rank
     df.sort_values(by=["distance_km", "crowd"], ascending=[True, True], inplace=True)
@@ -449,8 +462,10 @@ def update_plan_csv_with_populartimes(plan_csv_file, user_id, crowd_source="hist
     if "UserID/MemID" in df.columns:
         df["UserID/MemID"] = user_id
 
-    # 6. 寫回 CSV
-    df.to_csv(plan_csv_file, index=False, encoding="utf-8-sig")
+    # 6. 路徑輸入才寫回 CSV
+    if not isinstance(plan_csv_file, pd.DataFrame):
+        df.to_csv(plan_csv_file, index=False, encoding="utf-8-sig")
+    return df
 
 
 
@@ -460,9 +475,10 @@ def update_plan_csv_with_populartimes(plan_csv_file, user_id, crowd_source="hist
 # ---------- app.py  ※ Part 2 / 4  ----------------------------------
 # ---- 1) XGBoost 排序 (Machine Learning) ----
 
-def run_ml_sort(option, reply_token, user_id, df_plan):
+def run_ml_sort(option, reply_token, user_id, csv_path):
     """
     以 XGBoost 依性別、年齡做排序，回傳 userID list
+    （模型由 model_registry 每個 plan CSV 只訓練一次）
     """
     # 1) 取出原始文字性別，並轉成數值
     raw_gender = shared.user_gender.get(user_id, "")
@@ -471,9 +487,8 @@ def run_ml_sort(option, reply_token, user_id, df_plan):
     # 2) 取年齡
     age = shared.user_age.get(user_id, 30)
 
-    # 3) 印出 debug 訊息並呼叫 XGBoost
-    #print(f"run_ml_sort: gender={gender}, age={age}, df_plan.dtypes={df_plan.dtypes}")
-    return ML.XGboost_plan(df_plan, gender, age)
+    # 3) 呼叫 XGBoost
+    return ML.XGboost_plan(csv_path, gender, age)
 
 
 
@@ -481,27 +496,28 @@ def run_ml_sort(option, reply_token, user_id, df_plan):
 
 def run_filter(option, reply_token, user_id, csv_path, userID):
     """
-    根據需求過濾景點（例如距離、人潮…）
+    根據需求過濾景點（例如距離、人潮…），回傳模板旅客的行程 DataFrame
+    （plan_store 預建索引的切片，只在記憶體中傳給下一段）。
     """
-    Filter.filter(csv_path, userID)
+    return Filter.filter(csv_path, userID, output=None)
 
 
 # ---- 3) 景點重排名 (Attraction Ranking) ----
 
-def run_ranking(option, reply_token, user_id, plan_csv):
+def run_ranking(option, reply_token, user_id, df_plan):
     """
-    根據即時人潮和距離再對行程排序，並寫回 CSV
+    根據即時人潮和距離再對該使用者的行程排序，回傳新的 DataFrame
     """
-    update_plan_csv_with_populartimes(plan_csv, user_id, crowd_source="realtime")
+    return update_plan_csv_with_populartimes(df_plan, user_id, crowd_source="realtime")
 
 
 # ---- 4) 上傳資料 (Data to Database) ----
 
-def run_upload(option, reply_token, user_id):
+def run_upload(option, reply_token, user_id, df_plan):
     """
-    把最終 CSV 上傳到遠端 PHP 或其他服務
+    把最終行程存入 SQLite（以 user_id 為鍵）並上傳到遠端 Worker
     """
-    csv_up()
+    csv_up(df_plan, user_id=user_id)
 
 
 # ---- 串接主流程 ----
@@ -510,6 +526,8 @@ def process_travel_planning(option, reply_token, user_id):
     """
     拆成四段：ML排序 → 景點過濾 → 重排名 → 上傳，
     並在每一步發生錯誤時回報，最後標記完成狀態。
+    各段之間只傳遞該使用者自己的 DataFrame，不再共用 plan.csv，
+    多位使用者可以同時規劃。
     """
     # 0. 前置資料檢查
     if shared.user_gender.get(user_id) is None or shared.user_age.get(user_id) is None:
@@ -530,18 +548,10 @@ def process_travel_planning(option, reply_token, user_id):
         "五天四夜": PLAN_5DAY
     }
     csv_path = csv_map.get(option, PLAN_2DAY)
-    try:
-        df_plan = pd.read_csv(csv_path, encoding="utf-8-sig")
-    except Exception as e:
-        print("read CSV error:", e)
-        lang = _get_lang(user_id)
-        safe_push(user_id, TextSendMessage(text=_t('data_fetch_failed', lang)))
-        shared.user_preparing[user_id] = False
-        return
 
     # 2. 機器學習排序
     try:
-        sorted_user_list = run_ml_sort(option, reply_token, user_id, df_plan)
+        sorted_user_list = run_ml_sort(option, reply_token, user_id, csv_path)
     except Exception as e:
         print("XGboost_plan error:", e)
         lang = _get_lang(user_id)
@@ -551,7 +561,7 @@ def process_travel_planning(option, reply_token, user_id):
 
     # 3. 景點過濾
     try:
-        run_filter(option, reply_token, user_id, csv_path, sorted_user_list)
+        df_plan = run_filter(option, reply_token, user_id, csv_path, sorted_user_list)
     except Exception as e:
         print("filter error:", e)
         lang = _get_lang(user_id)
@@ -561,7 +571,7 @@ def process_travel_planning(option, reply_token, user_id):
 
     # 4. 重排名（加入即時人潮與距離）
     try:
-        run_ranking(option, reply_token, user_id, PLAN_CSV)
+        df_plan = run_ranking(option, reply_token, user_id, df_plan)
     except Exception as e:
         print("ranking error:", e)
         lang = _get_lang(user_id)
@@ -571,7 +581,7 @@ def process_travel_planning(option, reply_token, user_id):
 
     # 5. 上傳最終結果
     try:
-        run_upload(option, reply_token, user_id)
+        run_upload(option, reply_token, user_id, df_plan)
     except Exception as e:
         print("upload error:", e)
         lang = _get_lang(user_id)
@@ -590,20 +600,9 @@ def process_travel_planning(option, reply_token, user_id):
 
 
 def people_high5(tk, uid):
-    """回傳目前時段最壅擠前 5 名 (list, text)"""
+    """回傳目前時段最壅擠前 CROWD_TOP_K 名 (list, text)；排序與訊息都已預先建好"""
     try:
-        df = pd.read_csv("daily_crowd_stats.csv", encoding="utf-8-sig")
-        hr = dt.now().hour
-        top5 = (
-            df[df["hour"] == hr]
-              .sort_values("count", ascending=False)
-              .head(5)
-        )
-        msg = "\n".join(
-            f"{i+1}. {r.place}({r.count})"
-            for i, r in enumerate(top5.itertuples())
-        )
-        return top5["place"].tolist(), msg
+        return crowd_stats.top(dt.now().hour, _get_lang(uid))
     except Exception as e:
         print("people_high5 error:", e)
         # 取得使用者語系
@@ -733,7 +732,7 @@ def recommend_sustainable_places(tk, uid):
         gender_code = FlexMessage.classify_gender(raw_gender)   # 0/1/2
         age         = shared.user_age.get(uid, 30)
 
-        # ---------- 5) XGBoost 推薦 ----------
+        # ---------- 5) XGBoost 推薦（模型內直接遮罩 dont_go，只需一次 predict_proba）----------
         try:
             rec = ML.XGboost_recommend3(
                 np.array([w_str]), gender_code, age, tide, temp_c, dont_go
@@ -744,12 +743,6 @@ def recommend_sustainable_places(tk, uid):
                 np.array(['晴']), gender_code, age, tide, temp_c, dont_go
             )
 
-        # 如果結果還落在「不建議前往」名單，就再跑一次
-        if rec in dont_go:
-            rec = ML.XGboost_recommend3(
-                np.array([w_str]), gender_code, age, tide, temp_c, dont_go
-            )
-
         # ---------- 6) 取景點資訊 ----------
         web, img, maplink = PH_Attractions.Attractions_recommend1(rec)
 
@@ -793,7 +786,10 @@ def search_nearby_places(replyTK, uid, keyword):
 
     # 2) 呼叫 Google Maps Nearby Search
     try:
-        Googlemap_function.googlemap_search_nearby(lat, lon, keyword)
+        search_list, _ = Googlemap_function.googlemap_search_nearby(
+            lat, lon, keyword, sort_by=NEARBY_SORT,
+            language="en" if lang == "en" else "zh-TW"
+        )
     except Exception as e:
         print("googlemap_search_nearby error:", e)
         safe_reply(replyTK, TextSendMessage(text=_t("data_fetch_failed", lang)),uid)
@@ -801,7 +797,7 @@ def search_nearby_places(replyTK, uid, keyword):
 
     # 3) 產生並回傳 Carousel
     try:
-        contents = FlexMessage.Carousel_contents(RECOMMEND_CSV, uid)
+        contents = FlexMessage.Carousel_contents(search_list, uid)
         carousel = FlexMessage.Carousel(contents, uid)
         safe_reply(replyTK, carousel,uid)
     except Exception as e:
@@ -971,11 +967,9 @@ def handle_days(uid, text, replyTK):
     shared.user_plan_ready[uid]  = False
     shared.user_stage[uid]       = 'ready'
 
-    threading.Thread(
-        target=_background_planning,
-        args=(choice, replyTK, uid),
-        daemon=True
-    ).start()
+    if not _schedule_planning(choice, replyTK, uid):
+        safe_reply(replyTK, TextSendMessage(text=_t("planning_busy", lang)),uid)
+        return
 
     safe_reply(replyTK, TextSendMessage(text=_t("please_wait", lang)),uid)
 
@@ -1079,12 +1073,10 @@ def handle_free_command(uid, text, replyTK):
             if days:
                 shared.user_preparing[uid]  = True
                 shared.user_plan_ready[uid] = False
-                threading.Thread(
-                    target=_background_planning,
-                    args=(days, replyTK, uid),
-                    daemon=True
-                ).start()
-                safe_reply(replyTK, TextSendMessage(text=_t("please_wait", lang)), uid)
+                if _schedule_planning(days, replyTK, uid):
+                    safe_reply(replyTK, TextSendMessage(text=_t("please_wait", lang)), uid)
+                else:
+                    safe_reply(replyTK, TextSendMessage(text=_t("planning_busy", lang)), uid)
             else:
                 # 真正沒收集過資料時才提示
                 safe_reply(replyTK, TextSendMessage(text=_t("collect_info", lang)), uid)
@@ -1161,22 +1153,25 @@ def handle_single_event(ev):
     """處理單一事件，分發給 message 或 postback handler"""
     ev_type = ev.get("type")
     uid     = ev["source"]["userId"]
-    lang    = shared.user_language.get(uid, 'zh')
     replyTK = ev.get("replyToken")
 
     if not replyTK:
         print("Warning: no reply token")
         return
 
-    print(f"Handling event type: {ev_type}, user: {uid}, lang: {lang}")
-
-    if ev_type == "postback":
-        # 統一交給 handle_postback_event 處理
-        handle_postback_event(ev, uid, lang, replyTK)
-    elif ev_type == "message":
-        handle_message_event(ev, uid, lang, replyTK)
-    else:
-        print(f"Unhandled event type: {ev_type}")
+    # 同一使用者的事件依序執行；整個事件共用一份 profile：
+    # 開頭一次往返（搶鎖 + 登記 replyToken + SELECT），結束一次往返（UPSERT + 放鎖）
+    with shared.event_scope(uid, replyTK) as profile:
+        lang = profile.language
+        print(f"Handling event type: {ev_type}, user: {uid}, lang: {lang}")
+
+        if ev_type == "postback":
+            # 統一交給 handle_postback_event 處理
+            handle_postback_event(ev, uid, lang, replyTK)
+        elif ev_type == "message":
+            handle_message_event(ev, uid, lang, replyTK)
+        else:
+            print(f"Unhandled event type: {ev_type}")
 
 def handle_postback_event(ev, uid, lang, replyTK):
     """統一處理所有 Postback 事件"""
@@ -1195,12 +1190,10 @@ def handle_postback_event(ev, uid, lang, replyTK):
         shared.user_plan_ready[uid] = False
         shared.user_stage[uid] = 'ready'
 
-        safe_reply(replyTK, TextSendMessage(text=_t("please_wait", lang)), uid)
-        threading.Thread(
-            target=_background_planning,
-            args=(data, None, uid),
-            daemon=True
-        ).start()
+        if _schedule_planning(data, None, uid):
+            safe_reply(replyTK, TextSendMessage(text=_t("please_wait", lang)), uid)
+        else:
+            safe_reply(replyTK, TextSendMessage(text=_t("planning_busy", lang)), uid)
         return
 
     # 系統路線 / 使用者路線
@@ -1237,9 +1230,6 @@ def handle_postback_event(ev, uid, lang, replyTK):
 
 from linebot.models import TextSendMessage, StickerSendMessage
 
-# 在 app.py 開頭新增一個全域字典用於每個使用者的 Lock
-user_event_lock = {}
-
 def handle_message_event(ev, uid, lang, replyTK):
     """
     處理文字／位置／圖片／貼圖事件：
@@ -1247,151 +1237,133 @@ def handle_message_event(ev, uid, lang, replyTK):
     1) 自由指令
     2) 階段流程：語言→年齡→性別→位置→天數→ready
     """
-    # 使用者事件處理鎖定，確保同一使用者事件順序執行
-    if uid not in user_event_lock:
-        user_event_lock[uid] = threading.Lock()
-    with user_event_lock[uid]:
-        msg = ev.get("message", {})
-        msgType = msg.get("type")
-        text = (msg.get("text") or "").strip()
-        low = text.lower()
-
-        # —— 0) 重啟資料收集流程 ——
-        if msgType == "text" and text.startswith("收集資料"):
-            handle_ask_language(uid, replyTK)
-            return
+    # 同一使用者的事件鎖由 handle_single_event 取得，確保同一使用者事件順序執行
+    msg = ev.get("message", {})
+    msgType = msg.get("type")
+    text = (msg.get("text") or "").strip()
+    low = text.lower()
 
-        # —— 1) 自由指令 ——
-        crowd_keys  = {"景點人潮", "crowd analyzer", "3", "景點人潮(crowd analyzer)"}
-        plan_keys   = {"行程規劃", "plan itinerary", "6", "行程規劃(itinerary planning)"}
-        rec_keys    = {"景點推薦", "attraction recommendation", "2", "景點推薦(attraction recommendation)"}
-        sust_keys   = {"永續觀光", "sustainable tourism", "2-1"}
-        gen_keys    = {"一般景點推薦", "general recommendation", "2-2"}
-        nearby_keys = {"附近搜尋", "nearby search", "4", "附近搜尋(nearby search)"}
-        rental_keys = {"租車", "car rental information", "5", "租車(car rental information)"}
-        keyword_map = {"餐廳": "restaurants", "停車場": "parking", "風景區": "scenic spots", "住宿": "accommodation"}
-        is_keyword  = text in keyword_map or low in set(keyword_map.values())
-
-        if msgType == "text":
-            # Special handling for itinerary planning to prompt missing info
-            if low in plan_keys:
-                missing_field = None
-                if shared.user_age.get(uid) is None:
-                    missing_field = 'age'
-                elif shared.user_gender.get(uid) is None:
-                    missing_field = 'gender'
-                elif shared.user_location.get(uid) is None:
-                    missing_field = 'location'
-                elif shared.user_trip_days.get(uid) is None:
-                    missing_field = 'days'
-
-                if missing_field:
-                    # Prompt the user for the missing information
-                    current_lang = _get_lang(uid)
-                    if missing_field == 'age':
-                        shared.user_stage[uid] = 'got_age'
-                        safe_reply(replyTK, TextSendMessage(text=_t("ask_age", current_lang)), uid)
-                    elif missing_field == 'gender':
-                        shared.user_stage[uid] = 'got_gender'
-                        handle_gender_buttons(uid, current_lang, replyTK)
-                    elif missing_field == 'location':
-                        shared.user_stage[uid] = 'got_location'
-                        safe_reply(replyTK, FlexMessage.ask_location(), uid)
-                    elif missing_field == 'days':
-                        shared.user_stage[uid] = 'got_days'
-                        # Prepare quick-reply options for trip duration
-                        days_options = ["兩天一夜", "三天兩夜", "四天三夜", "五天四夜"]
-                        qr_items = [
-                            QuickReplyButton(
-                                action=MessageAction(
-                                    label=to_en(d) if current_lang == 'en' else d,
-                                    text = to_en(d) if current_lang == 'en' else d
-                                )
-                            )
-                            for d in days_options
-                        ]
-                        safe_reply(replyTK, TextSendMessage(text=_t("ask_days", current_lang),
-                                                            quick_reply=QuickReply(items=qr_items)), uid)
-                    return
-
-                # All data collected, proceed to itinerary planning
-                handle_free_command(uid, text, replyTK)
-                return
+    # —— 0) 重啟資料收集流程 ——
+    if msgType == "text" and text.startswith("收集資料"):
+        handle_ask_language(uid, replyTK)
+        return
 
-            # Other free commands and keyword-based searches
-            if (low in crowd_keys or low in rec_keys or low in sust_keys or 
-                low in gen_keys or low in nearby_keys or low in rental_keys or is_keyword):
-                handle_free_command(uid, text, replyTK)
+    # —— 1) 自由指令 ——
+    crowd_keys  = {"景點人潮", "crowd analyzer", "3", "景點人潮(crowd analyzer)"}
+    plan_keys   = {"行程規劃", "plan itinerary", "6", "行程規劃(itinerary planning)"}
+    rec_keys    = {"景點推薦", "attraction recommendation", "2", "景點推薦(attraction recommendation)"}
+    sust_keys   = {"永續觀光", "sustainable tourism", "2-1"}
+    gen_keys    = {"一般景點推薦", "general recommendation", "2-2"}
+    nearby_keys = {"附近搜尋", "nearby search", "4", "附近搜尋(nearby search)"}
+    rental_keys = {"租車", "car rental information", "5", "租車(car rental information)"}
+    keyword_map = {"餐廳": "restaurants", "停車場": "parking", "風景區": "scenic spots", "住宿": "accommodation"}
+    is_keyword  = text in keyword_map or low in set(keyword_map.values())
+
+    if msgType == "text":
+        # Special handling for itinerary planning to prompt missing info
+        if low in plan_keys:
+            missing_field = None
+            if shared.user_age.get(uid) is None:
+                missing_field = 'age'
+            elif shared.user_gender.get(uid) is None:
+                missing_field = 'gender'
+            elif shared.user_location.get(uid) is None:
+                missing_field = 'location'
+            elif shared.user_trip_days.get(uid) is None:
+                missing_field = 'days'
+
+            if missing_field:
+                # Prompt the user for the missing information
+                current_lang = _get_lang(uid)
+                if missing_field == 'age':
+                    shared.user_stage[uid] = 'got_age'
+                    safe_reply(replyTK, TextSendMessage(text=_t("ask_age", current_lang)), uid)
+                elif missing_field == 'gender':
+                    shared.user_stage[uid] = 'got_gender'
+                    handle_gender_buttons(uid, current_lang, replyTK)
+                elif missing_field == 'location':
+                    shared.user_stage[uid] = 'got_location'
+                    safe_reply(replyTK, FlexMessage.ask_location(), uid)
+                elif missing_field == 'days':
+                    shared.user_stage[uid] = 'got_days'
+                    # Prepare quick-reply options for trip duration
+                    days_options = ["兩天一夜", "三天兩夜", "四天三夜", "五天四夜"]
+                    qr_items = [
+                        QuickReplyButton(
+                            action=MessageAction(
+                                label=to_en(d) if current_lang == 'en' else d,
+                                text = to_en(d) if current_lang == 'en' else d
+                            )
+                        )
+                        for d in days_options
+                    ]
+                    safe_reply(replyTK, TextSendMessage(text=_t("ask_days", current_lang),
+                                                        quick_reply=QuickReply(items=qr_items)), uid)
                 return
 
-        # —— 2) 階段流程 ——
-        stage = shared.user_stage.get(uid, 'ask_language')
-        print(f"[Stage flow] type={msgType}, text={text}, stage={stage}")
+            # All data collected, proceed to itinerary planning
+            handle_free_command(uid, text, replyTK)
+            return
 
-        # 第一步：選擇語言
-        if stage == 'ask_language' and msgType == "text":
-            if low in ("中文", "zh", "english", "en"):
-                handle_language(uid, text, replyTK)
-            else:
-                safe_reply(replyTK, TextSendMessage(text=_t("invalid_language", _get_lang(uid))), uid)
+        # Other free commands and keyword-based searches
+        if (low in crowd_keys or low in rec_keys or low in sust_keys or 
+            low in gen_keys or low in nearby_keys or low in rental_keys or is_keyword):
+            handle_free_command(uid, text, replyTK)
             return
 
-        # **(Removed 'got_language' check – no longer needed)**
+    # —— 2) 階段流程 ——
+    stage = shared.user_stage.get(uid, 'ask_language')
+    print(f"[Stage flow] type={msgType}, text={text}, stage={stage}")
 
-        # 第二步：輸入年齡
-        if stage == 'got_age' and msgType == "text":
-            handle_age(uid, text, replyTK)
-            return
-        # 第三步：處理性別
-        if stage == 'got_gender' and msgType == "text":
-            handle_gender(uid, text, replyTK)
-            return
+    # 第一步：選擇語言
+    if stage == 'ask_language' and msgType == "text":
+        if low in ("中文", "zh", "english", "en"):
+            handle_language(uid, text, replyTK)
+        else:
+            safe_reply(replyTK, TextSendMessage(text=_t("invalid_language", _get_lang(uid))), uid)
+        return
 
-        # 第四步：處理位置（Location message）
-        if stage == 'got_location' and msgType == "location":
-            handle_location(uid, msg, replyTK)
-            return
+    # **(Removed 'got_language' check – no longer needed)**
 
-        # 第五步：處理天數
-        if stage == 'got_days' and msgType == "text":
-            handle_days(uid, text, replyTK)
-            return
+    # 第二步：輸入年齡
+    if stage == 'got_age' and msgType == "text":
+        handle_age(uid, text, replyTK)
+        return
+    # 第三步：處理性別
+    if stage == 'got_gender' and msgType == "text":
+        handle_gender(uid, text, replyTK)
+        return
 
-        # 第六步：Ready 階段的自由指令
-        if stage == 'ready' and msgType == "text":
-            handle_free_command(uid, text, replyTK)
-            return
+    # 第四步：處理位置（Location message）
+    if stage == 'got_location' and msgType == "location":
+        handle_location(uid, msg, replyTK)
+        return
 
-        # 處理圖片訊息
-        if msgType == "image":
-            safe_reply(replyTK, TextSendMessage(text=_t("data_fetch_failed", _get_lang(uid))), uid)
-            return
+    # 第五步：處理天數
+    if stage == 'got_days' and msgType == "text":
+        handle_days(uid, text, replyTK)
+        return
 
-        # 處理貼圖訊息
-        if msgType == "sticker":
-            safe_reply(replyTK, StickerSendMessage(package_id=msg.get("packageId"),
-                                                   sticker_id=msg.get("stickerId")), uid)
-            return
+    # 第六步：Ready 階段的自由指令
+    if stage == 'ready' and msgType == "text":
+        handle_free_command(uid, text, replyTK)
+        return
 
-        # 其他類型的訊息不處理
+    # 處理圖片訊息
+    if msgType == "image":
+        safe_reply(replyTK, TextSendMessage(text=_t("data_fetch_failed", _get_lang(uid))), uid)
         return
 
+    # 處理貼圖訊息
+    if msgType == "sticker":
+        safe_reply(replyTK, StickerSendMessage(package_id=msg.get("packageId"),
+                                               sticker_id=msg.get("stickerId")), uid)
+        return
 
+    # 其他類型的訊息不處理
+    return
 
 
-import threading
-import time
-
-def cleanup_used_tokens():
-    """定期清理已使用的 reply token (每小時執行一次)"""
-    while True:
-        time.sleep(3600)  # 1小時
-        used_reply_tokens.clear()
-        print("Cleaned up used reply tokens")
-
-# 啟動清理執行緒
-cleanup_thread = threading.Thread(target=cleanup_used_tokens, daemon=True)
-cleanup_thread.start()
 
 # ================= MAIN =========================================== #
 if __name__ == "__main__":
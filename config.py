@@ -81,6 +81,7 @@ BEACON_INPUT_CSV      = path.join(BASE_CSV_PATH, "Beacon20220907-crowd.csv")
 BEACON_OUTPUT_CSV     = path.join(BASE_CSV_PATH, "Beacon20220907-crowd-placeid10.csv")
 PENGHU_ORIGINAL_CSV   = path.join(BASE_CSV_PATH, "penghu_orignal2.csv")
 GENERATED_DATA_CSV    = path.join(BASE_CSV_PATH, "generated_data_updated1.csv")
+DAILY_CROWD_STATS_CSV = path.join(BASE_PROJECT, "daily_crowd_stats.csv")
 
 SUSTAINABLE_ATTR_CSV  = path.join(BASE_CSV_PATH, "test", "Sustainable",      "locations_Attractions.csv")
 NON_SUSTAINABLE_ATTR_CSV = path.join(BASE_CSV_PATH, "test", "non Sustainable", "penghu_Attractions.csv")
@@ -98,6 +99,47 @@ SUSTAINABLE_MODEL_PATH          = path.join(MODEL_DIR, "sustainable_Attractions.
 NON_SUSTAINABLE_MODEL_PATH      = path.join(MODEL_DIR, "non_sustainable_attraction.bin")
 SUSTAINABLE_NON_MODEL_PATH      = path.join(MODEL_DIR, "sustainable_non_Attractions.bin")
 NON_SUSTAINABLE_NON_MODEL_PATH  = path.join(MODEL_DIR, "non_sustainable_non_Attractions.bin")
+MODEL_BUNDLE_DIR                = os.getenv("MODEL_BUNDLE_DIR", path.join(MODEL_DIR, "model_bundles"))
+MODEL_RELOAD_INTERVAL           = int(os.getenv("MODEL_RELOAD_INTERVAL", 60))   # 秒；hot-reload 檢查間隔
+INFERENCE_BATCH_MS              = float(os.getenv("INFERENCE_BATCH_MS", 5))     # micro-batch 收集視窗；0 = 停用
+LOOKUP_TOP_N                    = int(os.getenv("LOOKUP_TOP_N", 10))            # 離線查表每格保留的景點數
+INFERENCE_BATCH_MAX             = int(os.getenv("INFERENCE_BATCH_MAX", 64))     # 單批最多列數
+PLANNING_WORKERS                = int(os.getenv("PLANNING_WORKERS", 4))         # 背景行程規劃的固定 worker 數
+PLANNING_QUEUE_SIZE             = int(os.getenv("PLANNING_QUEUE_SIZE", 32))     # 等待中的規劃工作上限；滿了直接回覆忙碌
+MAPS_LOOKUP_CONCURRENCY         = int(os.getenv("MAPS_LOOKUP_CONCURRENCY", 8))   # 重排名時同時查詢的景點數
+DISTANCE_MATRIX_MAX_DESTINATIONS = 25                                            # Distance Matrix 單次 origins=1 的目的地上限
+PLACE_CACHE_DB                  = os.getenv("PLACE_CACHE_DB", path.join(BASE_PROJECT, "place_cache.db"))
+PLACE_ID_TTL                    = int(os.getenv("PLACE_ID_TTL", 30 * 86400))    # 秒；查到 place_id 的快取時間
+PLACE_ID_NEGATIVE_TTL           = int(os.getenv("PLACE_ID_NEGATIVE_TTL", 86400)) # 秒；查無結果的快取時間
+DISTANCE_MODE                   = os.getenv("DISTANCE_MODE", "local")           # local = 本地 haversine / 路網矩陣；google = 再用 Distance Matrix 精修
+ROAD_DISTANCE_MATRIX            = os.getenv("ROAD_DISTANCE_MATRIX", path.join(BASE_CSV_PATH, "road_distance.npz"))
+ROAD_SNAP_KM                    = float(os.getenv("ROAD_SNAP_KM", 0.3))          # 使用者距最近景點在此範圍內才套用路網矩陣
+NEARBY_SORT                     = os.getenv("NEARBY_SORT", "rating")            # 附近搜尋排序：rating / distance
+MAPS_QPS                        = float(os.getenv("MAPS_QPS", 20))               # Maps API token bucket：每秒補充量
+MAPS_BURST                      = int(os.getenv("MAPS_BURST", 40))               # token bucket 容量
+MAPS_POOL_SIZE                  = int(os.getenv("MAPS_POOL_SIZE", 20))           # keep-alive 連線池大小
+MAPS_MAX_RETRIES                = int(os.getenv("MAPS_MAX_RETRIES", 3))          # 暫時性錯誤的重試次數
+MAPS_TIMEOUT                    = float(os.getenv("MAPS_TIMEOUT", 5))            # 秒；單次請求逾時
+NEARBY_DETAILS_LIMIT            = int(os.getenv("NEARBY_DETAILS_LIMIT", 10))     # 附近搜尋只抓前 N 筆 Place Details（Carousel 顯示 10 筆）
+NEARBY_DETAILS_CONCURRENCY      = int(os.getenv("NEARBY_DETAILS_CONCURRENCY", 5))
+NEARBY_DETAILS_DEADLINE         = float(os.getenv("NEARBY_DETAILS_DEADLINE", 3)) # 秒；逾時未回來的 Details 直接略過
+NEARBY_CACHE_PRECISION          = int(os.getenv("NEARBY_CACHE_PRECISION", 6))    # geohash 長度（6 ≈ 1.2 km × 0.6 km）
+NEARBY_CACHE_TTL                = int(os.getenv("NEARBY_CACHE_TTL", 1800))       # 秒
+NEARBY_CACHE_SIZE               = int(os.getenv("NEARBY_CACHE_SIZE", 512))       # LRU 最多保留的格數
+NEARBY_RESULT_LOG               = os.getenv("NEARBY_RESULT_LOG", "")             # 附近搜尋結果的 append-only JSONL 紀錄；空字串 = 不紀錄
+POPULARITY_SNAPSHOT             = os.getenv("POPULARITY_SNAPSHOT", path.join(BASE_CSV_PATH, "popularity_snapshot.npz"))
+POPULARITY_REFRESH_INTERVAL     = int(os.getenv("POPULARITY_REFRESH_INTERVAL", 3600))  # 秒；populartimes 快照更新週期
+CROWD_TOP_K                     = int(os.getenv("CROWD_TOP_K", 5))              # 「目前最擁擠」清單的景點數（預先排好並組好訊息）
+SHARED_SQLITE_POOL_SIZE         = int(os.getenv("SHARED_SQLITE_POOL_SIZE", 16))  # shared 每個 db 檔保留的閒置連線數
+SHARED_SQLITE_MMAP_SIZE         = int(os.getenv("SHARED_SQLITE_MMAP_SIZE", 64 * 1024 * 1024))  # bytes；PRAGMA mmap_size
+SHARED_SQLITE_CACHE_KB          = int(os.getenv("SHARED_SQLITE_CACHE_KB", 8192)) # KiB；PRAGMA cache_size（每條連線）
+STATE_BACKEND                   = os.getenv("STATE_BACKEND", "sqlite")          # shared 狀態後端：sqlite / memory / remote
+STATE_BACKEND_URL               = os.getenv("STATE_BACKEND_URL", "tcp://127.0.0.1:7379")  # remote：state server 位址（python state_backend.py）
+STATE_BACKEND_TIMEOUT           = float(os.getenv("STATE_BACKEND_TIMEOUT", 2))   # 秒；remote 單次請求逾時
+STATE_BACKEND_TOKEN             = os.getenv("STATE_BACKEND_TOKEN", "")            # remote：與 state server 共用的密鑰；空字串 = 不驗證（僅限本機 / 私有網路）
+STATE_LOCK_TTL                  = float(os.getenv("STATE_LOCK_TTL", 60))         # 秒；使用者事件鎖的租約上限（持有者當掉時自動釋放）
+REPLY_TOKEN_TTL                 = float(os.getenv("REPLY_TOKEN_TTL", 60))        # 秒；已用 reply token 的記憶時間（LINE reply token 約一分鐘內有效）
+REPLY_TOKEN_BUCKETS             = int(os.getenv("REPLY_TOKEN_BUCKETS", 6))       # 上面時間切成幾個桶；每過一桶清掉最舊的一桶
 
 # ──────────────────────────────────────────────────────────────
 # 8. MySQL 連線資訊
@@ -0,0 +1,130 @@
+# crowd_stats.py
+"""
+crowd_stats.py
+──────────────
+daily_crowd_stats.csv（hour, place, count）的記憶體模型：
+
+  • 讀一次，轉成稠密矩陣 counts[place, hour]（24 欄，無資料為 NaN）
+  • avg(place)：該景點有資料的小時平均，四捨五入成整數
+                （與 groupby("place")["count"].mean().round().astype(int) 相同）
+  • at(place, hour)：單格人潮
+  • top_k(hour, k)：該小時人潮最多的前 k 個景點（同數量依景點在檔案中首次出現的順序）
+  • top(hour, lang, k)：(景點 list, 「1. 景點(人數)」逐行的訊息字串)
+
+載入時就把 24 個小時各自依人潮排好序（ranked[hour]），並預先組好 CROWD_TOP_K 筆的
+中 / 英訊息；請求路徑上只剩切片與 dict 查詢。
+檔案 mtime 變動時自動重新載入，不再每次 read_csv。
+"""
+from __future__ import annotations
+
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from config import DAILY_CROWD_STATS_CSV, CROWD_TOP_K
+from zh2en import to_en
+
+HOURS = 24
+LANGS = ("zh", "en")
+
+
+class CrowdStats:
+    def __init__(self, csv_path=DAILY_CROWD_STATS_CSV):
+        self.csv_path = csv_path
+        self.version = os.path.getmtime(csv_path)
+
+        df = pd.read_csv(csv_path, encoding="utf-8-sig")
+        self.places = pd.unique(df["place"]).tolist()
+        self.index = {place: i for i, place in enumerate(self.places)}
+
+        # 同一 (place, hour) 出現多列時加總
+        rows = df["place"].map(self.index).to_numpy()
+        hours = df["hour"].to_numpy(dtype=int)
+        counts = np.zeros((len(self.places), HOURS))
+        present = np.zeros_like(counts, dtype=bool)
+        np.add.at(counts, (rows, hours), df["count"].to_numpy(dtype=float))
+        present[rows, hours] = True
+        counts[~present] = np.nan
+        self.counts = counts
+
+        # avg 以原始列計算（與 groupby mean 完全一致）
+        mean = df.groupby("place", sort=False)["count"].mean().round().astype(int)
+        self.avg_vec = mean.reindex(self.places).to_numpy()
+        self._avg_dict = dict(zip(self.places, self.avg_vec.tolist()))
+
+        # 每小時預先排序：ranked[hour] = 有資料的景點索引，人潮由多到少
+        self.ranked = []
+        for hour in range(HOURS):
+            col = counts[:, hour]
+            valid = np.flatnonzero(~np.isnan(col))
+            self.ranked.append(valid[np.argsort(-col[valid], kind="stable")])
+
+        # (hour, k, lang) → (places, msg)；預設 k 先全部組好，其他 k 第一次用到時才組
+        self._top: dict[tuple, tuple[list[str], str]] = {}
+        for hour in range(HOURS):
+            for lang in LANGS:
+                self._build_top(hour, CROWD_TOP_K, lang)
+
+    def _build_top(self, hour, k, lang):
+        top = self.top_k(hour, k)
+        label = to_en if lang == "en" else str
+        msg = "\n".join(f"{i+1}. {label(place)}({count})" for i, (place, count) in enumerate(top))
+        entry = ([place for place, _ in top], msg)
+        self._top[(hour, k, lang)] = entry
+        return entry
+
+    def avg(self, place, default=0) -> int:
+        i = self.index.get(place)
+        return int(self.avg_vec[i]) if i is not None else default
+
+    def avg_dict(self) -> dict:
+        """{place: avg_count}（共用物件，請勿修改）"""
+        return self._avg_dict
+
+    def at(self, place, hour, default=0) -> int:
+        i = self.index.get(place)
+        if i is None or not 0 <= hour < HOURS or np.isnan(self.counts[i, hour]):
+            return default
+        return int(self.counts[i, hour])
+
+    def top_k(self, hour, k=CROWD_TOP_K) -> list[tuple[str, int]]:
+        """[(place, count), ...] 依人潮由多到少"""
+        col = self.counts[:, hour]
+        return [(self.places[i], int(col[i])) for i in self.ranked[hour][:k]]
+
+    def top(self, hour, lang="zh", k=CROWD_TOP_K) -> tuple[list[str], str]:
+        """(景點名稱 list, 訊息字串)；回傳的是共用物件，請勿修改"""
+        entry = self._top.get((hour, k, lang))
+        return entry if entry is not None else self._build_top(hour, k, lang)
+
+
+_stats: dict[str, CrowdStats] = {}
+_lock = threading.Lock()
+
+def get(csv_path=DAILY_CROWD_STATS_CSV) -> CrowdStats:
+    """取得（必要時載入 / 重載）人潮統計"""
+    stats = _stats.get(csv_path)
+    if stats is not None and stats.version == os.path.getmtime(csv_path):
+        return stats
+    with _lock:
+        stats = _stats.get(csv_path)
+        if stats is None or stats.version != os.path.getmtime(csv_path):
+            stats = CrowdStats(csv_path)
+            _stats[csv_path] = stats
+            print(f"[crowd_stats] loaded {os.path.basename(csv_path)}: "
+                  f"{len(stats.places)} places × {HOURS} hours")
+    return stats
+
+def top_k(hour, k=CROWD_TOP_K) -> list[tuple[str, int]]:
+    return get().top_k(hour, k)
+
+def top(hour, lang="zh", k=CROWD_TOP_K) -> tuple[list[str], str]:
+    return get().top(hour, lang, k)
+
+def avg(place, default=0) -> int:
+    return get().avg(place, default)
+
+def at(place, hour, default=0) -> int:
+    return get().at(place, hour, default)
@@ -0,0 +1,179 @@
+# geo_distance.py
+"""
+geo_distance.py
+───────────────
+本地距離計算，取代每個景點一次的 Google Distance Matrix 往返：
+
+  • haversine_km：NumPy 向量化大圓距離，一次算完所有候選列
+  • RoadMatrix：已知景點之間預先算好的行車距離（ROAD_DISTANCE_MATRIX, .npz）；
+    使用者位置距最近景點在 ROAD_SNAP_KM 以內時，以「最近景點 → 目的地」的路網距離
+    加上吸附距離估計，其餘情況退回 haversine
+  • distances_km(origin, names, lats, lngs)：上面兩者的組合，無座標的列為 NaN
+  • geohash：座標 → geohash 字串（附近搜尋快取的分格鍵）
+
+澎湖範圍內直線距離已足夠排序；需要精確行車距離時由呼叫端（DISTANCE_MODE=google）
+另外向 Distance Matrix 精修。
+
+離線建立路網矩陣（會呼叫 Distance Matrix API）：
+    python geo_distance.py
+"""
+from __future__ import annotations
+
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from config import (
+    ROAD_DISTANCE_MATRIX, ROAD_SNAP_KM, DISTANCE_MATRIX_MAX_DESTINATIONS,
+    PLAN_2DAY, PLAN_3DAY, PLAN_4DAY, PLAN_5DAY,
+)
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def to_float(values) -> np.ndarray:
+    """字串 / 數值座標 → float64 陣列，無法轉換的為 NaN"""
+    return pd.to_numeric(pd.Series(list(values), dtype=object), errors="coerce").to_numpy(dtype=np.float64)
+
+def haversine_km(lat, lng, lats, lngs) -> np.ndarray:
+    """(lat, lng) 到每個 (lats[i], lngs[i]) 的大圓距離（公里）"""
+    lat1, lng1 = np.radians(float(lat)), np.radians(float(lng))
+    lat2, lng2 = np.radians(to_float(lats)), np.radians(to_float(lngs))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+_GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+def geohash(lat, lng, precision=6) -> str:
+    """標準 geohash 編碼；precision=6 約 1.2 km × 0.6 km 一格"""
+    lat_rng, lng_rng = [-90.0, 90.0], [-180.0, 180.0]
+    lat, lng = float(lat), float(lng)
+    bits, even, out = 0, True, []
+    for i in range(precision * 5):
+        rng, val = (lng_rng, lng) if even else (lat_rng, lat)
+        mid = (rng[0] + rng[1]) / 2
+        bits <<= 1
+        if val >= mid:
+            bits |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        if i % 5 == 4:
+            out.append(_GEOHASH_BASE32[bits])
+            bits = 0
+    return "".join(out)
+
+
+# ────────────────────────────────
+# 1. 預先計算的景點間路網距離
+class RoadMatrix:
+    def __init__(self, path=ROAD_DISTANCE_MATRIX):
+        data = np.load(path, allow_pickle=False)
+        self.version = os.path.getmtime(path)
+        self.names = data["names"].tolist()
+        self.lats = data["lats"]
+        self.lngs = data["lngs"]
+        self.km = data["km"]                     # shape (n, n)，NaN = 無資料
+        self.index = {name: i for i, name in enumerate(self.names)}
+
+    def from_point(self, lat, lng, names) -> np.ndarray | None:
+        """
+        使用者吸附到最近的已知景點後，回傳到 names 的路網距離（未知景點為 NaN）；
+        最近景點超過 ROAD_SNAP_KM 時回傳 None。
+        """
+        snap = haversine_km(lat, lng, self.lats, self.lngs)
+        nearest = int(np.nanargmin(snap))
+        if snap[nearest] > ROAD_SNAP_KM:
+            return None
+        cols = np.array([self.index.get(n, -1) for n in names])
+        out = np.full(len(cols), np.nan)
+        known = cols >= 0
+        out[known] = self.km[nearest, cols[known]] + snap[nearest]
+        return out
+
+_matrix: RoadMatrix | None = None
+_matrix_lock = threading.Lock()
+
+def road_matrix() -> RoadMatrix | None:
+    """讀取（必要時重載）路網矩陣；檔案不存在時回傳 None"""
+    global _matrix
+    try:
+        version = os.path.getmtime(ROAD_DISTANCE_MATRIX)
+    except OSError:
+        return None
+    if _matrix is not None and _matrix.version == version:
+        return _matrix
+    with _matrix_lock:
+        if _matrix is None or _matrix.version != version:
+            try:
+                _matrix = RoadMatrix()
+            except Exception as e:
+                print(f"⚠️ [geo_distance] 載入 {ROAD_DISTANCE_MATRIX} 失敗：{e}")
+                return None
+    return _matrix
+
+
+def distances_km(lat, lng, names, lats, lngs) -> np.ndarray:
+    """
+    使用者位置到每一列的距離（公里）：有路網矩陣時優先採用，其餘列用 haversine。
+    座標無效的列為 NaN。
+    """
+    dist = haversine_km(lat, lng, lats, lngs)
+    matrix = road_matrix()
+    if matrix is not None:
+        road = matrix.from_point(lat, lng, list(names))
+        if road is not None:
+            dist = np.where(np.isnan(road), dist, road)
+    return dist
+
+
+# ────────────────────────────────
+# 2. 離線建立路網矩陣
+def known_places(csv_paths=(PLAN_2DAY, PLAN_3DAY, PLAN_4DAY, PLAN_5DAY)) -> pd.DataFrame:
+    """各 plan CSV 中出現過的景點（名稱 + 第一次出現的座標）"""
+    frames = [pd.read_csv(p, encoding="utf-8-sig", dtype=str, usecols=["設置點", "緯度", "經度"])
+              for p in csv_paths]
+    df = pd.concat(frames).drop_duplicates("設置點").reset_index(drop=True)
+    df["緯度"], df["經度"] = to_float(df["緯度"]), to_float(df["經度"])
+    return df.dropna().reset_index(drop=True)
+
+def build_road_matrix(gmaps, places: pd.DataFrame, out_path=ROAD_DISTANCE_MATRIX) -> str:
+    """
+    以 Distance Matrix（每次 1 個起點 × 最多 25 個目的地）算出景點間行車距離，
+    寫成 .npz（names / lats / lngs / km）。失敗的格子保留 NaN。
+    """
+    n = len(places)
+    coords = [f"{lat},{lng}" for lat, lng in zip(places["緯度"], places["經度"])]
+    km = np.full((n, n), np.nan)
+    np.fill_diagonal(km, 0.0)
+    for i, origin in enumerate(coords):
+        for start in range(0, n, DISTANCE_MATRIX_MAX_DESTINATIONS):
+            dests = coords[start:start + DISTANCE_MATRIX_MAX_DESTINATIONS]
+            try:
+                matrix = gmaps.distance_matrix(origins=[origin], destinations=dests,
+                                               mode="driving", units="metric")
+                elements = matrix["rows"][0]["elements"]
+            except Exception as e:
+                print(f"⚠️ [geo_distance] row {i} chunk {start} 失敗：{e}")
+                continue
+            for j, elem in enumerate(elements, start):
+                if elem.get("status") == "OK":
+                    km[i, j] = elem["distance"]["value"] / 1000
+        print(f"[geo_distance] {i + 1}/{n} {places['設置點'][i]}")
+
+    tmp_path = out_path + ".tmp.npz"
+    np.savez(tmp_path, names=places["設置點"].to_numpy(dtype=str),
+             lats=places["緯度"].to_numpy(), lngs=places["經度"].to_numpy(), km=km)
+    os.replace(tmp_path, out_path)
+    print(f"[geo_distance] {n}×{n} road matrix → {out_path}")
+    return out_path
+
+
+if __name__ == "__main__":
+    import maps_gateway
+    build_road_matrix(maps_gateway.client(), known_places())
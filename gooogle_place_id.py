@@ -1,15 +1,36 @@
 # add_place_id.py
 
 import csv
-import googlemaps
 import time
-import os
+
+import maps_gateway
+import place_cache
 
 from config import BEACON_INPUT_CSV, BEACON_OUTPUT_CSV
 
-# 設定你的 Google API 金鑰（請確保環境變數 GOOGLE_MAPS_API_KEY 已正確設定）
-API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
-gmaps = googlemaps.Client(key=API_KEY)
+# 經 maps_gateway 共用的 Google Maps client（請確保環境變數 GOOGLE_MAPS_API_KEY 已正確設定）
+gmaps = maps_gateway.client()
+
+def _find_place_id(place_name):
+    """
+    以名稱查 place_id。回傳 (place_id, ok)：查無結果時 place_id 為 ""；
+    ok=False 表示 API 錯誤，結果不應寫入快取。
+    """
+    try:
+        return maps_gateway.find_place_id(place_name), True
+    except Exception as e:
+        print(f"API 查詢錯誤，地點名稱: {place_name}，錯誤: {e}")
+        return "", False
+
+def _reverse_geocode_id(lat, lng):
+    """座標逆向地理編碼取得的地址 place_id（不是景點本身，只給 CSV 當備援）"""
+    try:
+        reverse_geocode_result = gmaps.reverse_geocode((lat, lng))
+        if reverse_geocode_result:
+            return reverse_geocode_result[0].get("place_id", "")
+    except Exception as e:
+        print(f"逆向地理編碼錯誤，座標({lat}, {lng})，錯誤: {e}")
+    return ""
 
 def add_place_id_to_csv(infile, outfile, limit=6000):
     # 讀取時假設檔案編碼為 utf-8-sig，根據實際檔案調整編碼
@@ -39,38 +60,25 @@ def add_place_id_to_csv(infile, outfile, limit=6000):
             lat = row.get("緯度", "")
             lng = row.get("經度", "")
 
-            place_id = ""
-
-            # 先以地點名稱查詢
-            try:
-                response = gmaps.find_place(
-                    input=place_name, 
-                    input_type="textquery", 
-                    fields=["place_id"]
-                )
-            except Exception as e:
-                print(f"API 查詢錯誤，地點名稱: {place_name}，錯誤: {e}")
-                response = {}
-
-            if response.get("status") == "OK" and response.get("candidates"):
-                place_id = response["candidates"][0].get("place_id", "")
-            else:
-                # 若以名稱查詢無結果，嘗試逆向地理編碼
-                try:
-                    reverse_geocode_result = gmaps.reverse_geocode((lat, lng))
-                    if reverse_geocode_result:
-                        place_id = reverse_geocode_result[0].get("place_id", "")
-                except Exception as e:
-                    print(f"逆向地理編碼錯誤，座標({lat}, {lng})，錯誤: {e}")
-                    place_id = ""
+            # 先查共用的 place_id 快取（與線上重排名同一顆資料庫）
+            place_id = place_cache.get(place_name) if place_name else None
+            if place_id is None:
+                place_id, ok = _find_place_id(place_name)
+                # 共用快取只放 find_place 的結果（查無結果則為 ""）
+                if ok and place_name:
+                    place_cache.put(place_name, place_id)
+                # 延遲以避免 API 請求過快（命中快取時不必等待）
+                time.sleep(0.1)
+
+            # 以名稱查不到時，CSV 改填座標逆向地理編碼的地址 place_id；
+            # 它不是景點本身的 id，不可寫入共用快取，否則線上重排名與人潮快照會拿到地址的資料
+            if not place_id:
+                place_id = _reverse_geocode_id(lat, lng)
 
             row["place_id"] = place_id
             writer.writerow(row)
             count += 1
 
-            # 延遲以避免 API 請求過快
-            time.sleep(0.1)
-
     print(f"已將前 {count} 筆查詢到的 place_id 寫入新檔案: {outfile}")
 
 if __name__ == "__main__":
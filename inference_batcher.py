@@ -0,0 +1,156 @@
+# inference_batcher.py
+"""
+inference_batcher.py
+────────────────────
+XGBoost 推論的 micro-batching 排程器。
+
+高併發時每個請求都只帶 1×5 的特徵列；這裡把 INFERENCE_BATCH_MS 毫秒內
+抵達的請求收集成一個 NumPy 矩陣，只呼叫一次 predict_proba，再把每列結果
+交還給各自等待中的 greenlet / thread。
+
+在 gevent monkey-patch 下 queue / threading.Event 都是協作式的，
+等待結果不會卡住 event loop。INFERENCE_BATCH_MS=0 時直接同步推論。
+"""
+from __future__ import annotations
+
+import queue
+import threading
+import time
+
+import numpy as np
+from prometheus_client import Histogram
+
+import model_registry
+from config import INFERENCE_BATCH_MS, INFERENCE_BATCH_MAX
+
+BATCH_SIZE_HIST = Histogram(
+    name="inference_batch_size",
+    documentation="Rows per micro-batched predict_proba call",
+    labelnames=("model",),
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+
+
+class _Request:
+    __slots__ = ("row", "event", "model", "proba", "error")
+
+    def __init__(self, row):
+        self.row = row
+        self.event = threading.Event()
+        self.model = None
+        self.proba = None
+        self.error = None
+
+
+class MicroBatcher:
+    """單一模型的批次排程器；背景執行緒在第一次 submit 時啟動"""
+
+    def __init__(self, name, max_wait_ms=INFERENCE_BATCH_MS, max_batch=INFERENCE_BATCH_MAX):
+        self.name = name
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch = max_batch
+        self._queue: queue.Queue[_Request] = queue.Queue()
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def _ensure_worker(self):
+        if self._started:
+            return
+        with self._start_lock:
+            if not self._started:
+                threading.Thread(
+                    target=self._run, daemon=True, name=f"batcher-{self.name}"
+                ).start()
+                self._started = True
+
+    def submit(self, row):
+        """
+        送出單列原始特徵，等待批次結果；回傳 (LoadedModel, 機率向量)。
+        該列特徵無法編碼（例如未知天氣）時拋出原本的例外。
+        """
+        if self.max_wait <= 0:
+            model = model_registry.get(self.name)
+            return model, model.predict_proba([row])[0]
+
+        req = _Request(row)
+        self._ensure_worker()
+        self._queue.put(req)
+        req.event.wait()
+        if req.error is not None:
+            raise req.error
+        return req.model, req.proba
+
+    # ── 背景：收集 → 一次 predict_proba → 分發 ──
+    def _collect(self) -> list[_Request]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._infer(batch)
+            except Exception as e:
+                for req in batch:
+                    if not req.event.is_set():
+                        req.error = e
+                        req.event.set()
+
+    def _infer(self, batch):
+        model = model_registry.get(self.name)
+        try:
+            X = model.encode([req.row for req in batch])
+            ok = batch
+        except ValueError:
+            # 有列無法編碼：逐列編碼，只讓出錯的那幾列失敗
+            rows, ok = [], []
+            for req in batch:
+                try:
+                    rows.append(model.encode([req.row])[0])
+                    ok.append(req)
+                except ValueError as e:
+                    req.error = e
+                    req.event.set()
+            if not ok:
+                return
+            X = np.vstack(rows)
+
+        proba = model.model.predict_proba(X)
+        BATCH_SIZE_HIST.labels(self.name).observe(len(ok))
+        for req, p in zip(ok, proba):
+            req.model = model
+            req.proba = p
+            req.event.set()
+
+
+# ────────────────────────────────
+# 模組層級：每個模型一個 batcher
+_batchers: dict[str, MicroBatcher] = {}
+_lock = threading.Lock()
+
+def get(name) -> MicroBatcher:
+    batcher = _batchers.get(name)
+    if batcher is None:
+        with _lock:
+            batcher = _batchers.setdefault(name, MicroBatcher(name))
+    return batcher
+
+def rank(name, row, exclude=(), k=5) -> list[str]:
+    """單列特徵經 micro-batch 推論後，回傳排除 exclude 的 top-k 景點"""
+    model, proba = get(name).submit(row)
+    return model.rank_from_proba(proba, exclude, k)[0]
+
+def best(name, row, exclude=()) -> str:
+    """單列最佳景點；全部被排除時退回未遮罩的第一名"""
+    model, proba = get(name).submit(row)
+    top = model.rank_from_proba(proba, exclude, k=1)[0] or model.rank_from_proba(proba, k=1)[0]
+    return top[0]
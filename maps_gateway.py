@@ -0,0 +1,179 @@
+# maps_gateway.py
+"""
+maps_gateway.py
+───────────────
+所有 Google Maps 呼叫的單一出入口：
+
+  • 一個共用的 requests.Session（keep-alive 連線池，MAPS_POOL_SIZE）
+  • 一個共用的 googlemaps.Client（建在上面的 Session 上，第一次使用時才建立）
+  • token bucket 限流（MAPS_QPS / MAPS_BURST），全行程共用
+  • 暫時性錯誤（逾時、連線錯誤、5xx、OVER_QUERY_LIMIT）以 exponential backoff + jitter 重試
+  • Prometheus：各 endpoint 的延遲分佈與錯誤次數
+
+用法與 googlemaps.Client 相同：
+
+    gmaps = maps_gateway.client()
+    gmaps.find_place(input=name, input_type="textquery", fields=["place_id"])
+
+googlemaps 套件不支援的欄位（例如 Place Details 的 populartimes）用 get_json 直接打 REST API。
+"""
+from __future__ import annotations
+
+import os
+import random
+import threading
+import time
+
+import googlemaps
+import requests
+from googlemaps import exceptions as gm_exceptions
+from prometheus_client import Counter, Histogram
+from requests.adapters import HTTPAdapter
+
+from config import MAPS_QPS, MAPS_BURST, MAPS_POOL_SIZE, MAPS_MAX_RETRIES, MAPS_TIMEOUT
+
+BASE_URL = "https://maps.googleapis.com"
+
+LATENCY_HIST = Histogram(
+    name="maps_request_latency_seconds",
+    documentation="Google Maps API latency per endpoint (including retries)",
+    labelnames=("endpoint",),
+    buckets=(0.05, 0.1, 0.25, 0.5, 0.75, 1, 2, 5, 10),
+)
+ERROR_COUNTER = Counter(
+    name="maps_request_errors_total",
+    documentation="Google Maps API errors per endpoint and kind",
+    labelnames=("endpoint", "kind"),       # retry / failed
+)
+
+_RETRY_STATUSES = {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR"}
+
+
+class TokenBucket:
+    """簡單的 token bucket；acquire() 在沒有 token 時 sleep（gevent 下為協作式）"""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(capacity))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def _is_transient(exc) -> bool:
+    if isinstance(exc, (gm_exceptions.Timeout, gm_exceptions.TransportError,
+                        requests.Timeout, requests.ConnectionError)):
+        return True
+    if isinstance(exc, gm_exceptions.ApiError):
+        return exc.status in _RETRY_STATUSES
+    if isinstance(exc, gm_exceptions.HTTPError):
+        return str(exc.status_code).startswith("5")
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        return exc.response.status_code >= 500
+    return False
+
+
+class MapsGateway:
+    def __init__(self, qps=MAPS_QPS, burst=MAPS_BURST, pool_size=MAPS_POOL_SIZE,
+                 max_retries=MAPS_MAX_RETRIES, timeout=MAPS_TIMEOUT):
+        self.bucket = TokenBucket(qps, burst)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    def _googlemaps(self) -> googlemaps.Client:
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    # 重試與限流由 gateway 負責；套件內建的只保留很短的 retry_timeout
+                    self._client = googlemaps.Client(
+                        key=os.getenv("GOOGLE_MAPS_API_KEY"),
+                        timeout=self.timeout,
+                        retry_timeout=1,
+                        retry_over_query_limit=False,
+                        queries_per_second=1000,
+                        requests_session=self.session,
+                    )
+        return self._client
+
+    def call(self, endpoint, fn, *args, **kwargs):
+        """限流 + 重試 + 計時執行 fn(*args, **kwargs)；重試用完後拋出最後一次的例外"""
+        start = time.perf_counter()
+        try:
+            for attempt in range(self.max_retries + 1):
+                self.bucket.acquire()
+                try:
+                    return fn(*args, **kwargs)
+                except Exception as e:
+                    if attempt >= self.max_retries or not _is_transient(e):
+                        ERROR_COUNTER.labels(endpoint, "failed").inc()
+                        raise
+                    ERROR_COUNTER.labels(endpoint, "retry").inc()
+                    # 0.25s, 0.5s, 1s … 再乘上 50%–150% 的 jitter
+                    time.sleep(0.25 * 2 ** attempt * (random.random() + 0.5))
+        finally:
+            LATENCY_HIST.labels(endpoint).observe(time.perf_counter() - start)
+
+    def get_json(self, endpoint, path, params) -> dict:
+        """直接以共用 Session 打 Maps REST API（自動帶 key），回傳 JSON"""
+        def _get():
+            resp = self.session.get(
+                BASE_URL + path,
+                params=dict(params, key=os.getenv("GOOGLE_MAPS_API_KEY")),
+                timeout=self.timeout,
+            )
+            resp.raise_for_status()
+            return resp.json()
+        return self.call(endpoint, _get)
+
+
+class _Client:
+    """googlemaps.Client 的替身：每個方法都經過 MapsGateway.call"""
+
+    def __init__(self, gateway):
+        self._gateway = gateway
+
+    def __getattr__(self, name):
+        method = getattr(self._gateway._googlemaps(), name)
+        if not callable(method):
+            return method
+
+        def _wrapped(*args, **kwargs):
+            return self._gateway.call(name, method, *args, **kwargs)
+        return _wrapped
+
+
+# ────────────────────────────────
+# 模組層級單例
+_gateway = MapsGateway()
+_client = _Client(_gateway)
+
+def client() -> _Client:
+    return _client
+
+def get_json(endpoint, path, params) -> dict:
+    return _gateway.get_json(endpoint, path, params)
+
+def find_place_id(name) -> str:
+    """以名稱 find_place 取第一個候選的 place_id；查無結果回傳 ""，API 錯誤照常拋出"""
+    res = _client.find_place(input=name, input_type="textquery", fields=["place_id"])
+    candidates = res.get("candidates") or []
+    return candidates[0].get("place_id", "") if candidates else ""
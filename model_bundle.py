@@ -0,0 +1,126 @@
+# model_bundle.py
+"""
+model_bundle.py
+───────────────
+版本化的模型 artifact bundle：booster 與編碼器一起發佈，推論端讀取時不必再碰 CSV。
+
+目錄結構（MODEL_BUNDLE_DIR）：
+    <name>/<version>/model.ubj   ← XGBoost booster
+    <name>/<version>/meta.json   ← 特徵欄位、weather 類別、one-hot 類別、目標類別、訓練資料 checksum
+    <name>/LATEST                ← 目前版本號；以 os.replace 原子切換
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import xgboost
+from sklearn.preprocessing import LabelEncoder, OneHotEncoder
+from xgboost import XGBClassifier
+
+from config import MODEL_BUNDLE_DIR
+
+BUNDLE_FORMAT = 1
+_MODEL_FILE = "model.ubj"
+_META_FILE = "meta.json"
+_LATEST_FILE = "LATEST"
+
+
+def _bundle_root(name) -> str:
+    return os.path.join(MODEL_BUNDLE_DIR, name)
+
+def latest_path(name) -> str:
+    """LATEST 指標檔路徑（registry 以其內容判斷是否需要 hot-reload）"""
+    return os.path.join(_bundle_root(name), _LATEST_FILE)
+
+def file_sha256(path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def latest_version(name) -> str | None:
+    try:
+        with open(latest_path(name), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+# ────────────────────────────────
+# 1. 發佈
+def save_bundle(name, model, feature_cols, labelencoder, onehot, le, data_path, params=None) -> str:
+    """
+    寫出一個新版本並切換 LATEST，回傳版本號。
+    labelencoder：weather 編碼器（可為 None）；onehot：OneHotEncoder（可為 None）；le：目標編碼器。
+    """
+    data_sha256 = file_sha256(data_path)
+    version = f"{time.strftime('%Y%m%d%H%M%S')}-{data_sha256[:8]}"
+    bundle_dir = os.path.join(_bundle_root(name), version)
+    os.makedirs(bundle_dir, exist_ok=True)
+
+    model.save_model(os.path.join(bundle_dir, _MODEL_FILE))
+    meta = {
+        "format": BUNDLE_FORMAT,
+        "name": name,
+        "version": version,
+        "created_at": int(time.time()),
+        "xgboost_version": xgboost.__version__,
+        "params": params or {},
+        "feature_cols": list(feature_cols),
+        "weather_classes": labelencoder.classes_.tolist() if labelencoder is not None else None,
+        "onehot_categories": [c.tolist() for c in onehot.categories_] if onehot is not None else None,
+        "label_classes": le.classes_.tolist(),
+        "data_path": os.path.basename(data_path),
+        "data_sha256": data_sha256,
+    }
+    with open(os.path.join(bundle_dir, _META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    tmp = latest_path(name) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp, latest_path(name))
+    print(f"[model_bundle] 已發佈 {name}@{version} → {bundle_dir}")
+    return version
+
+
+# ────────────────────────────────
+# 2. 讀取
+def _label_encoder(classes) -> LabelEncoder:
+    enc = LabelEncoder()
+    enc.classes_ = np.asarray(classes, dtype=object)
+    return enc
+
+def _onehot_encoder(categories) -> OneHotEncoder:
+    cats = [np.asarray(c, dtype=np.float64) for c in categories]
+    enc = OneHotEncoder(categories=cats, handle_unknown="ignore", sparse_output=False)
+    enc.fit(np.array([[c[0] for c in cats]], dtype=np.float64))
+    return enc
+
+def load_bundle(name, version=None) -> dict | None:
+    """
+    讀取 bundle（預設 LATEST）；不存在時回傳 None。
+    回傳 dict：model / meta / weather_encoder / onehot / label_encoder / version
+    """
+    version = version or latest_version(name)
+    if version is None:
+        return None
+    bundle_dir = os.path.join(_bundle_root(name), version)
+    with open(os.path.join(bundle_dir, _META_FILE), encoding="utf-8") as f:
+        meta = json.load(f)
+
+    model = XGBClassifier()
+    model.load_model(os.path.join(bundle_dir, _MODEL_FILE))
+    return {
+        "model": model,
+        "meta": meta,
+        "weather_encoder": _label_encoder(meta["weather_classes"]) if meta.get("weather_classes") is not None else None,
+        "onehot": _onehot_encoder(meta["onehot_categories"]) if meta.get("onehot_categories") is not None else None,
+        "label_encoder": _label_encoder(meta["label_classes"]),
+        "version": version,
+    }
@@ -0,0 +1,256 @@
+# model_registry.py
+"""
+model_registry.py
+─────────────────
+每個 worker 只載入一次的 XGBoost 推論服務：
+  • 首次使用（或啟動 warm-up）時載入編碼器 + booster，之後常駐記憶體
+  • 優先讀 XGBOOST_train.py 發佈的版本化 bundle（model_bundle），完全不讀 CSV；
+    沒有 bundle 時才退回「讀 CSV 擬合編碼器 + 舊版 .bin」
+  • predict(name, features) 直接推論，不再每次讀 CSV、重新訓練
+  • 背景執行緒監看 bundle 的 LATEST（或模型檔 mtime），發佈新版後自動 hot-reload
+
+features 每列依 MODEL_SPECS 的欄位順序，例如 recommend3：
+    [weather, gender, age, tidal, temperature]
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import LabelEncoder
+from xgboost import XGBClassifier
+
+try:
+    from gevent import get_hub
+    from gevent.monkey import is_module_patched
+except ImportError:                 # 離線訓練腳本不一定裝 gevent
+    get_hub = None
+
+import XGBOOST_train
+import model_bundle
+from config import MODEL_RELOAD_INTERVAL
+
+TREE_DEEP = XGBOOST_train.TREE_DEEP
+LEARNING_RATE = XGBOOST_train.LEARNING_RATE
+
+# ────────────────────────────────
+# 1. 已載入的模型
+class LoadedModel:
+    """booster + 編碼器；encode / predict 都只做記憶體運算"""
+
+    def __init__(self, name, model, feature_cols, label_encoder,
+                 weather_encoder=None, onehot=None, version=None):
+        self.name = name
+        self.model = model
+        self.feature_cols = list(feature_cols)
+        self.label_encoder = label_encoder
+        self.weather_encoder = weather_encoder
+        self.onehot = onehot
+        self.version = version
+        self.classes = label_encoder.classes_
+
+    def encode(self, features) -> np.ndarray:
+        """
+        原始特徵列 → 模型輸入矩陣。
+        weather 為未見過的標籤時拋出 ValueError（與 LabelEncoder 行為一致）。
+        """
+        rows = np.atleast_2d(np.asarray(features, dtype=object))
+        cols = []
+        for i, col in enumerate(self.feature_cols):
+            if col == "weather" and self.weather_encoder is not None:
+                cols.append(self.weather_encoder.transform(rows[:, i].astype(str)))
+            else:
+                cols.append(rows[:, i].astype(np.float64))
+        X = np.column_stack(cols).astype(np.float64)
+        if self.onehot is not None:
+            X = self.onehot.transform(X)
+        return X
+
+    def predict_proba(self, features) -> np.ndarray:
+        return self.model.predict_proba(self.encode(features))
+
+    def predict(self, features) -> np.ndarray:
+        predicted = self.model.predict(self.encode(features))
+        return self.label_encoder.inverse_transform(predicted)
+
+    def rank_from_proba(self, proba, exclude=(), k=5) -> list[list[str]]:
+        """
+        由機率矩陣取每列 top-k 景點；exclude 中的景點直接遮罩掉，不需重新訓練。
+        """
+        proba = np.array(proba, dtype=np.float64, ndmin=2)
+        if exclude:
+            proba[:, np.isin(self.classes, list(exclude))] = -1.0
+        k = min(k, proba.shape[1])
+        order = np.argsort(-proba, axis=1, kind="stable")[:, :k]
+        return [
+            [self.classes[i] for i in row if p[i] >= 0]
+            for row, p in zip(order, proba)
+        ]
+
+    def rank(self, features, exclude=(), k=5) -> list[list[str]]:
+        """一次 predict_proba 後遮罩 exclude，回傳每列 top-k 景點"""
+        return self.rank_from_proba(self.predict_proba(features), exclude, k)
+
+    def best(self, row, exclude=()) -> str:
+        """單列最佳景點；全部被排除時退回未遮罩的第一名"""
+        top = self.rank([row], exclude, k=1)[0] or self.rank([row], k=1)[0]
+        return top[0]
+
+
+# ────────────────────────────────
+# 2. 載入 / 訓練
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+def _fit(model, X, Y):
+    """
+    記憶體內訓練（沒有 bundle、plan CSV 變動時）。
+    app.py 以 monkey.patch_all 把 threading 換成 greenlet，背景 warm-up 直接訓練會卡住整個
+    event loop（recommend2 約 11 秒），所以改交給 hub 的原生執行緒池；
+    xgboost 訓練期間會釋放 GIL，同一個 worker 的 webhook 照常處理。
+    """
+    if get_hub is not None and is_module_patched("threading"):
+        return get_hub().threadpool.apply(model.fit, (X, Y))
+    return model.fit(X, Y)
+
+def _recommend_stamp(name):
+    """目前應載入的版本：bundle 版本號，沒有 bundle 時為舊版模型檔 mtime"""
+    return model_bundle.latest_version(name) or _mtime(XGBOOST_train.MODEL_SPECS[name][2])
+
+def _load_recommend(name) -> LoadedModel:
+    """
+    有 bundle 就直接載入（零 CSV I/O）；否則依 XGBOOST_train.MODEL_SPECS
+    擬合編碼器並載入舊版 booster，檔案不存在或不符時於記憶體內訓練一次（不覆寫檔案）。
+    """
+    bundle = model_bundle.load_bundle(name)
+    if bundle is not None:
+        print(f"[model_registry] {name} loaded from bundle {bundle['version']}")
+        return LoadedModel(name, bundle["model"], bundle["meta"]["feature_cols"],
+                           bundle["label_encoder"], weather_encoder=bundle["weather_encoder"],
+                           onehot=bundle["onehot"], version=bundle["version"])
+
+    csv_path, feature_cols, model_path = XGBOOST_train.MODEL_SPECS[name]
+    df_data = XGBOOST_train.load_training_frame(csv_path, feature_cols)
+    labelencoder, onehot, le, X_train, Y_train = XGBOOST_train.fit_encoders(df_data, feature_cols)
+
+    version = _mtime(model_path)
+    model = None
+    if version is not None:
+        try:
+            model = XGBClassifier()
+            model.load_model(model_path)
+            if (model.get_booster().num_features() != X_train.shape[1]
+                    or model.n_classes_ != len(le.classes_)):
+                print(f"⚠️ [model_registry] {model_path} 與訓練資料不符，改為記憶體內重新訓練")
+                model = None
+        except Exception as e:
+            print(f"⚠️ [model_registry] 載入 {model_path} 失敗：{e}")
+            model = None
+
+    if model is None:
+        model = XGBClassifier(n_estimators=TREE_DEEP, learning_rate=LEARNING_RATE)
+        _fit(model, X_train, Y_train)
+
+    print(f"[model_registry] {name} loaded (version={version})")
+    return LoadedModel(name, model, feature_cols, le,
+                       weather_encoder=labelencoder, onehot=onehot, version=version)
+
+def _load_plan(csv_path) -> LoadedModel:
+    """行程模板：(gender, age) → UserID/MemID，每個 plan CSV 只訓練一次"""
+    version = _mtime(csv_path)
+    plan_data = pd.read_csv(csv_path, encoding="utf-8-sig")
+    le = LabelEncoder()
+    X_train = plan_data[["gender", "age"]].values.astype(np.float64)
+    Y_train = le.fit_transform(plan_data["UserID/MemID"].values)
+
+    model = XGBClassifier(n_estimators=TREE_DEEP, learning_rate=LEARNING_RATE)
+    _fit(model, X_train, Y_train)
+    print(f"[model_registry] plan model loaded: {os.path.basename(csv_path)}")
+    return LoadedModel(csv_path, model, ["gender", "age"], le, version=version)
+
+
+# ────────────────────────────────
+# 3. Registry（模組層級單例）
+_models: dict[str, LoadedModel] = {}
+_sources: dict[str, tuple] = {}          # key → (loader, arg, stamp 函式)
+_lock = threading.Lock()
+
+def _get(key, loader, arg, stamp) -> LoadedModel:
+    entry = _models.get(key)
+    if entry is not None:
+        return entry
+    with _lock:
+        entry = _models.get(key)
+        if entry is None:
+            entry = loader(arg)
+            _models[key] = entry
+            _sources[key] = (loader, arg, stamp)
+    return entry
+
+def get(name) -> LoadedModel:
+    """取得 XGBOOST_train.MODEL_SPECS 中的模型（recommend1 / recommend2 / recommend3 …）"""
+    return _get(name, _load_recommend, name, lambda: _recommend_stamp(name))
+
+def plan_model(csv_path) -> LoadedModel:
+    """取得某份 plan_Nday.csv 的行程模板模型"""
+    return _get(f"plan:{csv_path}", _load_plan, csv_path, lambda: _mtime(csv_path))
+
+def predict(name, features) -> list:
+    """features：單列或多列原始特徵，回傳預測的景點名稱 list"""
+    return list(get(name).predict(features))
+
+def rank(name, features, exclude=(), k=5) -> list[list[str]]:
+    """features：單列或多列原始特徵，回傳每列排除 exclude 後的 top-k 景點"""
+    return get(name).rank(features, exclude, k)
+
+def reload_if_changed() -> list[str]:
+    """檢查各模型的版本（bundle LATEST / 檔案 mtime），有變動就重新載入並原子替換"""
+    reloaded = []
+    for key, (loader, arg, stamp) in list(_sources.items()):
+        current = _models.get(key)
+        if current is None or stamp() == current.version:
+            continue
+        try:
+            fresh = loader(arg)
+        except Exception as e:
+            print(f"⚠️ [model_registry] reload {key} 失敗，沿用舊模型：{e}")
+            continue
+        _models[key] = fresh
+        reloaded.append(key)
+    return reloaded
+
+
+# ────────────────────────────────
+# 4. 啟動 warm-up + hot-reload 監看
+_WATCHER_RUNNING = False
+
+def _watch_loop(interval):
+    while _WATCHER_RUNNING:
+        time.sleep(interval)
+        for key in reload_if_changed():
+            print(f"[model_registry] hot-reloaded {key}")
+
+def start(names=("recommend2", "recommend3"), interval: int = MODEL_RELOAD_INTERVAL):
+    """
+    在 app.py 啟動時呼叫一次：背景載入 names 指定的模型並開始監看。
+    """
+    global _WATCHER_RUNNING
+    if _WATCHER_RUNNING:
+        return
+    _WATCHER_RUNNING = True
+
+    def _warm_up():
+        for name in names:
+            try:
+                get(name)
+            except Exception as e:
+                print(f"⚠️ [model_registry] warm-up {name} 失敗：{e}")
+        _watch_loop(interval)
+
+    threading.Thread(target=_warm_up, daemon=True, name="model-registry").start()
@@ -0,0 +1,80 @@
+# nearby_cache.py
+"""
+nearby_cache.py
+───────────────
+附近搜尋結果的 geo 分格快取：
+
+  key   = (geohash 格子, 關鍵字, 語言, 排序方式)
+  value = googlemap_search_nearby 整理好的結果 list
+
+澎湖使用者集中在少數市區，搜尋的關鍵字也只有幾種（餐廳 / 停車場 / 風景區 / 住宿），
+同一格內的使用者共用一份結果，命中時完全不呼叫 Places API。
+每筆保留 NEARBY_CACHE_TTL 秒，超過 NEARBY_CACHE_SIZE 格時淘汰最久沒用的（LRU）。
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+
+from prometheus_client import Counter
+
+import geo_distance
+from config import NEARBY_CACHE_PRECISION, NEARBY_CACHE_TTL, NEARBY_CACHE_SIZE
+
+LOOKUP_COUNTER = Counter(
+    name="nearby_cache_lookups_total",
+    documentation="Nearby-search tile cache lookups by result",
+    labelnames=("result",),            # hit / miss / expired
+)
+
+
+class TTLCache:
+    """執行緒安全的 TTL + LRU 字典"""
+
+    def __init__(self, maxsize=NEARBY_CACHE_SIZE, ttl=NEARBY_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()     # key → (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                LOOKUP_COUNTER.labels("miss").inc()
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                LOOKUP_COUNTER.labels("expired").inc()
+                return None
+            self._data.move_to_end(key)
+        LOOKUP_COUNTER.labels("hit").inc()
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+_cache = TTLCache()
+
+def tile_key(lat, lng, keyword, language, sort_by):
+    return (geo_distance.geohash(lat, lng, NEARBY_CACHE_PRECISION), keyword, language, sort_by)
+
+def get(lat, lng, keyword, language, sort_by):
+    return _cache.get(tile_key(lat, lng, keyword, language, sort_by))
+
+def put(lat, lng, keyword, language, sort_by, value):
+    _cache.put(tile_key(lat, lng, keyword, language, sort_by), value)
@@ -0,0 +1,113 @@
+# place_cache.py
+"""
+place_cache.py
+──────────────
+設置點名稱 → Google place_id 的持久化快取（SQLite，PLACE_CACHE_DB）。
+
+  • 查到的 place_id 保留 PLACE_ID_TTL 秒
+  • 查無結果（空字串）也會快取 PLACE_ID_NEGATIVE_TTL 秒，避免同一個名稱反覆打 API
+  • 查詢時發生例外（網路 / 配額）不寫入快取，下次再試
+
+線上重排名（app._resolve_places）與離線腳本（gooogle_place_id.add_place_id_to_csv）
+共用同一顆資料庫，同名景點重複查詢時不再呼叫 Google。
+"""
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+
+from prometheus_client import Counter
+
+from config import PLACE_CACHE_DB, PLACE_ID_TTL, PLACE_ID_NEGATIVE_TTL
+
+LOOKUP_COUNTER = Counter(
+    name="place_id_cache_lookups_total",
+    documentation="place_id cache lookups by result",
+    labelnames=("result",),            # hit / negative / miss
+)
+
+
+class PlaceIdCache:
+    def __init__(self, db_path=PLACE_CACHE_DB):
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        with self._lock:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS place_ids (
+                  name       TEXT PRIMARY KEY,
+                  place_id   TEXT NOT NULL,
+                  expires_at REAL NOT NULL
+                )
+            """)
+            self.conn.commit()
+
+    def get(self, name) -> str | None:
+        """未過期的快取值（"" 表示已知查無結果）；沒有或已過期時回傳 None"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT place_id FROM place_ids WHERE name = ? AND expires_at > ?",
+                (name, time.time())
+            ).fetchone()
+        if row is None:
+            LOOKUP_COUNTER.labels("miss").inc()
+            return None
+        LOOKUP_COUNTER.labels("hit" if row[0] else "negative").inc()
+        return row[0]
+
+    def put(self, name, place_id) -> None:
+        ttl = PLACE_ID_TTL if place_id else PLACE_ID_NEGATIVE_TTL
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO place_ids (name, place_id, expires_at) VALUES (?, ?, ?)",
+                (name, place_id or "", time.time() + ttl)
+            )
+            self.conn.commit()
+
+    def resolve(self, name, lookup) -> str:
+        """
+        先查快取，沒有才呼叫 lookup(name) → place_id（查無結果回傳 ""）並寫回。
+        lookup 拋出例外時回傳 "" 且不快取。
+        """
+        if not name:
+            return ""
+        cached = self.get(name)
+        if cached is not None:
+            return cached
+        try:
+            place_id = lookup(name) or ""
+        except Exception as e:
+            print(f"[place_cache] lookup {name} 失敗：{e}")
+            return ""
+        self.put(name, place_id)
+        return place_id
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cur = self.conn.execute("DELETE FROM place_ids WHERE expires_at <= ?", (time.time(),))
+            self.conn.commit()
+        return cur.rowcount
+
+
+# ────────────────────────────────
+# 模組層級單例（第一次使用時才開資料庫）
+_cache: PlaceIdCache | None = None
+_init_lock = threading.Lock()
+
+def _get() -> PlaceIdCache:
+    global _cache
+    if _cache is None:
+        with _init_lock:
+            if _cache is None:
+                _cache = PlaceIdCache()
+    return _cache
+
+def get(name) -> str | None:
+    return _get().get(name)
+
+def put(name, place_id) -> None:
+    _get().put(name, place_id)
+
+def resolve(name, lookup) -> str:
+    return _get().resolve(name, lookup)
@@ -24,18 +24,31 @@ FIELD_MAPPING = {
     "crowd_rank": "crowd_rank"
 }
 
+EXPECTED_KEYS = {
+    "no", "time", "poi", "user_id", "place", "latitude", "longitude",
+    "bplu_id", "age", "gender", "weather", "place_id", "crowd", "crowd_rank"
+}
+# 指定哪些欄位預設為 "0"
+ZERO_DEFAULTS = {"crowd", "crowd_rank"}
+
+def _to_record(row):
+    """欄位名稱對應 + 補齊所有 EXPECTED_KEYS"""
+    new_row = {}
+    for key, value in row.items():
+        new_key = FIELD_MAPPING.get(key, key)
+        new_row[new_key] = value
+    for k in EXPECTED_KEYS:
+        if k not in new_row or new_row[k] is None:
+            # crowd / crowd_rank 用 "0"，其餘用空字串
+            new_row[k] = "0" if k in ZERO_DEFAULTS else ""
+    return new_row
+
 def csv_to_json(file_path):
     """
     讀取 CSV 檔案，將每一列轉換成字典後返回 JSON 資料，
     並補齊所有 expected_keys，預防 undefined。
     """
     records = []
-    expected_keys = {
-        "no", "time", "poi", "user_id", "place", "latitude", "longitude",
-        "bplu_id", "age", "gender", "weather", "place_id", "crowd", "crowd_rank"
-    }
-    # 指定哪些欄位預設為 "0"
-    zero_defaults = {"crowd", "crowd_rank"}
     try:
         with open(file_path, mode='r', encoding='utf-8-sig', newline='') as fin:
             reader = csv.DictReader(fin)
@@ -43,24 +56,19 @@ def csv_to_json(file_path):
                 # 略過完全空的列
                 if not any(row.values()):
                     continue
-
-                # 1) 欄位名稱對應
-                new_row = {}
-                for key, value in row.items():
-                    new_key = FIELD_MAPPING.get(key, key)
-                    new_row[new_key] = value
-
-                # 2) 補齊所有 expected_keys
-                for k in expected_keys:
-                    if k not in new_row or new_row[k] is None:
-                        # crowd / crowd_rank 用 "0"，其餘用空字串
-                        new_row[k] = "0" if k in zero_defaults else ""
-
-                records.append(new_row)
+                records.append(_to_record(row))
     except Exception as e:
         print(f"讀取 CSV 過程中發生錯誤: {e}")
     return records
 
+def df_to_json(df):
+    """
+    與 csv_to_json 相同的輸出格式，但直接從記憶體中的 DataFrame 轉換
+    （值一律轉成字串，與從 CSV 讀到的一致）。
+    """
+    df = df.astype(object).where(df.notna(), "").astype(str)
+    return [_to_record(row) for row in df.to_dict(orient="records")]
+
 
 def send_to_worker(data):
     """
@@ -79,12 +87,16 @@ def send_to_worker(data):
         print("發送請求失敗:", e)
         return None
 
-def csv_up():
-    # 1. 讀 CSV 並轉成 JSON（list of dict）
-    data = csv_to_json(PLAN_CSV)
+def csv_up(df=None, user_id=None):
+    """
+    上傳行程：df 為該使用者記憶體中的行程（None 時讀 PLAN_CSV，相容 CLI）。
+    給了 user_id 時，SQLite 中該使用者的舊行程會先被取代。
+    """
+    # 1. 轉成 JSON（list of dict）
+    data = csv_to_json(PLAN_CSV) if df is None else df_to_json(df)
 
     # 2. **寫入本地 SQLite**  
-    save_to_sqlite(data, db_path=D1_BINDING)
+    save_to_sqlite(data, db_path=D1_BINDING, user_id=user_id)
 
     # 3. 印出轉換後的 JSON 以供檢查
     print("轉換後的 JSON 資料:")
@@ -100,9 +112,15 @@ def csv_up():
 
 
 
-def save_to_sqlite(records, db_path='local.db'):
+def save_to_sqlite(records, db_path='local.db', user_id=None):
+    """
+    寫入 plan 表；user_id 不為 None 時在同一個交易內先刪掉該使用者的舊行程，
+    讓每位使用者只保留最新一份結果。
+    """
     conn = sqlite3.connect(db_path)
     cur = conn.cursor()
+    if user_id is not None:
+        cur.execute("DELETE FROM plan WHERE user_id = ?", (user_id,))
     # 假設你已經用下面 SQL 建好表：
     # CREATE TABLE plan (
     #   no TEXT, time TEXT, poi TEXT, user_id TEXT,
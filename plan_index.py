@@ -0,0 +1,82 @@
+# plan_index.py
+"""
+plan_index.py
+─────────────
+每份 plan_Nday.csv 建一次的族群索引：
+  (gender, age) → 模型預測的模板旅客 UserID/MemID → 該旅客已篩選好的行程列
+                                                     （plan_store 的零複製切片）
+
+行程規劃的前兩段（XGBoost 選模板旅客、Filter 篩出其行程）因此變成字典查詢。
+gender ∈ {-1, 0, 1}、age ∈ 0–120 以外的輸入才回頭呼叫模型。
+CSV 檔 mtime 變動時自動重建。
+"""
+from __future__ import annotations
+
+import os
+import threading
+
+import pandas as pd
+
+import model_registry
+import plan_store
+
+GENDERS = (-1, 0, 1)
+AGES = range(0, 121)
+
+
+class PlanIndex:
+    def __init__(self, csv_path):
+        self.csv_path = csv_path
+        self.version = os.path.getmtime(csv_path)
+        model = model_registry.plan_model(csv_path)
+
+        grid = [(g, a) for g in GENDERS for a in AGES]
+        users = model.predict(grid)
+        self.cohorts = {cohort: user for cohort, user in zip(grid, users)}
+
+        table = plan_store.get(csv_path)
+        self.rows = {user: table.rows(user) for user in set(users)}
+        print(f"[plan_index] {os.path.basename(csv_path)}: "
+              f"{len(self.cohorts)} cohorts → {len(self.rows)} template users")
+
+    def template_user(self, gender, age) -> str:
+        user = self.cohorts.get((int(gender), int(age))) if float(age).is_integer() else None
+        if user is None:
+            user = model_registry.plan_model(self.csv_path).predict([[gender, age]])[0]
+        return user
+
+    def template_rows(self, user_id) -> pd.DataFrame:
+        """模板旅客的行程列（唯讀切片；要修改請先 .copy()）"""
+        rows = self.rows.get(user_id)
+        if rows is None:
+            rows = plan_store.rows(self.csv_path, user_id)
+        return rows
+
+
+_indexes: dict[str, PlanIndex] = {}
+_lock = threading.Lock()
+
+def get(csv_path) -> PlanIndex:
+    """取得（必要時建立 / 重建）某份 plan CSV 的索引"""
+    index = _indexes.get(csv_path)
+    if index is not None and index.version == os.path.getmtime(csv_path):
+        return index
+    with _lock:
+        index = _indexes.get(csv_path)
+        if index is None or index.version != os.path.getmtime(csv_path):
+            index = PlanIndex(csv_path)
+            _indexes[csv_path] = index
+    return index
+
+def template_user(csv_path, gender, age) -> str:
+    return get(csv_path).template_user(gender, age)
+
+def template_rows(csv_path, user_id) -> pd.DataFrame:
+    return get(csv_path).template_rows(user_id)
+
+def warm_up(csv_paths):
+    for csv_path in csv_paths:
+        try:
+            get(csv_path)
+        except Exception as e:
+            print(f"⚠️ [plan_index] warm-up {csv_path} 失敗：{e}")
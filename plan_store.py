@@ -0,0 +1,80 @@
+# plan_store.py
+"""
+plan_store.py
+─────────────
+plan_2day.csv ~ plan_5day.csv 的記憶體欄式儲存：
+
+  • 啟動時各讀一次，只保留 FIELDNAMES 欄位；重複度高的欄位轉成 categorical
+  • 依 UserID/MemID 穩定排序（同一旅客維持原檔順序），預建 user_id → (start, stop)
+  • rows(csv_path, user_id) 直接回傳連續列的 iloc 切片，不掃描、不寫檔
+
+文字欄位原樣保留（dtype=str），輸出 CSV 時與原本 csv.DictReader 逐列複製的結果一致。
+檔案 mtime 變動時自動重新載入。
+"""
+from __future__ import annotations
+
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+# 行程輸出欄位（不包含 "place_id"）
+FIELDNAMES = ['no', 'Time', 'POI', 'UserID/MemID', '設置點', '緯度', '經度', 'BPL UID', 'age', 'gender', '天氣']
+
+_CATEGORICAL = ("POI", "UserID/MemID", "設置點", "緯度", "經度", "age", "gender", "天氣")
+
+
+class PlanTable:
+    def __init__(self, csv_path):
+        self.csv_path = csv_path
+        self.version = os.path.getmtime(csv_path)
+
+        df = pd.read_csv(csv_path, encoding="utf-8-sig", dtype=str, keep_default_na=False)
+        df = df[[c for c in FIELDNAMES if c in df.columns]]
+        df = df.sort_values("UserID/MemID", kind="stable").reset_index(drop=True)
+        for col in _CATEGORICAL:
+            if col in df.columns:
+                df[col] = df[col].astype("category")
+        self.df = df
+
+        users = df["UserID/MemID"].to_numpy(dtype=object)
+        starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]]) if len(users) else np.array([], dtype=int)
+        stops = np.r_[starts[1:], len(users)]
+        self.slices = {users[s]: (int(s), int(e)) for s, e in zip(starts, stops)}
+
+    def rows(self, user_id) -> pd.DataFrame:
+        start, stop = self.slices.get(user_id, (0, 0))
+        return self.df.iloc[start:stop]
+
+    def users(self) -> list[str]:
+        return list(self.slices)
+
+
+_tables: dict[str, PlanTable] = {}
+_lock = threading.Lock()
+
+def get(csv_path) -> PlanTable:
+    """取得（必要時載入 / 重載）某份 plan CSV 的欄式表"""
+    table = _tables.get(csv_path)
+    if table is not None and table.version == os.path.getmtime(csv_path):
+        return table
+    with _lock:
+        table = _tables.get(csv_path)
+        if table is None or table.version != os.path.getmtime(csv_path):
+            table = PlanTable(csv_path)
+            _tables[csv_path] = table
+            print(f"[plan_store] loaded {os.path.basename(csv_path)}: "
+                  f"{len(table.df)} rows / {len(table.slices)} users")
+    return table
+
+def rows(csv_path, user_id) -> pd.DataFrame:
+    """某旅客在該 plan CSV 的所有行程列（唯讀切片；要修改請先 .copy()）"""
+    return get(csv_path).rows(user_id)
+
+def warm_up(csv_paths):
+    for csv_path in csv_paths:
+        try:
+            get(csv_path)
+        except Exception as e:
+            print(f"⚠️ [plan_store] warm-up {csv_path} 失敗：{e}")
@@ -0,0 +1,185 @@
+# planning_scheduler.py
+"""
+planning_scheduler.py
+─────────────────────
+背景行程規劃的工作排程器：
+
+  • 固定 PLANNING_WORKERS 個 worker 執行緒，取代每個請求各開一條 Thread
+  • 有界佇列（PLANNING_QUEUE_SIZE）；滿了 submit 立即回傳 REJECTED，由呼叫端回覆忙碌
+  • 同一位使用者同時只會有一個工作：
+      - 已在排隊 → 直接改成最新的參數（例如改選天數），不另外排一個
+      - 已在執行、key 相同（同樣的天數）→ 忽略這次請求
+      - 已在執行、key 不同，或執行中的工作已呼叫 finishing() 開始寫回結果
+        → 記一個後續工作（只留最新一個），目前的工作結束後由同一個 worker 接著跑
+  • Prometheus：佇列深度、執行中數量、排隊等待時間、各種 submit 結果次數
+
+在 gevent monkey-patch 下 queue / threading 都是協作式的。
+"""
+from __future__ import annotations
+
+import queue
+import threading
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from config import PLANNING_WORKERS, PLANNING_QUEUE_SIZE
+
+QUEUED = "queued"
+UPDATED = "updated"
+DUPLICATE = "duplicate"
+FOLLOWUP = "followup"
+REJECTED = "rejected"
+
+QUEUE_DEPTH = Gauge(
+    name="planning_queue_depth",
+    documentation="Planning jobs waiting for a worker",
+)
+RUNNING_GAUGE = Gauge(
+    name="planning_jobs_running",
+    documentation="Planning jobs currently executing",
+)
+WAIT_HIST = Histogram(
+    name="planning_queue_wait_seconds",
+    documentation="Time a planning job waited in the queue before starting",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 120),
+)
+SUBMIT_COUNTER = Counter(
+    name="planning_jobs_submitted_total",
+    documentation="Planning job submissions by outcome",
+    labelnames=("result",),
+)
+
+
+class _Job:
+    __slots__ = ("user_id", "fn", "args", "key", "enqueued_at")
+
+    def __init__(self, user_id, fn, args, key):
+        self.user_id = user_id
+        self.fn = fn
+        self.args = args
+        self.key = key
+        self.enqueued_at = time.monotonic()
+
+
+class PlanningScheduler:
+    def __init__(self, workers=PLANNING_WORKERS, max_queue=PLANNING_QUEUE_SIZE):
+        self.workers = max(1, workers)
+        self._queue: queue.Queue[_Job] = queue.Queue(maxsize=max(1, max_queue))
+        self._pending: dict[str, _Job] = {}     # 排隊中
+        self._running: dict[str, object] = {}   # 執行中：user_id → key
+        self._finishing: set[str] = set()       # 執行中且已開始寫回結果
+        self._followups: dict[str, _Job] = {}   # 執行中時收到的後續工作
+        self._lock = threading.Lock()
+        self._started = False
+
+    def _ensure_workers(self):
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            for i in range(self.workers):
+                threading.Thread(
+                    target=self._run, daemon=True, name=f"planning-{i}"
+                ).start()
+            self._started = True
+
+    def submit(self, user_id, fn, *args, key=None) -> str:
+        """
+        排入 fn(*args)；回傳 QUEUED / UPDATED / DUPLICATE / FOLLOWUP / REJECTED。
+        key 用來判斷是否與執行中的工作相同（預設為 args；參數含 reply token 這類每次都不同的值時請給 key）。
+        """
+        key = args if key is None else key
+        self._ensure_workers()
+        with self._lock:
+            if user_id in self._running:
+                if self._running[user_id] == key and user_id not in self._finishing:
+                    self._followups.pop(user_id, None)
+                    result = DUPLICATE
+                else:
+                    self._followups[user_id] = _Job(user_id, fn, args, key)
+                    result = FOLLOWUP
+            elif user_id in self._pending:
+                job = self._pending[user_id]
+                job.fn, job.args, job.key = fn, args, key
+                result = UPDATED
+            else:
+                job = _Job(user_id, fn, args, key)
+                try:
+                    self._queue.put_nowait(job)
+                    self._pending[user_id] = job
+                    result = QUEUED
+                except queue.Full:
+                    result = REJECTED
+            QUEUE_DEPTH.set(self.depth())
+        SUBMIT_COUNTER.labels(result).inc()
+        return result
+
+    def finishing(self, user_id) -> bool:
+        """
+        工作即將寫回結果時呼叫；之後同一使用者的 submit 一律排成後續工作，
+        不會因為在寫回途中被當成 DUPLICATE 而沒有工作接手。
+        回傳是否已有後續工作（目前的結果已過時）。
+        """
+        with self._lock:
+            if user_id in self._running:
+                self._finishing.add(user_id)
+            return user_id in self._followups
+
+    def is_busy(self, user_id) -> bool:
+        """該使用者是否已有排隊中或執行中的工作"""
+        with self._lock:
+            return user_id in self._pending or user_id in self._running
+
+    def depth(self) -> int:
+        return len(self._pending) + len(self._followups)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            user_id = job.user_id
+            with self._lock:
+                self._pending.pop(user_id, None)
+                self._running[user_id] = job.key
+                QUEUE_DEPTH.set(self.depth())
+            while job is not None:
+                self._execute(job)
+                # 執行期間收到的後續工作由同一個 worker 接著跑，同一使用者仍保持一次一個
+                with self._lock:
+                    self._finishing.discard(user_id)
+                    job = self._followups.pop(user_id, None)
+                    if job is None:
+                        del self._running[user_id]
+                    else:
+                        self._running[user_id] = job.key
+                    QUEUE_DEPTH.set(self.depth())
+            self._queue.task_done()
+
+    def _execute(self, job):
+        fn, args = job.fn, job.args
+        WAIT_HIST.observe(time.monotonic() - job.enqueued_at)
+        RUNNING_GAUGE.inc()
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f"⚠️ [planning_scheduler] job for {job.user_id} failed: {e}")
+        finally:
+            RUNNING_GAUGE.dec()
+
+
+# ────────────────────────────────
+# 模組層級單例
+_scheduler = PlanningScheduler()
+
+def submit(user_id, fn, *args, key=None) -> str:
+    return _scheduler.submit(user_id, fn, *args, key=key)
+
+def finishing(user_id) -> bool:
+    return _scheduler.finishing(user_id)
+
+def is_busy(user_id) -> bool:
+    return _scheduler.is_busy(user_id)
+
+def depth() -> int:
+    return _scheduler.depth()
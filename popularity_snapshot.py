@@ -0,0 +1,177 @@
+# popularity_snapshot.py
+"""
+popularity_snapshot.py
+──────────────────────
+Google populartimes 的每小時快照：
+
+  • 背景執行緒每 POPULARITY_REFRESH_INTERVAL 秒，對所有已知景點（各 plan CSV 的設置點）
+    經 place_cache 取得 place_id，再經 maps_gateway 抓一次 Place Details populartimes
+  • 整理成 uint8 陣列 week[place, weekday, hour]（weekday 依 Google：Sun=0 … Sat=6）
+    並原子寫入 POPULARITY_SNAPSHOT（.npz），多個 worker / 重啟後都可直接讀
+  • current(place_id) 是記憶體中的 O(1) 陣列索引；快照裡沒有的 place_id 回傳 None，
+    由呼叫端自行決定是否即時查詢
+
+populartimes 一週內每小時的分佈幾乎不變，快照取代了每次規劃、每一列各打一次 API。
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime as dt
+
+import numpy as np
+
+import geo_distance
+import maps_gateway
+import place_cache
+from config import POPULARITY_SNAPSHOT, POPULARITY_REFRESH_INTERVAL, MAPS_LOOKUP_CONCURRENCY
+
+_CHECK_INTERVAL = 60
+
+
+# ────────────────────────────────
+# 1. 單一景點
+def google_weekday(when=None) -> int:
+    """Python weekday(): Mon=0…Sun=6 → Google: Sun=0…Sat=6"""
+    return ((when or dt.now()).weekday() + 1) % 7
+
+def week_from_populartimes(pop_times) -> np.ndarray:
+    """Place Details 的 populartimes → (7, 24) uint8；缺的格子為 0"""
+    week = np.zeros((7, 24), dtype=np.uint8)
+    if not isinstance(pop_times, list):
+        return week
+    for day_obj in pop_times:
+        day, data = day_obj.get("name"), day_obj.get("data")
+        if not isinstance(day, int) or not 0 <= day < 7 or not isinstance(data, list):
+            continue
+        for hour, val in enumerate(data[:24]):
+            try:
+                week[day, hour] = min(max(int(val), 0), 255)
+            except (TypeError, ValueError):
+                pass
+    return week
+
+def fetch_week(place_id) -> np.ndarray | None:
+    """經 maps_gateway 抓 populartimes；API 失敗時回傳 None"""
+    try:
+        res_json = maps_gateway.get_json(
+            "place_details_populartimes",
+            "/maps/api/place/details/json",
+            {"place_id": place_id, "fields": "populartimes"},
+        )
+    except Exception:
+        return None
+    return week_from_populartimes(res_json.get("result", {}).get("populartimes"))
+
+
+# ────────────────────────────────
+# 2. 快照
+class Snapshot:
+    def __init__(self, place_ids, week, taken_at):
+        self.place_ids = list(place_ids)
+        self.week = week                              # (n, 7, 24) uint8
+        self.taken_at = float(taken_at)
+        self.index = {pid: i for i, pid in enumerate(self.place_ids)}
+
+    def current(self, place_id, when=None) -> int | None:
+        i = self.index.get(place_id)
+        if i is None:
+            return None
+        when = when or dt.now()
+        return int(self.week[i, google_weekday(when), when.hour])
+
+    @classmethod
+    def load(cls, path=POPULARITY_SNAPSHOT) -> "Snapshot":
+        data = np.load(path, allow_pickle=False)
+        return cls(data["place_ids"].tolist(), data["week"], data["taken_at"])
+
+    def save(self, path=POPULARITY_SNAPSHOT):
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, place_ids=np.array(self.place_ids, dtype=str),
+                 week=self.week, taken_at=np.float64(self.taken_at))
+        os.replace(tmp_path, path)
+
+
+def build(names=None) -> Snapshot:
+    """對 names（預設為所有 plan CSV 的景點）抓一輪 populartimes；失敗的景點不放進快照"""
+    if names is None:
+        names = geo_distance.known_places()["設置點"].tolist()
+    with ThreadPoolExecutor(max_workers=max(1, MAPS_LOOKUP_CONCURRENCY)) as pool:
+        resolved = pool.map(lambda name: place_cache.resolve(name, maps_gateway.find_place_id), names)
+        place_ids = [pid for pid in dict.fromkeys(resolved) if pid]
+        weeks = list(pool.map(fetch_week, place_ids))
+    ok = [(pid, w) for pid, w in zip(place_ids, weeks) if w is not None]
+    week = np.stack([w for _, w in ok]) if ok else np.zeros((0, 7, 24), dtype=np.uint8)
+    print(f"[popularity_snapshot] {len(ok)}/{len(place_ids)} places refreshed")
+    return Snapshot([pid for pid, _ in ok], week, time.time())
+
+
+# ────────────────────────────────
+# 3. 模組層級：讀取 + 背景更新
+_snapshot: Snapshot | None = None
+_version = None
+_lock = threading.Lock()
+
+def _file_mtime():
+    try:
+        return os.path.getmtime(POPULARITY_SNAPSHOT)
+    except OSError:
+        return None
+
+def _reload_if_changed():
+    global _snapshot, _version
+    mtime = _file_mtime()
+    if mtime is None or mtime == _version:
+        return
+    with _lock:
+        try:
+            _snapshot = Snapshot.load()
+            _version = mtime
+        except Exception as e:
+            print(f"⚠️ [popularity_snapshot] 載入 {POPULARITY_SNAPSHOT} 失敗：{e}")
+
+def refresh():
+    """重建快照、寫檔並立即換上；一個景點都沒抓到時保留舊快照"""
+    global _snapshot, _version
+    snap = build()
+    if not snap.place_ids:
+        return
+    snap.save()
+    with _lock:
+        _snapshot = snap
+        _version = _file_mtime()
+
+def current(place_id, when=None) -> int | None:
+    """目前時段的熱度 (0–100)；快照未就緒或沒有這個 place_id 時回傳 None"""
+    if _snapshot is None:
+        _reload_if_changed()
+    snap = _snapshot
+    return snap.current(place_id, when) if snap is not None else None
+
+def _refresh_loop(interval):
+    last_attempt = 0.0
+    while True:
+        _reload_if_changed()
+        mtime = _file_mtime()
+        # 其他 worker 剛更新過就不重抓，只讀檔；失敗後也等滿一個週期再試
+        stale = mtime is None or time.time() - mtime >= interval
+        if stale and time.time() - last_attempt >= interval and os.getenv("GOOGLE_MAPS_API_KEY"):
+            last_attempt = time.time()
+            try:
+                refresh()
+            except Exception as e:
+                print(f"⚠️ [popularity_snapshot] refresh 失敗：{e}")
+        time.sleep(_CHECK_INTERVAL)
+
+_started = False
+
+def start(interval: int = POPULARITY_REFRESH_INTERVAL):
+    """在 app.py 啟動時呼叫一次：背景定期更新快照（interval <= 0 時停用，只讀現有檔案）"""
+    global _started
+    if _started or interval <= 0:
+        return
+    _started = True
+    threading.Thread(target=_refresh_loop, args=(interval,), daemon=True,
+                     name="popularity-snapshot").start()
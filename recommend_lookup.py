@@ -0,0 +1,183 @@
+# recommend_lookup.py
+"""
+recommend_lookup.py
+───────────────────
+推薦模型的離線查表：把離散特徵空間整個列舉一次，每格預存 top-N 景點。
+
+  weather     → 模型的 weather 類別
+  gender      → -1 / 0 / 1
+  age         → 0 – 120 整數
+  tidal       → 0 / 1 / 2
+  temperature → 0 – 40 整數
+
+表格以 int16（景點類別索引）存成 .npy，線上用 mmap 讀取，查詢是 O(1) 陣列索引；
+特徵落在網格外、查表不存在或與目前模型版本不符時回傳 None，由呼叫端改走即時模型。
+
+離線建表：
+    python recommend_lookup.py            # 或 XGBOOST_train.py 訓練完自動執行
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+
+import numpy as np
+
+import model_registry
+from config import MODEL_BUNDLE_DIR, LOOKUP_TOP_N
+
+AXES = {
+    "gender":      [-1, 0, 1],
+    "age":         list(range(0, 121)),
+    "tidal":       [0, 1, 2],
+    "temperature": list(range(0, 41)),
+}
+_CHUNK = 20000
+
+
+def _paths(name):
+    root = os.path.join(MODEL_BUNDLE_DIR, name)
+    return os.path.join(root, "lookup.npy"), os.path.join(root, "lookup.json")
+
+def _axis_values(model, col):
+    if col == "weather":
+        return model.weather_encoder.classes_.tolist()
+    return AXES[col]
+
+
+# ────────────────────────────────
+# 1. 離線建表
+def build(name, top_n=LOOKUP_TOP_N) -> str:
+    """
+    列舉網格並寫出 lookup.npy / lookup.json，回傳 .npy 路徑。
+    one-hot 之後相同的輸入（例如訓練資料沒出現過的年齡）只推論一次再展開。
+    """
+    model = model_registry.get(name)
+    axes = [_axis_values(model, col) for col in model.feature_cols]
+
+    # 每個軸：網格值 → 壓縮代碼（同一 one-hot 結果共用一個代碼）
+    codes, reps = [], []
+    for i, (col, values) in enumerate(zip(model.feature_cols, axes)):
+        if col == "weather":
+            encoded = model.weather_encoder.transform(values).astype(np.float64)
+        else:
+            encoded = np.asarray(values, dtype=np.float64)
+        cats = model.onehot.categories_[i]
+        known = np.isin(encoded, cats)
+        key = np.where(known, encoded, np.nan)
+        uniq, first, inverse = np.unique(key, return_index=True, return_inverse=True, equal_nan=True)
+        codes.append(inverse.ravel())
+        reps.append([values[j] for j in first])
+
+    compact_shape = tuple(len(r) for r in reps)
+    grid = np.stack(np.meshgrid(*[np.arange(n) for n in compact_shape], indexing="ij"), -1).reshape(-1, len(reps))
+    rows = np.array([[reps[a][c] for a, c in enumerate(g)] for g in grid], dtype=object)
+
+    top_n = min(top_n, len(model.classes))
+    compact = np.empty((len(rows), top_n), dtype=np.int16)
+    for start in range(0, len(rows), _CHUNK):
+        proba = model.predict_proba(rows[start:start + _CHUNK])
+        compact[start:start + _CHUNK] = np.argsort(-proba, axis=1, kind="stable")[:, :top_n]
+    compact = compact.reshape(compact_shape + (top_n,))
+
+    table = compact[np.ix_(*codes)]
+    npy_path, json_path = _paths(name)
+    os.makedirs(os.path.dirname(npy_path), exist_ok=True)
+    tmp_npy = npy_path + ".tmp.npy"
+    np.save(tmp_npy, table)
+    os.replace(tmp_npy, npy_path)
+    meta = {
+        "name": name,
+        "model_version": model.version,
+        "feature_cols": model.feature_cols,
+        "axes": axes,
+        "labels": model.classes.tolist(),
+        "top_n": top_n,
+    }
+    tmp_json = json_path + ".tmp"
+    with open(tmp_json, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_json, json_path)
+    print(f"[recommend_lookup] {name}: {table.shape} cells → {npy_path}")
+    return npy_path
+
+
+# ────────────────────────────────
+# 2. 線上查詢
+class _Table:
+    def __init__(self, name):
+        npy_path, json_path = _paths(name)
+        with open(json_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        self.model_version = meta["model_version"]
+        self.labels = meta["labels"]
+        self.table = np.load(npy_path, mmap_mode="r")
+        self.index = [
+            {(float(v) if col != "weather" else v): i for i, v in enumerate(values)}
+            for col, values in zip(meta["feature_cols"], meta["axes"])
+        ]
+        self.feature_cols = meta["feature_cols"]
+
+    def cell(self, row):
+        idx = []
+        for col, value, index in zip(self.feature_cols, row, self.index):
+            if col != "weather":
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    return None
+            i = index.get(value)
+            if i is None:
+                return None
+            idx.append(i)
+        return self.table[tuple(idx)]
+
+_tables: dict[str, tuple] = {}     # name → (模型版本, _Table 或 None, 讀取時 lookup.json 的 mtime)
+_lock = threading.Lock()
+
+def _meta_mtime(name):
+    try:
+        return os.path.getmtime(_paths(name)[1])
+    except OSError:
+        return None
+
+def _table(name) -> _Table | None:
+    """
+    取得與目前模型版本相符的查表；模型 hot-reload 後自動重新讀取。
+    查不到（尚未建表或版本不符）時不會一直記著：lookup.json 的 mtime 一變就重讀，
+    訓練端先發布模型、稍後才建表的空檔過後即可接上。
+    """
+    version = model_registry.get(name).version
+    cached = _tables.get(name)
+    if cached is not None and cached[0] == version:
+        if cached[1] is not None or cached[2] == _meta_mtime(name):
+            return cached[1]
+    with _lock:
+        mtime = _meta_mtime(name)
+        try:
+            table = _Table(name)
+            if table.model_version != version:
+                table = None
+        except (OSError, ValueError, KeyError):
+            table = None
+        _tables[name] = (version, table, mtime)
+    return table
+
+def rank(name, row, exclude=(), k=5) -> list[str] | None:
+    """
+    查表回傳排除 exclude 後的 top-k；網格外、無查表，或排除後不足 k 個時回傳 None。
+    """
+    table = _table(name)
+    if table is None:
+        return None
+    cell = table.cell(row)
+    if cell is None:
+        return None
+    result = [table.labels[i] for i in cell if table.labels[i] not in exclude][:k]
+    return result if len(result) == k else None
+
+
+if __name__ == "__main__":
+    for _name in ("recommend2", "recommend3"):
+        build(_name)
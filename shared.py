@@ -3,83 +3,303 @@ import threading
 # ─── 忽略 fork 之後的 threading._after_fork 呼叫，避免 gevent._gevent_cevent.Event 不能呼叫的錯 ───
 threading._after_fork = lambda: None
 
-import sqlite3
 import json
 import os
+import time
+import uuid
+import weakref
 from collections.abc import MutableMapping
-from typing import Any, Callable
+from contextlib import contextmanager
+from dataclasses import dataclass, field, fields
+from typing import Any
 
-# 用於保護 SQLite 寫入的鎖
-_lock = threading.Lock()
+import state_backend
+from config import STATE_LOCK_TTL, REPLY_TOKEN_TTL, REPLY_TOKEN_BUCKETS
 
-class SQLiteMap(MutableMapping):
+
+# ─────────────── 使用者 profile：一人一列 ───────────────
+@dataclass(slots=True)
+class UserProfile:
+    """
+    每位使用者的對話狀態。欄位以 set() 修改才會記為 dirty，
+    ProfileStore.save 只 UPSERT 有變動的欄位。
+    """
+    user_id:    str
+    language:   Any = "zh"
+    stage:      Any = "ask_language"
+    age:        Any = None
+    gender:     Any = None
+    trip_days:  Any = None
+    preparing:  Any = False
+    plan_ready: Any = False
+    location:   Any = None
+    dirty:      set = field(default_factory=set, repr=False, compare=False)
+
+    def set(self, name: str, value: Any) -> None:
+        setattr(self, name, value)
+        self.dirty.add(name)
+
+PROFILE_FIELDS = tuple(f.name for f in fields(UserProfile) if f.name not in ("user_id", "dirty"))
+_PROFILE_DEFAULTS = {f.name: f.default for f in fields(UserProfile) if f.name in PROFILE_FIELDS}
+
+
+class ProfileStore:
     """
-    SQLite-backed dict-like mapping.
-    key: str
-    value: stored as JSON text
+    user_profile：user_id → 每個欄位一格（JSON 文字，缺值 = 預設值）。
+    load 一次 hgetall；save 一次 hset（只含 dirty 欄位；sqlite 後端為單列 UPSERT）。
+    webhook 事件改由 event_scope 把 load / save 併進搶鎖 / 放鎖的那一次往返。
     """
-    def __init__(self, db_path: str, table: str, default_factory: Callable[[], Any]):
-        # 建立連線並啟用 WAL 模式，提升多進程併發能力
-        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
-        self.conn.execute("PRAGMA journal_mode=WAL;")
+    def __init__(self, backend: state_backend.Backend, table: str = "user_profile"):
+        self.backend = backend
         self.table = table
-        self.default_factory = default_factory
-        # 建表
-        with _lock:
-            self.conn.execute(f"""
-                CREATE TABLE IF NOT EXISTS {self.table} (
-                  key   TEXT PRIMARY KEY,
-                  value TEXT NOT NULL
-                )
-            """)
-            self.conn.commit()
-
-    def __getitem__(self, key: str) -> Any:
-        cur = self.conn.execute(
-            f"SELECT value FROM {self.table} WHERE key = ?", (key,)
-        )
-        row = cur.fetchone()
-        if row:
-            return json.loads(row[0])
-        # 若不存在，回傳 default 並存入
-        val = self.default_factory()
-        self[key] = val
-        return val
-
-    def __setitem__(self, key: str, value: Any) -> None:
-        j = json.dumps(value)
-        with _lock:
-            self.conn.execute(
-                f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)",
-                (key, j)
-            )
-            self.conn.commit()
-
-    def __delitem__(self, key: str) -> None:
-        with _lock:
-            self.conn.execute(
-                f"DELETE FROM {self.table} WHERE key = ?", (key,)
-            )
-            self.conn.commit()
+        if backend.ensure_hash(table, PROFILE_FIELDS, "user_id"):
+            # 舊版每個欄位一張 SQLiteMap 表（user_language …）→ 建表時併進來一次
+            backend.import_legacy(table, {name: f"user_{name}" for name in PROFILE_FIELDS})
+
+    @staticmethod
+    def decode(user_id: str, row: dict) -> UserProfile:
+        """hgetall 的結果 → UserProfile"""
+        profile = UserProfile(user_id)
+        for name, raw in row.items():
+            setattr(profile, name, json.loads(raw))
+        return profile
+
+    @staticmethod
+    def encode(profile: UserProfile) -> dict:
+        """dirty 欄位 → hset 的 mapping（None 存成 NULL）"""
+        return {
+            n: None if getattr(profile, n) is None else json.dumps(getattr(profile, n))
+            for n in PROFILE_FIELDS if n in profile.dirty
+        }
+
+    def load(self, user_id: str) -> UserProfile:
+        return self.decode(user_id, self.backend.hgetall(self.table, user_id))
+
+    def save(self, profile: UserProfile) -> None:
+        if not profile.dirty:
+            return
+        self.backend.hset(self.table, profile.user_id, self.encode(profile))
+        profile.dirty.clear()
+
+    def user_ids(self, name: str) -> list[str]:
+        return self.backend.hkeys(self.table, name)
+
+
+# ─────────────── 每個事件只 load / save 一次 ───────────────
+_local = threading.local()          # monkey.patch_all 後為每個 greenlet 各自一份
+
+def _scoped(user_id: str) -> UserProfile | None:
+    profiles = getattr(_local, "profiles", None)
+    return profiles.get(user_id) if profiles else None
+
+def _profiles() -> dict:
+    profiles = getattr(_local, "profiles", None)
+    if profiles is None:
+        profiles = _local.profiles = {}
+    return profiles
+
+@contextmanager
+def profile_scope(user_id: str):
+    """
+    with shared.profile_scope(uid): ...
+    區塊內對 user_xxx[uid] 的讀寫都落在同一個 UserProfile 上，離開時一次寫回。
+    巢狀進入同一 uid 時沿用外層的 profile。
+    """
+    profile = _scoped(user_id)
+    if profile is not None:
+        yield profile
+        return
+    profiles = _profiles()
+    profile = profiles[user_id] = profiles_store.load(user_id)
+    try:
+        yield profile
+    finally:
+        del profiles[user_id]
+        profiles_store.save(profile)
+
+def flush(user_id: str) -> None:
+    """立即寫回目前事件中的變動（交給背景工作之前呼叫，避免事件結束時蓋掉背景寫入）"""
+    profile = _scoped(user_id)
+    if profile is not None:
+        profiles_store.save(profile)
+
+
+class ProfileField(MutableMapping):
+    """
+    單一欄位的 dict 介面（user_language[uid] …），沿用舊 SQLiteMap 的用法。
+    在 profile_scope 內讀寫記憶體中的 profile；範圍外則直接 load / save 一次。
+    讀不到時回傳欄位預設值，但不寫入資料庫。
+    """
+    def __init__(self, name: str):
+        self.name = name
+
+    def __getitem__(self, user_id: str) -> Any:
+        profile = _scoped(user_id) or profiles_store.load(user_id)
+        return getattr(profile, self.name)
+
+    def __setitem__(self, user_id: str, value: Any) -> None:
+        profile = _scoped(user_id)
+        if profile is not None:
+            profile.set(self.name, value)
+        else:
+            profile = UserProfile(user_id)
+            profile.set(self.name, value)
+            profiles_store.save(profile)
+
+    def __delitem__(self, user_id: str) -> None:
+        self[user_id] = _PROFILE_DEFAULTS[self.name]
 
     def __iter__(self):
-        cur = self.conn.execute(f"SELECT key FROM {self.table}")
-        for row in cur:
-            yield row[0]
+        return iter(profiles_store.user_ids(self.name))
+
+    def __len__(self) -> int:
+        return len(profiles_store.user_ids(self.name))
+
+
+# ─────────────── 跨 worker 的集合 ───────────────
+class ExpiringSet:
+    """
+    只記住最近 ttl 秒的 key（used_reply_tokens 用）：
+      • 本行程：buckets+1 個 set 排成環，每個桶涵蓋 ttl/buckets 秒；時間每跨過一桶就清掉
+        最舊的那一桶。add / in 都是 O(1)，記憶體只跟 ttl 內的流量有關，到期是連續的，
+        不會有整批清空後舊 token 又被接受的空窗
+      • 後端是跨行程的（sqlite / remote）時，另以 ttl 租約寫入後端讓其他 worker 也看得到；
+        過期的租約在換桶時順手 purge
+    """
+    def __init__(self, ttl: float, buckets: int = REPLY_TOKEN_BUCKETS,
+                 backend: state_backend.Backend | None = None, table: str | None = None):
+        self.ttl = ttl
+        self.width = ttl / max(1, buckets)
+        self._ring: list[set] = [set() for _ in range(max(1, buckets) + 1)]
+        self._epoch = int(time.monotonic() / self.width)
+        self._lock = threading.Lock()
+        self.backend = None if isinstance(backend, state_backend.MemoryBackend) else backend
+        self.table = table
+
+    def _current(self) -> set:
+        """換桶（必要時）並回傳目前的桶；呼叫時須持有 _lock"""
+        epoch = int(time.monotonic() / self.width)
+        if epoch != self._epoch:
+            n = len(self._ring)
+            for i in range(1, min(epoch - self._epoch, n) + 1):
+                self._ring[(self._epoch + i) % n].clear()
+            self._epoch = epoch
+            if self.backend is not None:
+                try:
+                    self.backend.purge(self.table)
+                except Exception as e:
+                    print(f"⚠️ [shared] purge {self.table} 失敗：{e}")
+        return self._ring[epoch % len(self._ring)]
+
+    def add(self, key: str) -> bool:
+        """回傳是否為新加入"""
+        with self._lock:
+            if any(key in bucket for bucket in self._ring):
+                self._current()
+                return False
+            self._current().add(key)
+        if self.backend is not None:
+            return self.backend.add(self.table, key, "1", self.ttl)
+        return True
+
+    def remember(self, key: str) -> None:
+        """只記進本行程的環（後端已由 event_scope 一併登記過）"""
+        with self._lock:
+            self._current().add(key)
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            self._current()
+            if any(key in bucket for bucket in self._ring):
+                return True
+        return self.backend is not None and self.backend.has(self.table, key)
 
     def __len__(self) -> int:
-        cur = self.conn.execute(f"SELECT COUNT(*) FROM {self.table}")
-        return cur.fetchone()[0]
+        """本行程記住的 key 數"""
+        with self._lock:
+            self._current()
+            return sum(len(bucket) for bucket in self._ring)
+
+    def clear(self) -> None:
+        with self._lock:
+            for bucket in self._ring:
+                bucket.clear()
+        if self.backend is not None:
+            self.backend.clear(self.table)
 
-# 資料庫檔案（建議放在專案根目錄或可寫目錄）
+
+# 資料庫檔案（建議放在專案根目錄或可寫目錄）；STATE_BACKEND 不是 sqlite 時不使用
 _db_file = os.path.join(os.path.dirname(__file__), "user_state.db")
+backend = state_backend.backend(_db_file)
+
+profiles_store = ProfileStore(backend)
+used_reply_tokens = ExpiringSet(REPLY_TOKEN_TTL, backend=backend, table="used_reply_tokens")
+
+
+# ─────────────── 每個 webhook 事件：兩次後端往返 ───────────────
+_EVENT_LOCK_TABLE = "user_event_lock"
+_event_locks: "weakref.WeakValueDictionary[str, threading.Lock]" = weakref.WeakValueDictionary()
+_event_guard = threading.Lock()
+
+@contextmanager
+def event_scope(user_id: str, reply_token: str | None = None):
+    """
+    with shared.event_scope(uid, replyTK) as profile: ...
+    同一使用者的事件依序執行（跨 worker / 跨機器，依 STATE_BACKEND），區塊內等同 profile_scope。
+      • 進入：backend.hlock 一次完成「搶租約 + 登記 reply token + 讀 profile」
+      • 離開：backend.hunlock 一次完成「寫回 dirty 欄位 + 釋放租約」
+    先取本行程的 threading.Lock 再向後端搶租約；持有者當掉時租約在 STATE_LOCK_TTL 秒後失效。
+    reply token 的結果留給 claim_reply_token，safe_reply 不必再打一次後端。
+    """
+    with _event_guard:
+        local = _event_locks.get(user_id)
+        if local is None:
+            local = _event_locks[user_id] = threading.Lock()
+    with local:
+        owner = uuid.uuid4().hex
+        claim = None
+        if reply_token and used_reply_tokens.backend is not None:
+            claim = (used_reply_tokens.table, reply_token, used_reply_tokens.ttl)
+        delay = 0.005
+        while True:
+            locked, row, claimed = backend.hlock(profiles_store.table, user_id,
+                                                 _EVENT_LOCK_TABLE, owner, STATE_LOCK_TTL, claim)
+            if locked:
+                break
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+        profiles = _profiles()
+        profile = profiles[user_id] = profiles_store.decode(user_id, row)
+        tokens = _local.reply_tokens = {}
+        if claim is not None:
+            if claimed:
+                used_reply_tokens.remember(reply_token)
+            tokens[reply_token] = claimed
+        try:
+            yield profile
+        finally:
+            del profiles[user_id]
+            _local.reply_tokens = None
+            backend.hunlock(profiles_store.table, user_id, profiles_store.encode(profile),
+                            _EVENT_LOCK_TABLE, owner)
+            profile.dirty.clear()
+
+def claim_reply_token(token: str) -> bool:
+    """佔用 reply token；回傳 False 代表其他 greenlet / worker 已經用過"""
+    tokens = getattr(_local, "reply_tokens", None)
+    if tokens and token in tokens:
+        claimed = tokens[token]
+        tokens[token] = False       # 同一事件內只能用一次
+        return claimed
+    return used_reply_tokens.add(token)
 
-# 將原本的 in-memory dict 全部替換成 SQLiteMap
-user_language  = SQLiteMap(_db_file, "user_language",   lambda: "zh")
-user_stage     = SQLiteMap(_db_file, "user_stage",      lambda: "ask_language")
-user_age       = SQLiteMap(_db_file, "user_age",        lambda: None)
-user_gender    = SQLiteMap(_db_file, "user_gender",     lambda: None)
-user_trip_days = SQLiteMap(_db_file, "user_trip_days",  lambda: None)
-user_preparing = SQLiteMap(_db_file, "user_preparing",  lambda: False)
-user_plan_ready= SQLiteMap(_db_file, "user_plan_ready", lambda: False)
-user_location  = SQLiteMap(_db_file, "user_location",   lambda: None)
+# 沿用原本的名稱；底層都是同一列 user_profile
+user_language  = ProfileField("language")
+user_stage     = ProfileField("stage")
+user_age       = ProfileField("age")
+user_gender    = ProfileField("gender")
+user_trip_days = ProfileField("trip_days")
+user_preparing = ProfileField("preparing")
+user_plan_ready= ProfileField("plan_ready")
+user_location  = ProfileField("location")
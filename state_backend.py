@@ -0,0 +1,572 @@
+# state_backend.py
+"""
+state_backend.py
+────────────────
+shared.py 底下的儲存後端，以 STATE_BACKEND 選擇：
+
+  sqlite  （預設）本機 SQLite 檔（WAL）；同一台機器上的多個 gunicorn worker 共用
+  memory  行程內 dict，測試用；每個行程各自一份
+  remote  網路 KV：連到 STATE_BACKEND_URL（tcp://host:port）上的 state server，
+          多台機器 / 容器共用同一份狀態
+
+三種後端提供同一組操作（值一律是字串，JSON 編碼由 shared 負責）：
+
+  hash     ensure_hash / hgetall / hset / hkeys                  → ProfileStore（一人一列）
+  lease    add(ttl) / has / delete_if / purge / clear            → 使用者事件鎖、已用 reply token
+  event    hlock / hunlock                                       → shared.event_scope：
+           事件開頭「搶鎖 + 登記 reply token + 讀 profile」、結尾「寫回 + 放鎖」各一次往返
+           （sqlite 為同一個交易；其他後端預設由上面的操作組成）
+
+state server（remote 的本機替身；預設存在記憶體，給 --db 則存進 SQLite 檔）：
+    python state_backend.py --port 7379 [--db state.db] [--host 10.0.0.5 --token <secret>]
+
+  • 預設只聽 127.0.0.1；state server 沒有加密，只能放在私有網路 / 同一個容器網路內，
+    不要對外開 port
+  • 設了 STATE_BACKEND_TOKEN（或 --token）時，每條連線的第一個訊息必須是
+    {"op": "auth", "args": [token]}，不符就斷線；用戶端與 server 要設同一個值
+  • 表名 / 欄名只接受 [A-Za-z_][A-Za-z0-9_]*，其餘一律 ValueError，不會拼進 SQL
+"""
+from __future__ import annotations
+
+import argparse
+import hmac
+import json
+import re
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from config import (
+    STATE_BACKEND, STATE_BACKEND_URL, STATE_BACKEND_TIMEOUT, STATE_BACKEND_TOKEN,
+    SHARED_SQLITE_POOL_SIZE, SHARED_SQLITE_MMAP_SIZE, SHARED_SQLITE_CACHE_KB,
+)
+
+# remote 後端 / state server 允許的操作
+OPS = (
+    "ensure_hash", "hgetall", "hset", "hkeys", "import_legacy",
+    "add", "has", "delete_if", "purge", "clear",
+    "hlock", "hunlock",
+)
+
+
+class StateBackendError(RuntimeError):
+    pass
+
+
+_IDENT = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+def _ident(name):
+    """表名 / 欄名會直接拼進 SQL，只放行單純的識別字"""
+    if not isinstance(name, str) or not _IDENT.fullmatch(name):
+        raise ValueError(f"invalid identifier {name!r}")
+    return name
+
+
+class Backend:
+    """介面；各方法的語意見模組說明"""
+
+    # hash：key → {field: value}；ensure_hash 回傳是否為新建立
+    def ensure_hash(self, table, fields, key_column="key"): raise NotImplementedError
+    def hgetall(self, table, key): raise NotImplementedError
+    def hset(self, table, key, mapping): raise NotImplementedError
+    def hkeys(self, table, field): raise NotImplementedError
+
+    def import_legacy(self, table, sources):
+        """把舊版 {field: 舊 kv 表} 併進 hash 表；只有 sqlite 有舊資料"""
+        return None
+
+    # lease：key 不存在或已過期時才寫入，回傳是否寫入；ttl=None 表示不過期
+    def add(self, table, key, value, ttl=None): raise NotImplementedError
+    def has(self, table, key): raise NotImplementedError
+    def delete_if(self, table, key, value): raise NotImplementedError
+    def purge(self, table):
+        """刪掉已過期的 lease，回傳筆數"""
+        raise NotImplementedError
+    def clear(self, table): raise NotImplementedError
+
+    # event：claim = (lease 表, key, ttl) 或 None
+    def hlock(self, table, key, lock_table, owner, ttl, claim=None):
+        """
+        搶 lock_table[key] 的租約；搶到時一併登記 claim 並讀出 hash 列。
+        回傳 (locked, row, claimed)；沒搶到時 row / claimed 為 None，呼叫端稍後重試。
+        """
+        if not self.add(lock_table, key, owner, ttl):
+            return False, None, None
+        claimed = self.add(claim[0], claim[1], "1", claim[2]) if claim else None
+        return True, self.hgetall(table, key), claimed
+
+    def hunlock(self, table, key, mapping, lock_table, owner):
+        """寫回 mapping（可為空）並釋放 owner 持有的 lock_table[key] 租約"""
+        try:
+            if mapping:
+                self.hset(table, key, mapping)
+        finally:
+            self.delete_if(lock_table, key, owner)
+
+
+# ────────────────────────────────
+# 1. SQLite
+class ConnectionPool:
+    """
+    同一個 db 檔的連線池：每個 thread / greenlet 在一次操作期間獨佔一條 WAL 連線，
+    用完放回（最多保留 SHARED_SQLITE_POOL_SIZE 條閒置連線）。
+    WAL 下讀取不會被寫入擋住，不需要全域鎖；同檔的寫入由 SQLite 自己排隊（busy timeout）。
+    SQL 字串各表只組一次，靠 sqlite3 的 cached_statements 重用 prepared statement。
+    """
+    def __init__(self, db_path: str, max_idle: int = SHARED_SQLITE_POOL_SIZE):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self._idle: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5, cached_statements=64)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={SHARED_SQLITE_MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size=-{SHARED_SQLITE_CACHE_KB}")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._connect()
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            with self._lock:
+                keep = len(self._idle) < self.max_idle
+                if keep:
+                    self._idle.append(conn)
+            if not keep:
+                conn.close()
+
+
+_SCHEMAS = {
+    "lease":   "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL",
+}
+
+class SQLiteBackend(Backend):
+    def __init__(self, db_path: str):
+        self.db = ConnectionPool(db_path)
+        self._ready: set[str] = set()
+        self._hashes: dict[str, tuple[str, tuple]] = {}     # table → (key_column, fields)
+        self._upserts: dict[tuple, str] = {}                # (table, fields) → UPSERT SQL
+        self._lock = threading.Lock()
+
+    def _table(self, conn, table, kind):
+        if table not in self._ready:
+            with self._lock:
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {_ident(table)} ({_SCHEMAS[kind]})")
+                conn.commit()
+                self._ready.add(table)
+        return table
+
+    # hash：一個 key 一列、一個 field 一欄
+    def ensure_hash(self, table, fields, key_column="key"):
+        _ident(table), _ident(key_column)
+        cols = ", ".join(f"{_ident(name)} TEXT" for name in fields)
+        with self.db.connection() as conn, conn:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)
+            ).fetchone()
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({key_column} TEXT PRIMARY KEY, {cols})")
+        self._hashes[table] = (key_column, tuple(fields))
+        self._ready.add(table)
+        return not exists
+
+    def _hash_schema(self, conn, table):
+        """
+        table → (key_column, fields)。
+        通常由 ensure_hash 記下；state server 重啟後用戶端不會再送 ensure_hash，
+        這時從 PRAGMA table_info 重建（PRIMARY KEY 欄是 key，其餘是 field）。
+        """
+        schema = self._hashes.get(table)
+        if schema is None:
+            cols = conn.execute(f"PRAGMA table_info({_ident(table)})").fetchall()   # (cid, name, type, notnull, default, pk)
+            if not cols:
+                raise KeyError(f"hash table {table!r} does not exist")
+            key_column = next(c[1] for c in cols if c[5])
+            schema = self._hashes[table] = (key_column, tuple(c[1] for c in cols if not c[5]))
+            self._ready.add(table)
+        return schema
+
+    def import_legacy(self, table, sources):
+        with self.db.connection() as conn, conn:
+            key_column, _ = self._hash_schema(conn, table)
+            for name, legacy in sources.items():
+                _ident(name), _ident(legacy)
+                if not conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (legacy,)
+                ).fetchone():
+                    continue
+                conn.execute(f"""
+                    INSERT INTO {table} ({key_column}, {name})
+                    SELECT key, value FROM {legacy} WHERE true
+                    ON CONFLICT({key_column}) DO UPDATE SET {name} = excluded.{name}
+                """)
+                print(f"[state_backend] imported {legacy} → {table}")
+
+    def _hgetall(self, conn, table, key):
+        key_column, fields = self._hash_schema(conn, table)
+        row = conn.execute(f"SELECT {', '.join(fields)} FROM {table} WHERE {key_column} = ?",
+                           (key,)).fetchone()
+        return {name: raw for name, raw in zip(fields, row) if raw is not None} if row else {}
+
+    def _hset(self, conn, table, key, mapping):
+        key_column, fields = self._hash_schema(conn, table)
+        names = tuple(n for n in fields if n in mapping)
+        sql = self._upserts.get((table, names))
+        if sql is None:
+            sql = self._upserts[(table, names)] = (
+                f"INSERT INTO {table} ({key_column}, {', '.join(names)}) "
+                f"VALUES (?{', ?' * len(names)}) "
+                f"ON CONFLICT({key_column}) DO UPDATE SET "
+                + ", ".join(f"{n} = excluded.{n}" for n in names)
+            )
+        conn.execute(sql, (key, *(mapping[n] for n in names)))
+
+    def hgetall(self, table, key):
+        with self.db.connection() as conn:
+            return self._hgetall(conn, table, key)
+
+    def hset(self, table, key, mapping):
+        with self.db.connection() as conn, conn:
+            self._hset(conn, table, key, mapping)
+
+    def hkeys(self, table, field):
+        with self.db.connection() as conn:
+            key_column, fields = self._hash_schema(conn, table)
+            if field not in fields:
+                raise KeyError(field)
+            return [row[0] for row in conn.execute(f"SELECT {key_column} FROM {table} WHERE {field} IS NOT NULL")]
+
+    # lease
+    def _add(self, conn, table, key, value, ttl):
+        now = time.time()
+        cur = conn.execute(
+            f"INSERT INTO {table} (key, value, expires_at) VALUES (?, ?, ?) "
+            f"ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+            f"WHERE {table}.expires_at IS NOT NULL AND {table}.expires_at <= ?",
+            (key, value, now + ttl if ttl else None, now),
+        )
+        return cur.rowcount == 1
+
+    def add(self, table, key, value, ttl=None):
+        with self.db.connection() as conn:
+            t = self._table(conn, table, "lease")
+            with conn:
+                return self._add(conn, t, key, value, ttl)
+
+    def has(self, table, key):
+        with self.db.connection() as conn:
+            row = conn.execute(
+                f"SELECT 1 FROM {self._table(conn, table, 'lease')} "
+                f"WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, time.time()),
+            ).fetchone()
+        return row is not None
+
+    def delete_if(self, table, key, value):
+        with self.db.connection() as conn:
+            t = self._table(conn, table, "lease")
+            with conn:
+                return conn.execute(f"DELETE FROM {t} WHERE key = ? AND value = ?", (key, value)).rowcount == 1
+
+    def purge(self, table):
+        with self.db.connection() as conn:
+            t = self._table(conn, table, "lease")
+            with conn:
+                return conn.execute(f"DELETE FROM {t} WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def clear(self, table):
+        _ident(table)
+        with self.db.connection() as conn, conn:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)
+            ).fetchone()
+            if exists:
+                conn.execute(f"DELETE FROM {table}")
+
+    # event：同一條連線、同一個交易
+    def hlock(self, table, key, lock_table, owner, ttl, claim=None):
+        with self.db.connection() as conn:
+            lt = self._table(conn, lock_table, "lease")
+            ct = self._table(conn, claim[0], "lease") if claim else None
+            self._hash_schema(conn, table)
+            with conn:
+                if not self._add(conn, lt, key, owner, ttl):
+                    return False, None, None
+                claimed = self._add(conn, ct, claim[1], "1", claim[2]) if claim else None
+                return True, self._hgetall(conn, table, key), claimed
+
+    def hunlock(self, table, key, mapping, lock_table, owner):
+        with self.db.connection() as conn:
+            lt = self._table(conn, lock_table, "lease")
+            self._hash_schema(conn, table)
+            with conn:
+                if mapping:
+                    self._hset(conn, table, key, mapping)
+                conn.execute(f"DELETE FROM {lt} WHERE key = ? AND value = ?", (key, owner))
+
+
+# ────────────────────────────────
+# 2. 記憶體
+class MemoryBackend(Backend):
+    def __init__(self):
+        self._tables: dict[str, dict] = {}
+        self._hashes: dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def _t(self, table) -> dict:
+        return self._tables.setdefault(table, {})
+
+    # hash
+    def ensure_hash(self, table, fields, key_column="key"):
+        created = table not in self._hashes
+        self._hashes[table] = tuple(fields)
+        self._t(table)
+        return created
+
+    def hgetall(self, table, key):
+        return dict(self._t(table).get(key, {}))
+
+    def hset(self, table, key, mapping):
+        with self._lock:
+            row = self._t(table).setdefault(key, {})
+            for name, value in mapping.items():
+                if value is None:
+                    row.pop(name, None)
+                else:
+                    row[name] = value
+
+    def hkeys(self, table, field):
+        with self._lock:
+            return [k for k, row in self._t(table).items() if field in row]
+
+    # lease：value = (owner, expires_at)
+    def add(self, table, key, value, ttl=None):
+        now = time.time()
+        with self._lock:
+            t = self._t(table)
+            cur = t.get(key)
+            if cur is not None and (cur[1] is None or cur[1] > now):
+                return False
+            t[key] = (value, now + ttl if ttl else None)
+            return True
+
+    def has(self, table, key):
+        cur = self._t(table).get(key)
+        return cur is not None and (cur[1] is None or cur[1] > time.time())
+
+    def delete_if(self, table, key, value):
+        with self._lock:
+            t = self._t(table)
+            if key in t and t[key][0] == value:
+                del t[key]
+                return True
+            return False
+
+    def purge(self, table):
+        now = time.time()
+        with self._lock:
+            t = self._t(table)
+            expired = [k for k, (_, exp) in t.items() if exp is not None and exp <= now]
+            for k in expired:
+                del t[k]
+            return len(expired)
+
+    def clear(self, table):
+        with self._lock:
+            self._t(table).clear()
+
+
+# ────────────────────────────────
+# 3. 網路 KV（state server 的用戶端）
+class RemoteBackend(Backend):
+    """
+    以 newline-delimited JSON 與 state server 溝通：
+        → {"op": "hgetall", "args": ["user_profile", "U123"]}
+        ← {"result": ...}  或  {"error": "..."}
+    連線保持 keep-alive，用完放回池中；取出時先檢查對方是否已關閉，關閉的直接丟掉換新連線。
+    有 token 時每條新連線先送 auth。
+    """
+    def __init__(self, url: str = STATE_BACKEND_URL, timeout: float = STATE_BACKEND_TIMEOUT,
+                 max_idle: int = SHARED_SQLITE_POOL_SIZE, token: str = STATE_BACKEND_TOKEN):
+        parsed = urlparse(url)
+        self.address = (parsed.hostname or "127.0.0.1", parsed.port or 7379)
+        self.timeout = timeout
+        self.token = token
+        self.max_idle = max_idle
+        self._idle: list = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.create_connection(self.address, timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        f = sock.makefile("rwb")
+        if self.token:
+            try:
+                f.write((json.dumps({"op": "auth", "args": [self.token]}) + "\n").encode())
+                f.flush()
+                resp = json.loads(f.readline() or b"{}")
+            except BaseException:
+                sock.close()
+                raise
+            if "error" in resp or "result" not in resp:
+                sock.close()
+                raise StateBackendError(resp.get("error", "state server closed the connection during auth"))
+        return sock, f
+
+    def _dropped(self, sock) -> bool:
+        """池中的連線是否已被對方關閉（state server 重啟等）；不阻塞地偷看一個 byte"""
+        try:
+            sock.setblocking(False)
+            return sock.recv(1, socket.MSG_PEEK) == b""
+        except BlockingIOError:
+            return False
+        except OSError:
+            return True
+        finally:
+            sock.settimeout(self.timeout)
+
+    def _call(self, op, *args):
+        """
+        只有「請求還沒送出」時才換連線重送；送出後等回應逾時或斷線一律往上丟，
+        不重送，避免 add / hset 這類非冪等的操作被執行兩次。
+        """
+        line = (json.dumps({"op": op, "args": args}) + "\n").encode()
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is not None and self._dropped(conn[0]):
+                conn[0].close()
+                continue
+            try:
+                if conn is None:
+                    conn = self._connect()
+                conn[1].write(line)
+                conn[1].flush()
+            except OSError:
+                if conn is not None:
+                    conn[0].close()
+                raise
+            break
+        try:
+            raw = conn[1].readline()
+            if not raw:
+                raise ConnectionError("state server closed the connection")
+        except OSError:
+            conn[0].close()
+            raise
+        with self._lock:
+            keep = len(self._idle) < self.max_idle
+            if keep:
+                self._idle.append(conn)
+        if not keep:
+            conn[0].close()
+        resp = json.loads(raw)
+        if "error" in resp:
+            raise StateBackendError(resp["error"])
+        return resp["result"]
+
+for _op in OPS:
+    setattr(RemoteBackend, _op, lambda self, *args, _op=_op: self._call(_op, *args))
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def _reply(self, resp):
+        self.wfile.write((json.dumps(resp) + "\n").encode())
+        self.wfile.flush()
+
+    def _authenticate(self) -> bool:
+        """server 設了 token 時，第一個訊息必須是 auth 且 token 相符"""
+        token = self.server.token
+        if not token:
+            return True
+        try:
+            req = json.loads(self.rfile.readline() or b"{}")
+            args = req.get("args") or [""]
+            ok = req.get("op") == "auth" and hmac.compare_digest(str(args[0]).encode(), token.encode())
+        except Exception:
+            ok = False
+        self._reply({"result": True} if ok else {"error": "StateBackendError: authentication failed"})
+        return ok
+
+    def handle(self):
+        backend = self.server.backend
+        if not self._authenticate():
+            return
+        for raw in self.rfile:
+            try:
+                req = json.loads(raw)
+                if req.get("op") not in OPS:
+                    raise StateBackendError(f"unknown op {req.get('op')!r}")
+                resp = {"result": getattr(backend, req["op"])(*req.get("args", ()))}
+            except Exception as e:
+                resp = {"error": f"{type(e).__name__}: {e}"}
+            self._reply(resp)
+
+
+class StateServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, backend: Backend, token: str = STATE_BACKEND_TOKEN):
+        super().__init__(address, _Handler)
+        self.backend = backend
+        self.token = token
+
+
+def serve(host="127.0.0.1", port=7379, backend: Backend | None = None,
+          token: str = STATE_BACKEND_TOKEN) -> StateServer:
+    """在背景執行緒啟動 state server 並回傳（port=0 時由系統分配，見 server.server_address）"""
+    server = StateServer((host, port), backend or MemoryBackend(), token)
+    threading.Thread(target=server.serve_forever, daemon=True, name="state-server").start()
+    return server
+
+
+# ────────────────────────────────
+# 4. 依 STATE_BACKEND 取得後端
+_backends: dict[str, Backend] = {}
+_backends_lock = threading.Lock()
+
+def backend(db_path: str, kind: str = STATE_BACKEND) -> Backend:
+    """sqlite：每個 db 檔一個；memory / remote：整個行程共用一個"""
+    key = db_path if kind == "sqlite" else kind
+    with _backends_lock:
+        b = _backends.get(key)
+        if b is None:
+            if kind == "sqlite":
+                b = SQLiteBackend(db_path)
+            elif kind == "memory":
+                b = MemoryBackend()
+            elif kind == "remote":
+                b = RemoteBackend()
+            else:
+                raise ValueError(f"unknown STATE_BACKEND {kind!r}")
+            _backends[key] = b
+        return b
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="shared state server（STATE_BACKEND=remote 用）")
+    parser.add_argument("--host", default="127.0.0.1", help="只在私有網路內對外開放；非本機位址請搭配 --token")
+    parser.add_argument("--port", type=int, default=7379)
+    parser.add_argument("--db", help="存進這個 SQLite 檔；省略則只存在記憶體")
+    parser.add_argument("--token", default=STATE_BACKEND_TOKEN, help="共用密鑰（預設 STATE_BACKEND_TOKEN）")
+    opts = parser.parse_args()
+    if not opts.token and opts.host not in ("127.0.0.1", "localhost", "::1"):
+        print(f"⚠️ [state_backend] {opts.host} 沒有設定 --token，任何連得到這個 port 的人都能讀寫狀態")
+    server = StateServer((opts.host, opts.port), SQLiteBackend(opts.db) if opts.db else MemoryBackend(), opts.token)
+    print(f"[state_backend] serving on {opts.host}:{opts.port} ({'sqlite ' + opts.db if opts.db else 'memory'})")
+    server.serve_forever()
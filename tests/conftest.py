@@ -0,0 +1,14 @@
+# tests/conftest.py
+"""
+tests/conftest.py
+─────────────────
+pytest 共用設定：
+  • 專案根目錄加進 sys.path（模組都放在根目錄）
+  • shared 預設用 memory 後端，import 時不會在專案目錄建 user_state.db
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("STATE_BACKEND", "memory")
@@ -0,0 +1,48 @@
+# tests/test_model_registry.py
+"""
+model_registry：每個模型只載入一次、檔案變動後 hot-reload、重新載入失敗時沿用舊模型。
+"""
+import os
+import shutil
+
+import pytest
+
+import model_registry
+from conftest import ROOT
+
+PLAN_CSV = os.path.join(ROOT, "penghu_csv_file", "plan_2day.csv")
+
+
+@pytest.fixture
+def plan_csv(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_registry, "_models", {})
+    monkeypatch.setattr(model_registry, "_sources", {})
+    path = str(tmp_path / "plan_2day.csv")
+    shutil.copy(PLAN_CSV, path)
+    return path
+
+
+def test_loaded_once(plan_csv):
+    model = model_registry.plan_model(plan_csv)
+    assert model_registry.plan_model(plan_csv) is model
+    assert model_registry.reload_if_changed() == []
+    assert len(model.predict([[1, 30], [0, 45]])) == 2
+
+
+def test_reload_when_file_changes(plan_csv):
+    old = model_registry.plan_model(plan_csv)
+    stamp = os.path.getmtime(plan_csv) + 10
+    os.utime(plan_csv, (stamp, stamp))
+    assert model_registry.reload_if_changed() == [f"plan:{plan_csv}"]
+    fresh = model_registry.plan_model(plan_csv)
+    assert fresh is not old
+    assert fresh.version == stamp
+
+
+def test_failed_reload_keeps_old_model(plan_csv):
+    old = model_registry.plan_model(plan_csv)
+    with open(plan_csv, "w", encoding="utf-8") as f:
+        f.write("not,a,plan\n")
+    os.utime(plan_csv, (old.version + 10, old.version + 10))
+    assert model_registry.reload_if_changed() == []
+    assert model_registry.plan_model(plan_csv) is old
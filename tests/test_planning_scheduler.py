@@ -0,0 +1,129 @@
+# tests/test_planning_scheduler.py
+"""
+planning_scheduler：同一使用者的去重 / 改參數 / 後續工作、finishing 之後的請求、佇列滿。
+"""
+import threading
+
+import pytest
+
+import planning_scheduler as ps
+
+
+class Gate:
+    """工作開始時通知、等放行才結束，方便在「執行中」時送出請求"""
+    def __init__(self):
+        self.ran = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def job(self, value):
+        self.started.set()
+        assert self.release.wait(5)
+        self.ran.append(value)
+
+
+def _drain(scheduler, user_id="u"):
+    for _ in range(500):
+        if not scheduler.is_busy(user_id):
+            return
+        threading.Event().wait(0.01)
+    pytest.fail("scheduler did not finish")
+
+
+@pytest.fixture
+def gate():
+    g = Gate()
+    yield g
+    g.release.set()
+
+
+def test_duplicate_while_running(gate):
+    s = ps.PlanningScheduler(workers=1, max_queue=4)
+    assert s.submit("u", gate.job, "3", key="3") == ps.QUEUED
+    assert gate.started.wait(5)
+    assert s.submit("u", gate.job, "3", key="3") == ps.DUPLICATE
+    gate.release.set()
+    _drain(s)
+    assert gate.ran == ["3"]
+
+
+def test_followup_keeps_latest_args(gate):
+    s = ps.PlanningScheduler(workers=1, max_queue=4)
+    s.submit("u", gate.job, "3", key="3")
+    assert gate.started.wait(5)
+    assert s.submit("u", gate.job, "4", key="4") == ps.FOLLOWUP
+    assert s.submit("u", gate.job, "5", key="5") == ps.FOLLOWUP
+    assert s.depth() == 1
+    gate.release.set()
+    _drain(s)
+    assert gate.ran == ["3", "5"]
+
+
+def test_same_key_after_followup_cancels_it(gate):
+    s = ps.PlanningScheduler(workers=1, max_queue=4)
+    s.submit("u", gate.job, "3", key="3")
+    assert gate.started.wait(5)
+    s.submit("u", gate.job, "4", key="4")
+    assert s.submit("u", gate.job, "3", key="3") == ps.DUPLICATE     # 最新的要求就是執行中的這個
+    gate.release.set()
+    _drain(s)
+    assert gate.ran == ["3"]
+
+
+def test_pending_job_is_updated(gate):
+    s = ps.PlanningScheduler(workers=1, max_queue=4)
+    other = Gate()
+    other.release.set()
+    s.submit("busy", gate.job, "x")
+    assert gate.started.wait(5)
+    assert s.submit("u", other.job, "3", key="3") == ps.QUEUED
+    assert s.submit("u", other.job, "4", key="4") == ps.UPDATED
+    assert s.depth() == 1
+    gate.release.set()
+    _drain(s)
+    assert other.ran == ["4"]
+
+
+def test_submit_after_finishing_is_not_dropped():
+    s = ps.PlanningScheduler(workers=1, max_queue=4)
+    ran, results = [], []
+    finishing, resume = threading.Event(), threading.Event()
+
+    def job(days):
+        if not ran:
+            results.append(s.finishing("u"))    # 開始寫回結果
+            finishing.set()
+            assert resume.wait(5)
+        ran.append(days)
+
+    s.submit("u", job, "3", key="3")
+    assert finishing.wait(5)
+    # 寫回途中送來同樣的天數：要重跑一次，不能當成 DUPLICATE 丟掉
+    assert s.submit("u", job, "3", key="3") == ps.FOLLOWUP
+    assert s.finishing("u") is True
+    resume.set()
+    _drain(s)
+    assert results == [False]
+    assert ran == ["3", "3"]
+
+
+def test_rejected_when_queue_full(gate):
+    s = ps.PlanningScheduler(workers=1, max_queue=1)
+    s.submit("busy", gate.job, "x")
+    assert gate.started.wait(5)
+    assert s.submit("a", gate.job, "1") == ps.QUEUED
+    assert s.submit("b", gate.job, "1") == ps.REJECTED
+    assert not s.is_busy("b")
+
+
+def test_failing_job_does_not_stop_worker():
+    s = ps.PlanningScheduler(workers=1, max_queue=4)
+    ran = threading.Event()
+
+    def boom():
+        raise RuntimeError("boom")
+
+    s.submit("u", boom)
+    _drain(s)
+    s.submit("u", ran.set)
+    assert ran.wait(5)
@@ -0,0 +1,67 @@
+# tests/test_recommend_lookup.py
+"""
+recommend_lookup：查表結果與即時模型一致、網格外 / 版本不符退回 None、
+先查不到（尚未建表）建表後即可接上。
+"""
+import itertools
+
+import pytest
+
+import model_registry
+import recommend_lookup
+
+NAME = "recommend3"
+
+
+@pytest.fixture
+def lookup(tmp_path, monkeypatch):
+    monkeypatch.setattr(recommend_lookup, "MODEL_BUNDLE_DIR", str(tmp_path))
+    monkeypatch.setattr(recommend_lookup, "_tables", {})
+    return recommend_lookup
+
+
+@pytest.fixture(scope="module")
+def model():
+    return model_registry.get(NAME)
+
+
+def _rows(model):
+    weathers = model.weather_encoder.classes_.tolist()
+    return [list(r) for r in itertools.product(weathers, (-1, 0, 1), (7, 30, 65), (0, 2), (12, 28))]
+
+
+def test_miss_then_build(lookup, model):
+    row = _rows(model)[0]
+    assert lookup.rank(NAME, row) is None            # 還沒建表
+    lookup.build(NAME)
+    assert lookup.rank(NAME, row) == model.rank([row])[0]
+
+
+def test_matches_live_model(lookup, model):
+    lookup.build(NAME)
+    rows = _rows(model)
+    live = model.rank(rows)
+    for row, expected in zip(rows, live):
+        assert lookup.rank(NAME, row) == expected
+
+    exclude = set(live[0][:2])
+    k = min(5, len(model.classes) - len(exclude))
+    for row, expected in zip(rows, model.rank(rows, exclude, k)):
+        assert lookup.rank(NAME, row, exclude, k) == expected
+
+
+def test_outside_grid(lookup, model):
+    lookup.build(NAME)
+    weather = model.weather_encoder.classes_[0]
+    assert lookup.rank(NAME, [weather, 1, 200, 1, 25]) is None       # 年齡超出網格
+    assert lookup.rank(NAME, ["不存在的天氣", 1, 30, 1, 25]) is None
+    assert lookup.rank(NAME, [weather, 1, "abc", 1, 25]) is None
+    assert lookup.rank(NAME, [weather, 1, 30, 1, 25], k=len(model.classes) + 1) is None
+
+
+def test_stale_table_ignored(lookup, model, monkeypatch):
+    lookup.build(NAME)
+    row = _rows(model)[0]
+    assert lookup.rank(NAME, row) is not None
+    monkeypatch.setattr(model, "version", "newer")                    # 模型 hot-reload 後
+    assert lookup.rank(NAME, row) is None
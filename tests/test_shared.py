@@ -0,0 +1,169 @@
+# tests/test_shared.py
+"""
+shared：舊版一欄一表的資料併進 user_profile、巢狀 profile_scope、
+event_scope 每個事件兩次後端往返、ExpiringSet 到期。
+"""
+import threading
+import types
+
+import pytest
+
+import shared
+import state_backend
+
+
+class Counting:
+    """包住後端，記下每個操作（= remote 時的一次往返）"""
+    def __init__(self, inner):
+        self.inner = inner
+        self.calls = []
+
+    def __getattr__(self, name):
+        attr = getattr(self.inner, name)
+        if name not in state_backend.OPS:
+            return attr
+        def call(*args):
+            self.calls.append(name)
+            return attr(*args)
+        return call
+
+
+@pytest.fixture
+def sqlite_state(tmp_path, monkeypatch):
+    """把 shared 的單例換成全新的 sqlite 後端"""
+    backend = Counting(state_backend.SQLiteBackend(str(tmp_path / "user_state.db")))
+    monkeypatch.setattr(shared, "backend", backend)
+    monkeypatch.setattr(shared, "profiles_store", shared.ProfileStore(backend))
+    monkeypatch.setattr(shared, "used_reply_tokens",
+                        shared.ExpiringSet(60, backend=backend, table="used_reply_tokens"))
+    backend.calls.clear()
+    return backend
+
+
+# ─────────────── ProfileStore ───────────────
+def test_legacy_tables_imported_once(tmp_path):
+    path = str(tmp_path / "user_state.db")
+    backend = state_backend.SQLiteBackend(path)
+    with backend.db.connection() as conn, conn:
+        for name, rows in {"user_language": [("U1", '"en"'), ("U2", '"zh"')],
+                           "user_age":      [("U1", "30")]}.items():
+            conn.execute(f"CREATE TABLE {name} (key TEXT PRIMARY KEY, value TEXT)")
+            conn.executemany(f"INSERT INTO {name} VALUES (?, ?)", rows)
+
+    store = shared.ProfileStore(backend)
+    u1 = store.load("U1")
+    assert (u1.language, u1.age, u1.stage) == ("en", 30, "ask_language")
+    assert store.load("U2").language == "zh"
+    assert sorted(store.user_ids("language")) == ["U1", "U2"]
+
+    # 已經有 user_profile：不再匯入，不會蓋掉新值
+    u1.set("language", "ja")
+    store.save(u1)
+    store = shared.ProfileStore(state_backend.SQLiteBackend(path))
+    assert store.load("U1").language == "ja"
+
+
+def test_save_only_dirty_fields(sqlite_state):
+    store = shared.profiles_store
+    profile = store.load("U1")
+    profile.set("age", 41)
+    profile.set("location", None)
+    store.save(profile)
+    assert sqlite_state.inner.hgetall("user_profile", "U1") == {"age": "41"}
+    assert not profile.dirty
+    sqlite_state.calls.clear()
+    store.save(profile)                     # 沒有變動：不打後端
+    assert sqlite_state.calls == []
+
+
+# ─────────────── profile_scope / event_scope ───────────────
+def test_nested_profile_scope_shares_one_profile(sqlite_state):
+    with shared.profile_scope("U1") as outer:
+        shared.user_stage["U1"] = "got_age"
+        with shared.profile_scope("U1") as inner:
+            assert inner is outer
+            shared.user_age["U1"] = 25
+        assert sqlite_state.calls == ["hgetall"]        # 內層離開時不寫回
+        assert shared.user_age["U1"] == 25
+    assert sqlite_state.calls == ["hgetall", "hset"]
+    assert (shared.user_stage["U1"], shared.user_age["U1"]) == ("got_age", 25)
+
+
+def test_profile_scope_is_per_thread(sqlite_state):
+    seen = []
+    with shared.profile_scope("U1") as profile:
+        profile.set("stage", "mine")
+        t = threading.Thread(target=lambda: seen.append(shared.user_stage["U1"]))
+        t.start()
+        t.join()
+    assert seen == ["ask_language"]         # 別的執行緒看不到尚未寫回的變動
+
+
+def test_event_scope_two_round_trips(sqlite_state):
+    with shared.event_scope("U1", "tok-1") as profile:
+        profile.set("stage", "ask_age")
+        assert shared.claim_reply_token("tok-1") is True
+        assert shared.claim_reply_token("tok-1") is False        # 同一事件內只能用一次
+    assert sqlite_state.calls == ["hlock", "hunlock"]
+    assert shared.profiles_store.load("U1").stage == "ask_age"
+    assert sqlite_state.inner.has("user_event_lock", "U1") is False
+
+    # 同一個 token 再來一次（LINE 重送）：登記失敗，不能回覆
+    with shared.event_scope("U1", "tok-1"):
+        assert shared.claim_reply_token("tok-1") is False
+
+
+def test_event_scope_serializes_same_user(sqlite_state):
+    order = []
+    entered = threading.Event()
+
+    def second():
+        entered.wait()
+        with shared.event_scope("U1"):
+            order.append("second")
+
+    t = threading.Thread(target=second)
+    t.start()
+    with shared.event_scope("U1"):
+        entered.set()
+        t.join(0.2)
+        order.append("first")
+    t.join()
+    assert order == ["first", "second"]
+
+
+def test_event_scope_releases_lock_on_error(sqlite_state):
+    with pytest.raises(RuntimeError):
+        with shared.event_scope("U1") as profile:
+            profile.set("age", 30)
+            raise RuntimeError("boom")
+    assert shared.profiles_store.load("U1").age == 30
+    assert sqlite_state.inner.has("user_event_lock", "U1") is False
+
+
+# ─────────────── ExpiringSet ───────────────
+def test_expiring_set_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(shared, "time", types.SimpleNamespace(monotonic=lambda: now[0]))
+    tokens = shared.ExpiringSet(10, buckets=5)          # 每桶 2 秒：存活 10～12 秒
+
+    assert tokens.add("a") is True
+    assert tokens.add("a") is False
+    now[0] += 9.9
+    assert "a" in tokens
+    assert tokens.add("a") is False
+    now[0] += 2.2
+    assert "a" not in tokens
+    assert len(tokens) == 0
+    assert tokens.add("a") is True
+
+
+def test_expiring_set_shared_through_backend(tmp_path):
+    backend = state_backend.SQLiteBackend(str(tmp_path / "user_state.db"))
+    one = shared.ExpiringSet(60, backend=backend, table="used_reply_tokens")
+    two = shared.ExpiringSet(60, backend=backend, table="used_reply_tokens")   # 另一個 worker
+    assert one.add("tok") is True
+    assert "tok" in two
+    assert two.add("tok") is False
+    two.clear()
+    assert "tok" not in two
@@ -0,0 +1,188 @@
+# tests/test_state_backend.py
+"""
+state_backend：memory / sqlite / remote 三種後端行為一致、token 驗證、
+state server 重啟後重連、送出後逾時不重送、表名檢查。
+"""
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+import state_backend
+from conftest import ROOT
+
+
+@pytest.fixture
+def server():
+    srv = state_backend.serve(port=0, backend=state_backend.MemoryBackend(), token="")
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def _url(srv):
+    return f"tcp://127.0.0.1:{srv.server_address[1]}"
+
+
+@pytest.fixture(params=["memory", "sqlite", "remote"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return state_backend.MemoryBackend()
+    if request.param == "sqlite":
+        return state_backend.SQLiteBackend(str(tmp_path / "state.db"))
+    srv = state_backend.serve(port=0, backend=state_backend.SQLiteBackend(str(tmp_path / "state.db")), token="")
+    request.addfinalizer(srv.server_close)
+    request.addfinalizer(srv.shutdown)
+    return state_backend.RemoteBackend(_url(srv), timeout=2, token="")
+
+
+# ─────────────── 三種後端行為一致 ───────────────
+def test_hash_roundtrip(backend):
+    assert backend.ensure_hash("profile", ("stage", "age"), "user_id") is True
+    assert backend.ensure_hash("profile", ("stage", "age"), "user_id") is False
+    assert backend.hgetall("profile", "U1") == {}
+    backend.hset("profile", "U1", {"stage": '"ask_age"'})
+    backend.hset("profile", "U1", {"age": "30"})
+    backend.hset("profile", "U2", {"stage": None})
+    assert backend.hgetall("profile", "U1") == {"stage": '"ask_age"', "age": "30"}
+    assert backend.hgetall("profile", "U2") == {}
+    assert sorted(backend.hkeys("profile", "stage")) == ["U1"]
+
+
+def test_lease(backend):
+    assert backend.add("lock", "k", "a", 5) is True
+    assert backend.add("lock", "k", "b", 5) is False
+    assert backend.has("lock", "k") is True
+    assert backend.delete_if("lock", "k", "b") is False
+    assert backend.delete_if("lock", "k", "a") is True
+    assert backend.has("lock", "k") is False
+
+    assert backend.add("lock", "short", "a", 0.05) is True
+    time.sleep(0.1)
+    assert backend.has("lock", "short") is False
+    assert backend.add("lock", "short", "b", 5) is True      # 過期的租約可以被搶走
+    assert backend.purge("lock") == 0
+    backend.clear("lock")
+    assert backend.has("lock", "short") is False
+
+
+def test_hlock_hunlock(backend):
+    backend.ensure_hash("profile", ("stage",), "user_id")
+    backend.hset("profile", "U1", {"stage": '"x"'})
+
+    locked, row, claimed = backend.hlock("profile", "U1", "lock", "o1", 5, ("tokens", "t1", 60))
+    assert (locked, row, claimed) == (True, {"stage": '"x"'}, True)
+    assert backend.hlock("profile", "U1", "lock", "o2", 5, None)[0] is False
+
+    backend.hunlock("profile", "U1", {"stage": '"y"'}, "lock", "o1")
+    locked, row, claimed = backend.hlock("profile", "U1", "lock", "o2", 5, ("tokens", "t1", 60))
+    assert (locked, row, claimed) == (True, {"stage": '"y"'}, False)   # token 已經用過
+    backend.hunlock("profile", "U1", {}, "lock", "o2")
+    assert backend.has("lock", "U1") is False
+
+
+def test_identifier_validation(backend):
+    if isinstance(backend, state_backend.MemoryBackend):
+        pytest.skip("memory 後端不拼 SQL，表名不檢查")
+    for bad in ("x; DROP TABLE y", "a b", "a--", "x)"):
+        with pytest.raises((ValueError, state_backend.StateBackendError)):
+            backend.ensure_hash(bad, ("stage",))
+        with pytest.raises((ValueError, state_backend.StateBackendError)):
+            backend.ensure_hash("ok", (bad,))
+
+
+def test_sqlite_hash_schema_survives_restart(tmp_path):
+    path = str(tmp_path / "state.db")
+    state_backend.SQLiteBackend(path).ensure_hash("profile", ("stage", "age"), "user_id")
+    fresh = state_backend.SQLiteBackend(path)       # 沒有呼叫 ensure_hash，從 PRAGMA 重建
+    fresh.hset("profile", "U1", {"age": "41"})
+    assert fresh.hgetall("profile", "U1") == {"age": "41"}
+
+
+# ─────────────── remote ───────────────
+def test_auth(tmp_path):
+    srv = state_backend.serve(port=0, backend=state_backend.MemoryBackend(), token="s3cret")
+    try:
+        good = state_backend.RemoteBackend(_url(srv), timeout=2, token="s3cret")
+        assert good.add("t", "k", "v", 5) is True
+        for token in ("wrong", ""):
+            bad = state_backend.RemoteBackend(_url(srv), timeout=2, token=token)
+            with pytest.raises((state_backend.StateBackendError, OSError)):
+                bad.has("t", "k")
+    finally:
+        srv.shutdown()
+        srv.server_close()
+
+
+def test_unknown_op_rejected(server):
+    client = state_backend.RemoteBackend(_url(server), timeout=2, token="")
+    with pytest.raises(state_backend.StateBackendError, match="unknown op"):
+        client._call("__init__")
+
+
+def test_no_replay_after_timeout():
+    class Slow(state_backend.MemoryBackend):
+        calls = 0
+
+        def add(self, *args):
+            Slow.calls += 1
+            result = super().add(*args)
+            time.sleep(0.5)
+            return result
+
+    srv = state_backend.serve(port=0, backend=Slow(), token="")
+    try:
+        client = state_backend.RemoteBackend(_url(srv), timeout=0.2, token="")
+        client.has("t", "x")                        # 先放一條連線進池
+        with pytest.raises(OSError):
+            client.add("t", "k", "v", 10)
+        time.sleep(0.6)
+        assert Slow.calls == 1
+        client.timeout = 2
+        assert client.has("t", "k") is True
+    finally:
+        srv.shutdown()
+        srv.server_close()
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start(port, db):
+    proc = subprocess.Popen(
+        [sys.executable, "state_backend.py", "--port", str(port), "--db", db, "--token", ""],
+        cwd=ROOT, stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    pytest.fail("state server did not start")
+
+
+def test_reconnect_after_server_restart(tmp_path):
+    port, db = _free_port(), str(tmp_path / "state.db")
+    proc = _start(port, db)
+    try:
+        client = state_backend.RemoteBackend(f"tcp://127.0.0.1:{port}", timeout=2, token="")
+        client.ensure_hash("profile", ("stage",), "user_id")
+        client.hset("profile", "U1", {"stage": '"a"'})
+        proc.kill()
+        proc.wait()
+        proc = _start(port, db)
+        # 池中那條連線已被關閉：換新連線，不拋錯；hash schema 由新的 server 從 PRAGMA 重建
+        assert client.hgetall("profile", "U1") == {"stage": '"a"'}
+        client.hset("profile", "U1", {"stage": '"b"'})
+        assert client.hgetall("profile", "U1") == {"stage": '"b"'}
+    finally:
+        proc.kill()
+        proc.wait()
@@ -119,7 +119,7 @@ if not CSV_PATH.exists():
 # 4. 全域併發狀態 & 行程後綴
 # ────────────────────────────────────────────────
 _current_option: str | None = None  # 行程天數後綴
-_fn_active = Counter()  # 併發計數
+_fn_active = Counter()  # 併發計數（每個 worker 行程各自一份；重啟即歸零，不跨行程累加）
 _lock = threading.Lock()
 
 _SUFFIX_FUNCS = {
@@ -107,6 +107,7 @@ TEXTS: dict[str, dict[str, object]] = {
         # 規劃結果通知（已加入）
         "planning_completed":  "✅ 行程規劃完成！",
         "planning_failed":     "❌ 行程規劃失敗，請稍後再試。",
+        "planning_busy":       "⏳ 目前規劃的人數太多，請稍後再試。",
 
         # 景點推薦
         "yes": "是",
@@ -166,6 +167,7 @@ TEXTS: dict[str, dict[str, object]] = {
         # 規劃結果通知（已加入）
         "planning_completed":  "✅ Your itinerary is ready.",
         "planning_failed":     "❌ Itinerary planning failed. Please try again later.",
+        "planning_busy":       "⏳ Too many itineraries are being planned right now. Please try again later.",
 
         # 景點推薦
         "yes": "yes",